@@ -6,11 +6,49 @@ import tempfile
 
 import logging
 
+import math
+
 import asyncio
 
-from datetime import datetime, timedelta, timezone
+import contextvars
+
+import functools
+
+import hashlib
+
+import heapq
+
+import hmac
+
+import multiprocessing
+
+import random
+
+import re
+
+import sys
+
+import threading
+
+import time
+
+import traceback
+
+import unicodedata
+
+import zlib
+
+from array import array
+
+from bisect import bisect_left
 
-from aiohttp import web
+from collections import OrderedDict, defaultdict, deque
+
+from operator import itemgetter
+
+from datetime import date, datetime, timedelta, timezone
+
+from aiohttp import ClientSession, web
 
 from telegram import (
 
@@ -26,8 +64,14 @@ from telegram import (
 
     InputMediaPhoto,
 
+    InlineQueryResultCachedPhoto,
+
 )
 
+from telegram.error import BadRequest
+
+from telegram.request import BaseRequest, HTTPXRequest
+
 from telegram.ext import (
 
     Application,
@@ -36,6 +80,10 @@ from telegram.ext import (
 
     CallbackQueryHandler,
 
+    ChatMemberHandler,
+
+    InlineQueryHandler,
+
     MessageHandler,
 
     ContextTypes,
@@ -52,6 +100,32 @@ from firebase_admin import credentials, firestore
 
 
 
+# NumPy es opcional: solo acelera la exportación del contador compacto de vistas
+
+try:
+
+    import numpy as np
+
+except ImportError:
+
+    np = None
+
+
+
+# Decoder JSON rápido para el webhook (orjson si está instalado)
+
+try:
+
+    import orjson
+
+    json_loads = orjson.loads
+
+except ImportError:
+
+    json_loads = json.loads
+
+
+
 # --- Inicializar Firestore con variable de entorno JSON doblemente serializada ---
 
 google_credentials_raw = os.getenv("GOOGLE_APPLICATION_CREDENTIALS_JSON")
@@ -96,1825 +170,6997 @@ APP_URL = os.getenv("APP_URL")
 
 PORT = int(os.getenv("PORT", "8080"))
 
+# Secret token que Telegram envía en cada webhook (por defecto derivado del TOKEN)
 
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
 
-if not TOKEN:
+# Updates pendientes como máximo (en cola, esperando turno o en su handler) y política
 
-    raise ValueError("❌ ERROR: La variable de entorno TOKEN no está configurada.")
+# cuando se llega al límite (reject | drop_new | drop_oldest)
 
-if not APP_URL:
+UPDATE_QUEUE_MAXSIZE = int(os.getenv("UPDATE_QUEUE_MAXSIZE", "1000"))
 
-    raise ValueError("❌ ERROR: La variable de entorno APP_URL no está configurada.")
+UPDATE_QUEUE_OVERFLOW = os.getenv("UPDATE_QUEUE_OVERFLOW", "reject")
 
+# Tipos de update que se piden a Telegram: el resto ni siquiera llega al webhook
 
+ALLOWED_UPDATES = ["message", "callback_query", "pre_checkout_query", "my_chat_member", "inline_query"]
 
-# --- Logging ---
+# Handlers ejecutándose en paralelo (entre usuarios distintos)
 
-logging.basicConfig(level=logging.INFO)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "32"))
 
-logger = logging.getLogger(__name__)
+# Ventana de deduplicación de reentregas del webhook (update_ids recordados y segundos)
 
+UPDATE_DEDUP_SIZE = int(os.getenv("UPDATE_DEDUP_SIZE", "10000"))
 
+UPDATE_DEDUP_TTL = int(os.getenv("UPDATE_DEDUP_TTL", "600"))
 
-# --- Variables en memoria ---
+# Modo multiproceso: con más de 1 worker, un router en PORT reparte los updates por usuario
 
-# MODIFICADO: Ahora user_premium guarda un diccionario {expire_at: datetime, plan_type: str}
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
 
-user_premium = {}          # {user_id: {expire_at: datetime, plan_type: str}}
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", str(PORT + 1)))
 
-user_daily_views = {}      # {user_id: {date: count}}
+# URL base de la Bot API (vacío = api.telegram.org; útil para un servidor Bot API local)
 
-content_packages = {}      # {pkg_id: {photo_id, caption, video_id}}
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").rstrip("/")
 
-known_chats = set()
+# Expiración de planes: cada cuánto se revisa, tamaño de lote y avisos previos (días)
 
-current_photo = {}
+EXPIRY_CHECK_INTERVAL = int(os.getenv("EXPIRY_CHECK_INTERVAL", "60"))
 
-series_data = {}           # {serie_id: {"title", "photo_id", "caption", "capitulos": [video_id, ...], ...}}
+EXPIRY_BATCH_SIZE = int(os.getenv("EXPIRY_BATCH_SIZE", "200"))
 
-current_series = {}        # {user_id: {"title", "photo_id", "caption", "serie_id", "capitulos": []}}
+EXPIRY_NOTICE_DAYS = [int(d) for d in os.getenv("EXPIRY_NOTICE_DAYS", "3,1").split(",") if d.strip()]
 
+EXPIRY_NOTICE_RATE = float(os.getenv("EXPIRY_NOTICE_RATE", "20"))  # avisos por segundo como máximo
 
+# Contador de vistas diarias: "records" (en cada UserRecord) o "compact" (columnas en arrays,
 
-# --- Firestore colecciones ---
+# para cientos de miles de usuarios en poca RAM)
 
-COLLECTION_USERS = "users_premium"
+VIEW_COUNTER_STORE = os.getenv("VIEW_COUNTER_STORE", "records")
 
-COLLECTION_VIDEOS = "videos"
+# Reserva de vistas: "local" (una instancia, el proceso es dueño del usuario) o
 
-COLLECTION_VIEWS = "user_daily_views"
+# "transaction" (varias instancias contra el mismo Firestore)
 
-COLLECTION_CHATS = "known_chats"
+QUOTA_MODE = os.getenv("QUOTA_MODE", "local")
 
-COLLECTION_SERIES = "series_data"
+# Límite de callbacks por usuario (token bucket): recarga por segundo y ráfaga máxima
 
+CALLBACK_RATE = float(os.getenv("CALLBACK_RATE", "1"))
 
+CALLBACK_BURST = int(os.getenv("CALLBACK_BURST", "5"))
 
-# --- Funciones Firestore (Síncronas) ---
+# Updates pendientes por usuario como máximo (los pagos y los administradores no se limitan)
 
-def save_user_premium_firestore():
+USER_PENDING_MAX = int(os.getenv("USER_PENDING_MAX", "10"))
 
-    batch = db.batch()
+# Updates pendientes a partir de los cuales se aplaza el trabajo no crítico
 
-    for uid, data in user_premium.items(): # MODIFICADO: 'data' ahora es un dict
+ADMISSION_QUEUE_HIGH = int(os.getenv("ADMISSION_QUEUE_HIGH", str(UPDATE_QUEUE_MAXSIZE // 2)))
 
-        doc_ref = db.collection(COLLECTION_USERS).document(str(uid))
+# Búsqueda inline: segundos que Telegram cachea cada respuesta y consultas cacheadas en memoria
 
-        exp = data["expire_at"]
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "300"))
 
-        if exp.tzinfo is None:
+INLINE_CACHE_SIZE = int(os.getenv("INLINE_CACHE_SIZE", "1024"))
 
-            batch.set(doc_ref, {"expire_at": exp.replace(tzinfo=timezone.utc).isoformat(), "plan_type": data["plan_type"]}) # MODIFICADO: Guardar plan_type
+# Con varios workers: cada cuántos segundos se añade a la búsqueda inline y a /catalogo el
 
-        else:
+# contenido publicado en otros procesos (0 = solo al reiniciar)
 
-            batch.set(doc_ref, {"expire_at": exp.isoformat(), "plan_type": data["plan_type"]}) # MODIFICADO: Guardar plan_type
+CATALOG_REFRESH_INTERVAL = int(os.getenv("CATALOG_REFRESH_INTERVAL", "30"))
 
-    batch.commit()
+# Instancia en el nodo de los ids de contenido (10 bits, los bajos se reservan al índice de
 
+# worker): distinta por instancia si hay varias contra el mismo Firestore (vacío = aleatoria)
 
+NODE_ID = os.getenv("NODE_ID", "")
 
-def load_user_premium_firestore():
+# Segundos sin recibir más videos tras los que se cierra un álbum o lote reenviado de capítulos
 
-    docs = db.collection(COLLECTION_USERS).stream()
+ALBUM_FLUSH_DELAY = float(os.getenv("ALBUM_FLUSH_DELAY", "1.5"))
 
-    result = {}
+# Trazas por update en JSONL (vacío = desactivado): se guardan las lentas y una muestra del resto
 
-    for doc in docs:
+TRACE_FILE = os.getenv("TRACE_FILE", "")
 
-        data = doc.to_dict()
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "1000"))
 
-        try:
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
 
-            expire_at_str = data.get("expire_at")
+# Monitor de retraso del event loop: segundos entre muestras (0 = desactivado) y umbral
 
-            plan_type = data.get("plan_type", "premium_legacy") # MODIFICADO: Cargar plan_type, default para compatibilidad
+# a partir del cual se captura y registra la pila de lo que bloquea el loop
 
-            if expire_at_str:
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))
 
-                expire_at = datetime.fromisoformat(expire_at_str)
+LOOP_LAG_THRESHOLD_MS = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "250"))
 
-                if expire_at.tzinfo is None:
+# Profiler por muestreo (desactivado si ambos son 0): updates más lentos que PROFILE_SLOW_MS
 
-                    expire_at = expire_at.replace(tzinfo=timezone.utc)
+# y una fracción PROFILE_SAMPLE_RATE del resto; se vuelca con GET /profile (cabecera X-Admin-Token)
 
-                result[int(doc.id)] = {"expire_at": expire_at, "plan_type": plan_type} # MODIFICADO: Guardar como dict
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
 
-        except Exception as e:
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
 
-            logger.error(f"Error al cargar fecha premium para {doc.id}: {e}")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
 
-            pass
+PROFILE_DIR = os.getenv("PROFILE_DIR", tempfile.gettempdir())
 
-    return result
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
 
+# Grabación anonimizada de los updates del webhook en JSONL (vacío = desactivada); en modo
 
+# multiproceso cada worker escribe en <archivo>.<n>. La sal fija los seudónimos de los ids
 
-def save_videos_firestore():
+# entre reinicios (sin ella se genera una aleatoria por proceso)
 
-    batch = db.batch()
+WEBHOOK_RECORD_FILE = os.getenv("WEBHOOK_RECORD_FILE", "")
 
-    for pkg_id, content in content_packages.items():
+WEBHOOK_RECORD_SALT = os.getenv("WEBHOOK_RECORD_SALT", "")
 
-        doc_ref = db.collection(COLLECTION_VIDEOS).document(pkg_id)
+# Administradores (ids separados por comas) que pueden usar /top y /stats
 
-        batch.set(doc_ref, content)
+ADMIN_IDS = {int(uid) for uid in os.getenv("ADMIN_IDS", "").split(",") if uid.strip()}
 
-    batch.commit()
+# Cada cuántos segundos se guardan en Firestore las vistas acumuladas por contenido
 
+STATS_FLUSH_INTERVAL = int(os.getenv("STATS_FLUSH_INTERVAL", "60"))
 
+# Cada cuántos segundos se contrastan los agregados de /stats con un recuento completo
 
-def load_videos_firestore():
+STATS_RECOUNT_INTERVAL = int(os.getenv("STATS_RECOUNT_INTERVAL", "3600"))
 
-    docs = db.collection(COLLECTION_VIDEOS).stream()
+# Elementos por página en /catalogo
 
-    result = {}
+CATALOG_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", "8"))
 
-    for doc in docs:
 
-        result[doc.id] = doc.to_dict()
 
-    return result
+if not TOKEN:
 
+    raise ValueError("❌ ERROR: La variable de entorno TOKEN no está configurada.")
 
+if not APP_URL:
 
-def save_user_daily_views_firestore():
+    raise ValueError("❌ ERROR: La variable de entorno APP_URL no está configurada.")
 
-    batch = db.batch()
+if VIEW_COUNTER_STORE not in ("records", "compact"):
 
-    for uid, views in user_daily_views.items():
+    raise ValueError("❌ ERROR: VIEW_COUNTER_STORE debe ser 'records' o 'compact'.")
 
-        doc_ref = db.collection(COLLECTION_VIEWS).document(uid)
+if QUOTA_MODE not in ("local", "transaction"):
 
-        batch.set(doc_ref, views)
+    raise ValueError("❌ ERROR: QUOTA_MODE debe ser 'local' o 'transaction'.")
 
-    batch.commit()
+if not 1 <= WEB_WORKERS <= 1024:
 
+    raise ValueError("❌ ERROR: WEB_WORKERS debe estar entre 1 y 1024.")
 
+if NODE_ID and not (NODE_ID.isdigit() and int(NODE_ID) < 1024 >> (WEB_WORKERS - 1).bit_length()):
 
-def load_user_daily_views_firestore():
+    raise ValueError(
 
-    docs = db.collection(COLLECTION_VIEWS).stream()
+        f"❌ ERROR: NODE_ID debe ser un entero entre 0 y {(1024 >> (WEB_WORKERS - 1).bit_length()) - 1} con {WEB_WORKERS} workers."
 
-    result = {}
+    )
 
-    for doc in docs:
+if PROFILE_INTERVAL_MS <= 0:
 
-        result[doc.id] = doc.to_dict()
+    raise ValueError("❌ ERROR: PROFILE_INTERVAL_MS debe ser mayor que 0.")
 
-    return result
+if UPDATE_QUEUE_OVERFLOW not in ("reject", "drop_new", "drop_oldest"):
 
+    raise ValueError("❌ ERROR: UPDATE_QUEUE_OVERFLOW debe ser 'reject', 'drop_new' o 'drop_oldest'.")
 
+if not WEBHOOK_SECRET:
 
-def save_known_chats_firestore():
+    WEBHOOK_SECRET = hashlib.sha256(TOKEN.encode()).hexdigest()
 
-    doc_ref = db.collection(COLLECTION_CHATS).document("chats")
 
-    doc_ref.set({"chat_ids": list(known_chats)})
 
+# --- Logging ---
 
+logging.basicConfig(level=logging.INFO)
 
-def load_known_chats_firestore():
+logger = logging.getLogger(__name__)
 
-    doc_ref = db.collection(COLLECTION_CHATS).document("chats")
 
-    doc = doc_ref.get()
 
-    if doc.exists:
+# --- Métricas (formato Prometheus) ---
 
-        data = doc.to_dict()
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
 
-        return set(data.get("chat_ids", []))
 
-    return set()
 
+class MetricHistogram:
 
+    """Histograma con una etiqueta; observe() es un bisect y dos sumas."""
 
-def save_series_firestore():
 
-    batch = db.batch()
 
-    for serie_id, serie in series_data.items():
+    def __init__(self, name, help_text, label, buckets=LATENCY_BUCKETS):
 
-        doc_ref = db.collection(COLLECTION_SERIES).document(serie_id)
+        self.name = name
 
-        batch.set(doc_ref, serie)
+        self.help = help_text
 
-    batch.commit()
+        self.label = label
 
+        self.buckets = buckets
 
+        self.series = {}  # {valor de la etiqueta: [conteos por bucket (+Inf al final), suma]}
 
-def load_series_firestore():
 
-    docs = db.collection(COLLECTION_SERIES).stream()
 
-    result = {}
+    def observe(self, label_value, seconds):
 
-    for doc in docs:
+        series = self.series.get(label_value)
 
-        result[doc.id] = doc.to_dict()
+        if series is None:
 
-    return result
+            series = self.series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
 
+        series[0][bisect_left(self.buckets, seconds)] += 1
 
+        series[1] += seconds
 
-# --- Guardar y cargar todo ---
 
-def save_data():
 
-    save_user_premium_firestore()
+    def render(self):
 
-    save_videos_firestore()
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
 
-    save_user_daily_views_firestore()
+        for value, (counts, total) in sorted(self.series.items()):
 
-    save_known_chats_firestore()
+            label = f'{self.label}="{value}"'
 
-    save_series_firestore()
+            cumulative = 0
 
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
 
+                cumulative += count
 
-def load_data():
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
 
-    global user_premium, content_packages, user_daily_views, known_chats, series_data
+            lines.append(f"{self.name}_sum{{{label}}} {total}")
 
-    user_premium = load_user_premium_firestore()
+            lines.append(f"{self.name}_count{{{label}}} {cumulative}")
 
-    content_packages = load_videos_firestore()
+        return lines
 
-    user_daily_views = load_user_daily_views_firestore()
 
-    known_chats = load_known_chats_firestore()
 
-    series_data = load_series_firestore()
+class MetricCounter:
 
+    """Contador con una o varias etiquetas (label: nombre o tupla de nombres)."""
 
 
-# --- Planes ---
 
-FREE_LIMIT_VIDEOS = 89
+    def __init__(self, name, help_text, label):
 
-PRO_LIMIT_VIDEOS = 50
+        self.name = name
 
-PLAN_PRO_ITEM = {
+        self.help = help_text
 
-    "title": "Plan Pro",
+        self.labels = (label,) if isinstance(label, str) else label
 
-    "description": "50 videos diarios, sin reenvíos ni compartir.",
+        self.values = {}  # {valor o tupla de valores: total}
 
-    "payload": "plan_pro", # Usado como plan_type
 
-    "currency": "XTR",
 
-    "prices": [LabeledPrice("Plan Pro por 30 días", 1)],
+    def inc(self, label_value, amount=1):
 
-}
+        self.values[label_value] = self.values.get(label_value, 0) + amount
 
-PLAN_ULTRA_ITEM = {
 
-    "title": "Plan Ultra",
 
-    "description": "Videos y reenvíos ilimitados, sin restricciones.",
+    def render(self):
 
-    "payload": "plan_ultra", # Usado como plan_type
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
 
-    "currency": "XTR",
+        for value, total in sorted(self.values.items()):
 
-    "prices": [LabeledPrice("Plan Ultra por 30 días", 1)],
+            values = value if isinstance(value, tuple) else (value,)
 
-}
+            labels = ",".join(f'{label}="{v}"' for label, v in zip(self.labels, values))
 
+            lines.append(f"{self.name}{{{labels}}} {total}")
 
+        return lines
 
-# --- Control acceso (MODIFICADO) ---
 
-def is_premium(user_id):
 
-    # Verifica si el usuario tiene CUALQUIER plan pago activo.
+queue_wait_seconds = MetricHistogram("bot_update_queue_wait_seconds", "Del webhook al inicio del handler", "type")
 
-    if user_id in user_premium:
+handler_seconds = MetricHistogram("bot_handler_seconds", "Duración del procesamiento por handler", "handler")
 
-        user_plan_data = user_premium[user_id]
+bot_api_seconds = MetricHistogram("bot_api_request_seconds", "Latencia de la Bot API por método", "method")
 
-        if isinstance(user_plan_data, dict) and "expire_at" in user_plan_data:
+storage_seconds = MetricHistogram("bot_storage_seconds", "Latencia de Firestore por operación", "op")
 
-            return user_plan_data["expire_at"] > datetime.now(timezone.utc)
+errors_total = MetricCounter("bot_errors_total", "Errores por origen", "source")
 
-        # Compatibilidad con versiones antiguas donde user_premium[user_id] era solo la fecha
+rate_limited_total = MetricCounter("bot_rate_limited_total", "Límites de frecuencia aplicados o recibidos", "source")
 
-        elif isinstance(user_plan_data, datetime):
+storage_ops_total = MetricCounter("bot_storage_ops_total", "Operaciones de Firestore por handler", ("handler", "kind"))
 
-            return user_plan_data > datetime.now(timezone.utc)
+stats_drift_total = MetricCounter("bot_admin_stats_drift_total", "Diferencias de /stats frente al recuento completo", "stat")
 
-    return False
+loop_blocked_total = MetricCounter("bot_event_loop_blocked_total", "Bloqueos del event loop sobre el umbral por handler", "handler")
 
 
 
-def get_user_plan_type(user_id):
+# --- Trazas por update ---
 
-    # Obtiene el tipo de plan actual del usuario.
+class Trace:
 
-    if is_premium(user_id):
+    """Spans de un update: (nombre, inicio, fin) en perf_counter, desde que llega al webhook."""
 
-        user_plan_data = user_premium[user_id]
 
-        if isinstance(user_plan_data, dict) and "plan_type" in user_plan_data:
 
-            return user_plan_data["plan_type"]
+    __slots__ = ("trace_id", "update_id", "started", "spans")
 
-        # Compatibilidad: si es premium pero no tiene 'plan_type', asumir "premium_legacy" o "ultra"
 
-        return "plan_ultra" # Asumir Ultra para planes antiguos sin tipo explícito
 
-    return "free"
+    def __init__(self, update_id, started):
 
+        self.trace_id = os.urandom(8).hex()
 
+        self.update_id = update_id
 
-def can_resend_content(user_id):
+        self.started = started
 
-    # SOLO el plan "ultra" (o "premium_legacy" para compatibilidad) permite reenviar.
+        self.spans = []
 
-    plan_type = get_user_plan_type(user_id)
 
-    return plan_type == "plan_ultra" or plan_type == "premium_legacy"
 
+    def add(self, name, start, end):
 
+        self.spans.append((name, start, end))
 
-def can_view_video(user_id):
 
-    plan_type = get_user_plan_type(user_id)
 
-    today = str(datetime.utcnow().date())
+current_trace = contextvars.ContextVar("current_trace", default=None)
 
-    current_views = user_daily_views.get(str(user_id), {}).get(today, 0)
+# Operaciones de Firestore del update en curso: {"read": n, "write": n} (None = tareas de fondo)
 
+current_storage_ops = contextvars.ContextVar("current_storage_ops", default=None)
 
+trace_file = None
 
-    if plan_type == "plan_ultra" or plan_type == "premium_legacy":
 
-        return True # Vistas ilimitadas
 
-    elif plan_type == "plan_pro":
+def write_trace(trace, update_type_name, handler, ended):
 
-        return current_views < PRO_LIMIT_VIDEOS
+    # Se guardan las trazas lentas y, del resto, una muestra de TRACE_SAMPLE_RATE
 
-    else: # plan_type == "free"
+    global trace_file
 
-        return current_views < FREE_LIMIT_VIDEOS
+    duration_ms = (ended - trace.started) * 1000
 
+    if duration_ms < TRACE_SLOW_MS and random.random() >= TRACE_SAMPLE_RATE:
 
+        return
 
-async def register_view(user_id):
+    if trace_file is None:
 
-    today = str(datetime.utcnow().date())
+        trace_file = open(TRACE_FILE, "a", encoding="utf-8", buffering=1)
 
-    uid = str(user_id)
+    record = {
 
-    if uid not in user_daily_views:
+        "trace_id": trace.trace_id,
 
-        user_daily_views[uid] = {}
+        "update_id": trace.update_id,
 
-    user_daily_views[uid][today] = user_daily_views[uid].get(today, 0) + 1
+        "type": update_type_name,
 
-    save_data()
+        "handler": handler,
 
+        "ts": time.time() - (time.perf_counter() - trace.started),
 
+        "duration_ms": round(duration_ms, 3),
 
-# --- Canales para verificación ---
+        "slow": duration_ms >= TRACE_SLOW_MS,
 
-CHANNELS = {
+        "spans": [
 
-    "canal_1": "@hsitotv",
+            {"name": name, "start_ms": round((start - trace.started) * 1000, 3), "duration_ms": round((end - start) * 1000, 3)}
 
-    "canal_2": "@Jhonmaxs",
+            for name, start, end in trace.spans
 
-}
+        ],
 
+    }
 
+    trace_file.write(json.dumps(record, ensure_ascii=False) + "\n")
 
-# --- Menú principal ---
 
-def get_main_menu():
 
-    return InlineKeyboardMarkup(
+def storage_op(*kinds):
 
-        [
+    """Mide una operación de Firestore (etiqueta = nombre de la función) y la cuenta
 
-            [
+    como una lectura y/o escritura del update que la provocó. Las que tocan varios
 
-                InlineKeyboardButton("🎧 Audio Libros", url="https://t.me/+3lDaURwlx-g4NWJk"),
+    documentos se declaran sin `kinds` y cuentan cada documento con count_storage_ops."""
 
-                InlineKeyboardButton("📚 Libro PDF", url="https://t.me/+iJ5D1VLCAW5hYzhk"),
+    def decorator(func):
 
-            ],
+        name = func.__name__
 
-            [
 
-                InlineKeyboardButton("💬 Chat Pedido", url="https://t.me/+6eA7AdRfgq81NzBh"),
 
-                InlineKeyboardButton("📽️ doramas", url="https://t.me/+YIXdwQ9Sa-I3ODYx"),
+        @functools.wraps(func)
 
-            ],
+        def wrapper(*args, **kwargs):
 
-            [
+            for kind in kinds:
 
-                InlineKeyboardButton("📽️ peliculas", url="https://t.me/+rvYUEq-c96kzODE0"),
+                count_storage_ops(kind)
 
-                InlineKeyboardButton("🎬 series", url="https://t.me/+eYI6JZq72o4xNWFh"),
+            started = time.perf_counter()
 
-            ],
+            try:
 
-            [
+                return func(*args, **kwargs)
 
-                InlineKeyboardButton("💎 Planes", callback_data="planes"),
+            except Exception:
 
-               ],
+                errors_total.inc("storage")
 
-            [
+                raise
 
-                InlineKeyboardButton("🧑 Perfil", callback_data="perfil"),
+            finally:
 
-            ],
+                ended = time.perf_counter()
 
-            [
+                storage_seconds.observe(name, ended - started)
 
-                InlineKeyboardButton("ℹ️ Info", callback_data="info"),
+                trace = current_trace.get()
 
-                InlineKeyboardButton("❓ soporte", url="https://t.me/Hsito"),
+                if trace is not None:
 
-            ],
+                    trace.add(f"storage:{name}", started, ended)
 
-        ]
+        return wrapper
 
-    )
+    return decorator
 
 
 
-# --- Función auxiliar para generar botones de capítulos en cuadrícula ---
+def count_storage_ops(kind, n=1):
 
-def generate_chapter_buttons(serie_id, num_chapters, chapters_per_row=5):
+    ops = current_storage_ops.get()
 
-    buttons = []
+    if ops is None:
 
-    row = []
+        storage_ops_total.inc(("background", kind), n)
 
-    for i in range(num_chapters):
+    else:
 
-        row.append(InlineKeyboardButton(str(i + 1), callback_data=f"cap_{serie_id}_{i}"))
+        ops[kind] += n
 
-        if len(row) == chapters_per_row:
 
-            buttons.append(row)
 
-            row = []
+def stream_docs(query):
 
-    if row: # Añadir la última fila si no está completa
+    # Itera una consulta contando sus documentos (Firestore cobra al menos una lectura por consulta)
 
-        buttons.append(row)
+    count = 0
 
-    
+    for doc in query.stream():
 
-    # Añadir botón "Volver al menú principal" al final
+        count += 1
 
-    buttons.append([InlineKeyboardButton("🔙 Volver al menú principal", callback_data="menu_principal")])
+        yield doc
 
-    return InlineKeyboardMarkup(buttons)
+    count_storage_ops("read", max(count, 1))
 
 
 
-# --- Función auxiliar para verificar suscripción a canales ---
+class MeteredRequest(BaseRequest):
 
-async def check_channel_subscription(user_id, context: ContextTypes.DEFAULT_TYPE):
+    """Envuelve el cliente HTTP de la Bot API para medir la latencia por método y los 429."""
 
-    not_joined = []
 
-    for name, username in CHANNELS.items():
 
-        try:
+    def __init__(self, inner):
 
-            member = await context.bot.get_chat_member(chat_id=username, user_id=user_id)
+        self._inner = inner
 
-            if member.status not in ["member", "administrator", "creator"]:
 
-                not_joined.append(username)
 
-        except Exception as e:
+    @property
 
-            logger.warning(f"Error verificando canal {username} para user {user_id}: {e}")
+    def read_timeout(self):
 
-            not_joined.append(username) # Asumir no unido si hay error
+        return self._inner.read_timeout
 
-    return not_joined
 
 
+    async def initialize(self):
 
-# --- Handlers ---
+        await self._inner.initialize()
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
-    args = context.args
 
-    user_id = update.effective_user.id
+    async def shutdown(self):
 
-    bot_username = (await context.bot.get_me()).username
+        await self._inner.shutdown()
 
 
 
-    # Verificar suscripción a canales al inicio
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
 
-    not_joined_channels = await check_channel_subscription(user_id, context)
+        api_method = url.rsplit("/", 1)[-1]
 
+        started = time.perf_counter()
 
+        try:
 
-    # Si el usuario NO está unido a todos los canales, pedir verificación
+            code, payload = await self._inner.do_request(url, method, request_data, *args, **kwargs)
 
-    if not_joined_channels:
+        except Exception:
 
-        await update.message.reply_text(
+            errors_total.inc("bot_api")
 
-            "👋 ¡Hola! Primero debes unirte a todos nuestros canales para usar este bot. Una vez te hayas unido, haz clic en 'Verificar suscripción' para continuar.",
+            raise
 
-            reply_markup=InlineKeyboardMarkup(
+        finally:
 
-                [
+            ended = time.perf_counter()
 
-                    [
+            bot_api_seconds.observe(api_method, ended - started)
 
-                        InlineKeyboardButton("🔗 Unirse a canal 1", url=f"https://t.me/{CHANNELS['canal_1'][1:]}"),
+            trace = current_trace.get()
 
-                        InlineKeyboardButton("🔗 Unirse a canal 2", url=f"https://t.me/{CHANNELS['canal_2'][1:]}"),
+            if trace is not None:
 
-                    ],
+                trace.add(f"bot_api:{api_method}", started, ended)
 
-                    [InlineKeyboardButton("✅ Verificar suscripción", callback_data="verify")],
+        if code == 429:
 
-                ]
+            rate_limited_total.inc("bot_api")
 
-            ),
+        return code, payload
 
-        )
 
-        return # Salir de la función si no está verificado
 
+# --- Retraso del event loop ---
 
+LOOP_LAG_STACK_DEPTH = 12  # frames registrados de la pila que bloquea el loop
 
-    # Si el usuario YA está unido a todos los canales, proceder con la lógica normal o menú principal
+LOOP_LAG_QUANTILES = (0.5, 0.9, 0.99)
 
-    # Manejo del start link para mostrar sinopsis + botón "Ver Video" (Videos individuales)
 
-    if args and args[0].startswith("video_"):
 
-        pkg_id = args[0].split("_")[1]
+def blocking_handler(frame):
 
-        pkg = content_packages.get(pkg_id)
+    # Handler del update en curso si el bloqueo ocurre dentro de _process_measured;
 
-        if not pkg:
+    # si no, la función más externa de este módulo (tareas de fondo como stats_flusher)
 
-            await update.message.reply_text("❌ Contenido no disponible.")
+    outermost = None
 
-            return
+    while frame is not None:
 
+        code = frame.f_code
 
+        if code.co_name == "_process_measured":
 
-        # Mostrar sinopsis y botón "Ver Video"
+            update = frame.f_locals.get("update")
 
-        ver_video_button = InlineKeyboardMarkup(
+            return handler_label(update) if isinstance(update, Update) else "otro"
 
-            [
+        if code.co_filename == __file__:
 
-                [
+            outermost = code.co_name
 
-                    InlineKeyboardButton(
+        frame = frame.f_back
 
-                        "▶️ Ver Video", callback_data=f"play_video_{pkg_id}" # Callback para cargar el video
+    return f"background:{outermost}" if outermost else "desconocido"
 
-                    )
 
-                ]
 
-            ]
+class LoopLagMonitor:
 
-        )
+    """Mide el retraso de planificación del event loop. Un hilo vigilante detecta cuándo
 
-        # MODIFICACIÓN AQUI: Enviar la foto junto con la sinopsis para videos individuales
+    el loop lleva más de threshold_ms sin avanzar y captura la pila del código que lo bloquea."""
 
-        if pkg.get("photo_id"):
 
-            await update.message.reply_photo(
 
-                photo=pkg["photo_id"],
+    def __init__(self, interval, threshold_ms):
 
-                caption=f"🎬 **{pkg.get('caption', 'Contenido:')}**\n\nPresiona 'Ver Video' para iniciar la reproducción.",
+        self.interval = interval
 
-                reply_markup=ver_video_button,
+        self.threshold = threshold_ms / 1000
 
-                parse_mode="Markdown"
+        self.samples = deque(maxlen=2048)  # últimos retrasos en segundos
 
-            )
+        self.total = 0.0
 
-        else: # Si por alguna razón no hay photo_id, enviar solo el texto como fallback
+        self.count = 0
 
-            await update.message.reply_text(
+        self.heartbeat = time.perf_counter()
 
-                f"🎬 **{pkg.get('caption', 'Contenido:')}**\n\nPresiona 'Ver Video' para iniciar la reproducción.",
+        self.offender = None  # (handler, pila) capturados por el vigilante en el bloqueo en curso
 
-                reply_markup=ver_video_button,
+        self._loop_thread = None
 
-                parse_mode="Markdown"
+        self._stopped = threading.Event()
 
-            )
 
-        return
 
+    async def run(self):
 
+        self._loop_thread = threading.get_ident()
 
-    # Manejo del start link para reproducir video (Videos individuales)
+        self._stopped.clear()
 
-    elif args and args[0].startswith("play_video_"):
+        threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True).start()
 
-        pkg_id = args[0].split("_")[2]
+        try:
 
-        pkg = content_packages.get(pkg_id)
+            while True:
 
-        if not pkg or "video_id" not in pkg:
+                expected = time.perf_counter() + self.interval
 
-            await update.message.reply_text("❌ Video no disponible.")
+                await asyncio.sleep(self.interval)
 
-            return
+                self.heartbeat = now = time.perf_counter()
 
+                self.observe(max(0.0, now - expected))
 
+        finally:
 
-        if can_view_video(user_id):
+            self._stopped.set()
 
-            await register_view(user_id)
 
-            title_caption = pkg.get("caption", "🎬 Aquí tienes el video completo.")
 
-            
+    def observe(self, lag):
 
-            # Añadir el botón "Volver al menú principal"
+        self.samples.append(lag)
 
-            reply_markup_video = InlineKeyboardMarkup(
+        self.total += lag
 
-                [
+        self.count += 1
 
-                    [InlineKeyboardButton("🔙 Volver al menú principal", callback_data="menu_principal")]
+        offender, self.offender = self.offender, None
 
-                ]
+        if lag >= self.threshold:
 
-            )
+            handler, stack = offender or ("desconocido", "  (pila no capturada)\n")
 
+            loop_blocked_total.inc(handler)
 
+            logger.warning(f"⏱️ Event loop bloqueado {lag * 1000:.0f} ms por {handler}:\n{stack.rstrip()}")
 
-            # Enviar la imagen junto con el video al hacer clic en "Ver Video" (opcional, si se desea reenviar la imagen)
 
-            if pkg.get("photo_id"):
 
-                await update.message.reply_photo(
+    def _watch(self):
 
-                    photo=pkg["photo_id"],
+        # Corre en otro hilo: una sola captura por bloqueo (mientras no cambie el latido)
 
-                    caption=f"Aquí tienes la sinopsis de tu contenido: {title_caption}", # Puedes ajustar este caption
+        captured = None
 
-                    parse_mode="Markdown"
+        while not self._stopped.wait(self.interval):
 
-                )
+            beat = self.heartbeat
 
+            if beat == captured or time.perf_counter() - beat < self.interval + self.threshold:
 
+                continue
 
-            await update.message.reply_video(
+            frame = sys._current_frames().get(self._loop_thread)
 
-                video=pkg["video_id"],
+            if frame is not None:
 
-                caption=title_caption,
+                stack = "".join(traceback.format_stack(frame, limit=LOOP_LAG_STACK_DEPTH))
 
-                protect_content=not can_resend_content(user_id),
+                self.offender = (blocking_handler(frame), stack)
 
-                reply_markup=reply_markup_video
+                captured = beat
 
-            )
 
-            # await update.message.delete() # Comentado porque el mensaje original ya se borra en handle_callback
 
+    def render(self):
 
+        name = "bot_event_loop_lag_seconds"
 
-        else:
+        lines = [f"# HELP {name} Retraso de planificación del event loop (últimas muestras)", f"# TYPE {name} summary"]
 
-            await update.message.reply_text(
+        samples = sorted(self.samples)
 
-                f"🚫 Has alcanzado tu límite diario de {FREE_LIMIT_VIDEOS} videos.\n"
+        for q in LOOP_LAG_QUANTILES:
 
-                "💎 Por favor, considera comprar un plan para acceso ilimitado.",
+            value = samples[min(len(samples) - 1, int(len(samples) * q))] if samples else 0.0
 
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("💎 Comprar Planes", callback_data="planes")]]),
+            lines.append(f'{name}{{quantile="{q}"}} {value}')
 
-            )
+        lines.append(f"{name}_sum {self.total}")
 
-            return
+        lines.append(f"{name}_count {self.count}")
 
+        return lines
 
 
-    # Modificado: Manejo de argumentos para series (directo a capítulos)
 
-    elif args and args[0].startswith("serie_"):
+loop_lag = LoopLagMonitor(LOOP_LAG_INTERVAL, LOOP_LAG_THRESHOLD_MS)
 
-        serie_id = args[0].split("_", 1)[1]
 
-        serie = series_data.get(serie_id)
 
-        if not serie:
+# --- Profiler por muestreo de updates ---
 
-            await update.message.reply_text("❌ Serie no encontrada.")
+class UpdateProfiler:
 
-            return
+    """Profiler estadístico: un hilo toma la pila del hilo del loop cada interval_ms y la
 
+    asigna al update que se está ejecutando. Al terminar el update sus muestras se suman al
 
+    perfil agregado (pilas colapsadas por handler) solo si fue lento o entró en la muestra.
 
-        # APLICACIÓN DE LA SEGURIDAD PARA SERIES AQUÍ
+    Solo ve el tiempo en el que el handler ocupa el loop (CPU o llamadas bloqueantes), no
 
-        if not can_view_video(user_id): # Verifica si tiene vistas disponibles
+    las esperas de red: esas ya las cubren las trazas."""
 
-            await update.message.reply_text(
 
-                f"🚫 Has alcanzado tu límite diario de {FREE_LIMIT_VIDEOS} vistas para series/videos.\n"
 
-                "💎 Por favor, considera comprar un plan para acceso ilimitado.",
+    def __init__(self, interval_ms, slow_ms, sample_rate):
 
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("💎 Comprar Planes", callback_data="planes")]]),
+        self.interval = interval_ms / 1000
 
-            )
+        self.slow = slow_ms / 1000 if slow_ms > 0 else math.inf
 
-            return
+        self.sample_rate = sample_rate
 
+        self.enabled = slow_ms > 0 or sample_rate > 0
 
+        self.active = {}  # {update_id: muestras} de los updates en curso
 
-        # Si puede ver, mostrar capítulos
+        self.stacks = {}  # {pila colapsada: muestras}
 
-        capitulos = serie.get("capitulos", [])
+        self.updates = 0
 
-        if not capitulos:
+        self._loop_thread = None
 
-            await update.message.reply_text("❌ Esta serie no tiene capítulos disponibles aún.")
+        self._stopped = threading.Event()
 
-            return
 
-        
 
-        # Usar la nueva función para generar los botones de los capítulos
+    def start(self):
 
-        markup = generate_chapter_buttons(serie_id, len(capitulos))
+        self._loop_thread = threading.get_ident()
 
+        self._stopped.clear()
 
+        threading.Thread(target=self._sample, name="update-profiler", daemon=True).start()
 
-        await update.message.reply_photo(
 
-            photo=serie["photo_id"],
 
-            caption=f"📺 *{serie['title']}*\n\n{serie['caption']}\n\nSelecciona un capítulo:",
+    def stop(self):
 
-            reply_markup=markup,
+        self._stopped.set()
 
-            parse_mode="Markdown"
 
-        )
 
-    else:
+    def begin(self, update_id):
 
-        # Si no hay argumentos específicos y el usuario ya está verificado, mostrar menú principal
+        self.active[update_id] = []
 
-        await update.message.reply_text("📋 Menú principal:", reply_markup=get_main_menu())
 
 
+    def end(self, update_id, handler, duration):
 
+        samples = self.active.pop(update_id, None)
 
+        if not samples or (duration < self.slow and random.random() >= self.sample_rate):
 
-async def verify(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            return
 
-    query = update.callback_query
+        self.updates += 1
 
-    await query.answer()
+        for frames in samples:
 
-    user_id = query.from_user.id
+            key = ";".join((handler,) + frames)
 
-    
+            self.stacks[key] = self.stacks.get(key, 0) + 1
 
-    not_joined = await check_channel_subscription(user_id, context)
 
 
+    def _sample(self):
 
-    if not not_joined:
+        # Corre en otro hilo; de cada pila se guardan los frames desde _process_measured hacia dentro
 
-        await query.edit_message_text("✅ Verificación completada. Menú disponible:")
+        while not self._stopped.wait(self.interval):
 
-        await query.message.reply_text("📋 Menú principal:", reply_markup=get_main_menu())
+            if not self.active:
 
-    else:
+                continue
 
-        await query.edit_message_text("❌ Aún no estás suscrito a:\n" + "\n".join(not_joined))
+            frame = sys._current_frames().get(self._loop_thread)
 
+            names = []
 
+            while frame is not None:
 
-async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+                code = frame.f_code
 
-    query = update.callback_query
+                if code.co_name == "_process_measured":
 
-    await query.answer()
+                    update = frame.f_locals.get("update")
 
-    user = query.from_user
+                    samples = self.active.get(getattr(update, "update_id", None))
 
-    user_id = user.id
+                    if samples is not None:
 
-    data = query.data
+                        samples.append(tuple(reversed(names)))
 
+                    break
 
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
 
-    if data == "planes":
+                frame = frame.f_back
 
-        texto_planes = (
 
-            f"💎 *Planes disponibles:*\n\n"
 
-            f"🔹 Free – Hasta {FREE_LIMIT_VIDEOS} videos por día.\n\n"
+    def snapshot(self, reset=False):
 
-            "🔸 *Plan Pro*\n"
+        stacks, updates = self.stacks, self.updates
 
-            "Precio: 25 estrellas\n"
+        if reset:
 
-            "Beneficios: 50 videos diarios, sin reenvíos ni compartir.\n\n"
+            self.stacks, self.updates = {}, 0
 
-            "🔸 *Plan Ultra*\n"
+        else:
 
-            "Precio: 50 estrellas\n"
+            stacks = dict(stacks)
 
-            "Beneficios: Videos y reenvíos ilimitados, sin restricciones.\n"
+        return stacks, updates
 
-        )
 
-        botones_planes = InlineKeyboardMarkup(
 
-            [
+def write_collapsed_stacks(path, stacks):
 
-                [InlineKeyboardButton("💸 Comprar Plan Pro (25 ⭐)", callback_data="comprar_pro")],
+    # Formato de flamegraph.pl / speedscope: "handler;frame;...;frame muestras"
 
-                [InlineKeyboardButton("💸 Comprar Plan Ultra (50 ⭐)", callback_data="comprar_ultra")],
+    with open(path, "w", encoding="utf-8") as f:
 
-                [InlineKeyboardButton("🔙 Volver", callback_data="menu_principal")],
+        for stack, count in sorted(stacks.items(), key=itemgetter(1), reverse=True):
 
-            ]
+            f.write(f"{stack} {count}\n")
 
-        )
 
-        await query.message.reply_text(texto_planes, parse_mode="Markdown", reply_markup=botones_planes)
 
+profiler = UpdateProfiler(PROFILE_INTERVAL_MS, PROFILE_SLOW_MS, PROFILE_SAMPLE_RATE)
 
 
-    elif data == "comprar_pro":
 
-        if is_premium(user_id):
+# --- Registro compacto por usuario ---
 
-            exp_date = user_premium[user_id].get("expire_at", datetime.now(timezone.utc)).strftime("%Y-%m-%d") # MODIFICADO
+EPOCH_DATE = date(1970, 1, 1)
 
-            await query.message.reply_text(f"✅ Ya tienes un plan activo hasta {exp_date}.")
+_day_keys = {}
 
-            return
 
-        await context.bot.send_invoice(
 
-            chat_id=query.message.chat_id,
+def utc_day():
 
-            title=PLAN_PRO_ITEM["title"],
+    # Día UTC como entero (días desde 1970-01-01): comparar días no requiere crear fechas
 
-            description=PLAN_PRO_ITEM["description"],
+    return int(time.time()) // 86400
 
-            payload=PLAN_PRO_ITEM["payload"],
 
-            provider_token=PROVIDER_TOKEN,
 
-            currency=PLAN_PRO_ITEM["currency"],
+def day_key(day):
 
-            prices=PLAN_PRO_ITEM["prices"],
+    # Clave de fecha que se guarda en Firestore ("AAAA-MM-DD")
 
-            start_parameter="buy-plan-pro",
+    key = _day_keys.get(day)
 
-        )
+    if key is None:
 
+        key = _day_keys[day] = str(EPOCH_DATE + timedelta(days=day))
 
+    return key
 
-    elif data == "comprar_ultra":
 
-        if is_premium(user_id):
 
-            exp_date = user_premium[user_id].get("expire_at", datetime.now(timezone.utc)).strftime("%Y-%m-%d") # MODIFICADO
+class UserRecord:
 
-            await query.message.reply_text(f"✅ Ya tienes un plan activo hasta {exp_date}.")
+    """Plan pagado y vistas del día en curso de un usuario."""
 
-            return
+    __slots__ = ("plan_type", "expire_at", "expire_ts", "views_day", "views")
 
-        await context.bot.send_invoice(
 
-            chat_id=query.message.chat_id,
 
-            title=PLAN_ULTRA_ITEM["title"],
+    def __init__(self, plan_type=None, expire_at=None):
 
-            description=PLAN_ULTRA_ITEM["description"],
+        self.plan_type = plan_type
 
-            payload=PLAN_ULTRA_ITEM["payload"],
+        self.expire_at = expire_at
 
-            provider_token=PROVIDER_TOKEN,
+        self.expire_ts = expire_at.timestamp() if expire_at else 0.0
 
-            currency=PLAN_ULTRA_ITEM["currency"],
+        self.views_day = 0
 
-            prices=PLAN_ULTRA_ITEM["prices"],
+        self.views = 0
 
-            start_parameter="buy-plan-ultra",
 
-        )
 
+    def set_plan(self, plan_type, expire_at):
 
+        self.plan_type = plan_type
 
-    elif data == "perfil":
+        self.expire_at = expire_at
 
-        plan_type = get_user_plan_type(user_id)
+        self.expire_ts = expire_at.timestamp()
 
-        exp_date_str = "N/A"
 
-        if is_premium(user_id):
 
-            # user_premium[user_id] ahora es un diccionario como {"expire_at": datetime, "plan_type": str}
+    def views_on(self, day):
 
-            user_plan_data = user_premium[user_id]
+        return self.views if self.views_day == day else 0
 
-            if isinstance(user_plan_data, dict) and "expire_at" in user_plan_data:
 
-                exp_date = user_plan_data.get("expire_at")
 
-                if exp_date:
+    def add_views(self, day, delta):
 
-                    exp_date_str = exp_date.strftime('%Y-%m-%d')
+        if day != self.views_day:
 
-            # Manejo de compatibilidad para usuarios antiguos que solo tenían fecha en user_premium
+            if day < self.views_day:
 
-            elif isinstance(user_plan_data, datetime):
+                return  # Devolución de un día ya cerrado: solo cuenta en Firestore
 
-                exp_date_str = user_plan_data.strftime('%Y-%m-%d')
+            self.views_day = day
 
+            self.views = 0
 
+        self.views = max(0, self.views + delta)
 
 
 
-        await query.message.reply_text(
+class RecordViewCounters:
 
-            f"🧑 Perfil:\n• {user.full_name}\n• @{user.username or 'Sin usuario'}\n"
+    """Vistas del día guardadas en los UserRecord de `users`."""
 
-            f"• ID: {user_id}\n• Plan: {plan_type.replace('plan_', '').replace('premium_legacy', 'Ultra').capitalize()}\n• Expira: {exp_date_str}",
 
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Volver", callback_data="planes")]]),
 
-        )
+    def get(self, user_id, day):
 
+        record = users.get(user_id)
 
+        return record.views_on(day) if record is not None else 0
 
-    elif data == "menu_principal":
 
-        await query.message.reply_text("📋 Menú principal:", reply_markup=get_main_menu())
 
+    def add(self, user_id, day, delta):
 
+        record = get_or_create_user(user_id)
 
-    elif data == "audio_libros":
+        record.add_views(day, delta)
 
-        await query.message.reply_text("🎧 Aquí estará el contenido de Audio Libros.")
+        return record.views_on(day)
 
-    elif data == "libro_pdf":
 
-        await query.message.reply_text("📚 Aquí estará el contenido de Libro PDF.")
 
-    elif data == "chat_pedido":
+    def set(self, user_id, day, count):
 
-        await query.message.reply_text("💬 Aquí puedes hacer tu pedido en el chat.")
+        record = get_or_create_user(user_id)
 
-    elif data == "cursos":
+        record.views_day, record.views = day, count
 
-        await query.message.reply_text("🎓 Aquí estarán los cursos disponibles.")
 
 
+    def export(self, day):
 
-    # Manejo del callback para reproducir el video individual
+        return [(uid, record.views) for uid, record in users.items() if record.views_day == day and record.views]
 
-    elif data.startswith("play_video_"):
 
-        pkg_id = data.split("_")[2]
 
-        pkg = content_packages.get(pkg_id)
+    def __len__(self):
 
-        if not pkg or "video_id" not in pkg:
+        return sum(1 for record in users.values() if record.views)
 
-            await query.message.reply_text("❌ Video no disponible.")
 
-            return
 
+class IntIndex:
 
+    """Tabla hash user_id -> posición densa sobre arrays (direccionamiento abierto).
 
-        # Verificación de seguridad (similar a 'start' handler)
 
-        not_joined_channels = await check_channel_subscription(user_id, context)
 
-        if not_joined_channels:
+    Cuesta ~24 bytes por usuario frente a los ~85 de un dict con claves int.
 
-            await query.message.reply_text(
+    """
 
-                "🔒 Para ver este contenido debes unirte a los canales.",
 
-                reply_markup=InlineKeyboardMarkup(
 
-                    [
+    def __init__(self, capacity=1024):
 
-                        [
+        self._keys = array("q", bytes(8 * capacity))  # 0 = hueco libre (no hay user_id 0)
 
-                            InlineKeyboardButton(
+        self._positions = array("I", bytes(4 * capacity))
 
-                                "🔗 Unirse a canal 1", url=f"https://t.me/{CHANNELS['canal_1'][1:]}"
+        self._mask = capacity - 1
 
-                            )
+        self._size = 0
 
-                        ],
 
-                        [
 
-                            InlineKeyboardButton(
+    def _probe(self, key):
 
-                                "🔗 Unirse a canal 2", url=f"https://t.me/{CHANNELS['canal_2'][1:]}"
+        keys, mask = self._keys, self._mask
 
-                            )
+        i = ((key * 0x9E3779B97F4A7C15) >> 32) & mask
 
-                        ],
+        while True:
 
-                        [InlineKeyboardButton("✅ Verificar suscripción", callback_data="verify")],
+            k = keys[i]
 
-                    ]
+            if k == key or k == 0:
 
-                ),
+                return i
 
-            )
+            i = (i + 1) & mask
 
-            return
 
 
+    def get(self, key):
 
-        if can_view_video(user_id):
+        i = self._probe(key)
 
-            await register_view(user_id)
+        return self._positions[i] if self._keys[i] == key else None
 
-            title_caption = pkg.get("caption", "🎬 Aquí tienes el video completo.")
 
 
+    def add(self, key, position):
 
-            # Añadir el botón "Volver al menú principal"
+        if (self._size + 1) * 2 > len(self._keys):
 
-            reply_markup_video = InlineKeyboardMarkup(
+            self._grow()
 
-                [
+        i = self._probe(key)
 
-                    [InlineKeyboardButton("🔙 Volver al menú principal", callback_data="menu_principal")]
+        self._keys[i] = key
 
-                ]
+        self._positions[i] = position
 
-            )
+        self._size += 1
 
 
 
-            # --- MODIFICACIÓN SUGERIDA: Enviar la imagen junto con el video ---
+    def _grow(self):
 
-            if pkg.get("photo_id"):
+        old = [(k, p) for k, p in zip(self._keys, self._positions) if k]
 
-                await query.message.reply_photo(
+        capacity = len(self._keys) * 2
 
-                    photo=pkg["photo_id"],
+        self._keys = array("q", bytes(8 * capacity))
 
-                    caption=f"Aquí tienes la sinopsis de tu contenido: {title_caption}", # Optional: Add a specific caption for the photo
+        self._positions = array("I", bytes(4 * capacity))
 
-                    parse_mode="Markdown"
+        self._mask = capacity - 1
 
-                )
+        for key, position in old:
 
-            # --- FIN MODIFICACIÓN ---
+            i = self._probe(key)
 
+            self._keys[i] = key
 
+            self._positions[i] = position
 
-            await query.message.reply_video(
 
-                video=pkg["video_id"],
 
-                caption=title_caption,
+    def __len__(self):
 
-                protect_content=not can_resend_content(user_id),
+        return self._size
 
-                reply_markup=reply_markup_video # Asignar el nuevo markup
 
-            )
 
-            await query.message.delete() # Eliminar el mensaje anterior
+class CompactViewCounters:
 
-        else:
+    """Vistas del día en columnas contiguas indexadas por una posición densa por usuario.
 
-            await query.answer("🚫 Has alcanzado tu límite diario de videos. Compra un plan para más acceso.", show_alert=True)
 
-            await query.message.reply_text(
 
-                f"🚫 Has alcanzado tu límite diario de {FREE_LIMIT_VIDEOS} videos.\n"
+    Cada posición guarda el día al que pertenece su contador: el cambio de día es O(1)
 
-                "💎 Por favor, considera comprar un plan para acceso ilimitado.",
+    (un contador de otro día vale 0 y se reinicia al escribirlo) y no recorre nada.
 
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("💎 Comprar Planes", callback_data="planes")]]),
+    """
 
-            )
 
 
+    def __init__(self):
 
-    # Mostrar video capítulo con navegación (series)
+        self._index = IntIndex()     # user_id -> posición
 
-    elif data.startswith("cap_"):
+        self._user_ids = array("q")  # user_id por posición
 
-        _, serie_id, index = data.split("_")
+        self._days = array("I")      # día (utc_day) del contador
 
-        index = int(index)
+        self._counts = array("H")    # vistas de ese día
 
-        serie = series_data.get(serie_id)
 
 
+    def _slot(self, user_id):
 
-        if not serie or "capitulos" not in serie:
+        idx = self._index.get(user_id)
 
-            await query.message.reply_text("❌ Serie o capítulos no disponibles.")
+        if idx is None:
 
-            return
+            idx = len(self._user_ids)
 
+            self._index.add(user_id, idx)
 
+            self._user_ids.append(user_id)
 
-        capitulos = serie["capitulos"]
+            self._days.append(0)
 
-        total = len(capitulos)
+            self._counts.append(0)
 
-        if index < 0 or index >= total:
+        return idx
 
-            await query.message.reply_text("❌ Capítulo fuera de rango.")
 
-            return
 
+    def get(self, user_id, day):
 
+        idx = self._index.get(user_id)
 
-        if can_view_video(user_id):
+        if idx is None or self._days[idx] != day:
 
-            await register_view(user_id)
+            return 0
 
-            video_id = capitulos[index]
+        return self._counts[idx]
 
 
 
-            botones = []
+    def add(self, user_id, day, delta):
 
-            if index > 0:
+        idx = self._slot(user_id)
 
-                botones.append(InlineKeyboardButton("⬅️ Anterior", callback_data=f"cap_{serie_id}_{index - 1}"))
+        if self._days[idx] != day:
 
-            if index < total - 1:
+            if self._days[idx] > day:
 
-                botones.append(InlineKeyboardButton("➡️ Siguiente", callback_data=f"cap_{serie_id}_{index + 1}"))
+                return 0  # Devolución de un día ya cerrado: solo cuenta en Firestore
 
-            botones.append(InlineKeyboardButton("🔙 Volver a la Serie", callback_data=f"serie_list_{serie_id}"))
+            self._days[idx] = day
 
+            self._counts[idx] = 0
 
+        count = min(0xFFFF, max(0, self._counts[idx] + delta))
 
-            markup = InlineKeyboardMarkup([botones])
+        self._counts[idx] = count
 
+        return count
 
 
-            # 🧨 Evitar edit_message_media, usar send_video con protect_content
 
-            await query.message.delete()
+    def set(self, user_id, day, count):
 
-            await context.bot.send_video(
+        idx = self._slot(user_id)
 
-                chat_id=query.message.chat_id,
+        self._days[idx] = day
 
-                video=video_id,
+        self._counts[idx] = min(0xFFFF, count)
 
-                caption=f"{serie['title']} - Capítulo {index + 1}",
 
-                parse_mode="Markdown",
 
-                protect_content=not can_resend_content(user_id),
+    def export(self, day):
 
-                reply_markup=markup
+        # Exportación en bloque de los contadores del día para persistirlos
 
-            )
+        if np is not None:
 
-        else:
+            days = np.frombuffer(self._days, dtype=np.uint32)
 
-            await query.answer("🚫 Has alcanzado tu límite diario de videos. Compra un plan para más acceso.", show_alert=True)
+            counts = np.frombuffer(self._counts, dtype=np.uint16)
 
-            await query.message.reply_text(
+            mask = (days == day) & (counts > 0)
 
-                f"🚫 Has alcanzado tu límite diario de {FREE_LIMIT_VIDEOS} videos.\n"
+            result = list(zip(np.frombuffer(self._user_ids, dtype=np.int64)[mask].tolist(), counts[mask].tolist()))
 
-                "💎 Por favor, considera comprar un plan para acceso ilimitado.",
+            del days, counts, mask  # Liberar las vistas para que los arrays puedan crecer
 
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("💎 Comprar Planes", callback_data="planes")]]),
+            return result
 
-            )
+        days, counts, user_ids = self._days, self._counts, self._user_ids
 
-    
+        return [(user_ids[i], counts[i]) for i in range(len(user_ids)) if days[i] == day and counts[i]]
 
-    # Nuevo callback para mostrar la lista de capítulos de una serie
 
-    elif data.startswith("serie_list_"):
 
-        serie_id = data.split("_")[2]
+    def __len__(self):
 
-        serie = series_data.get(serie_id)
+        return len(self._index)
 
-        if not serie:
 
-            await query.message.reply_text("❌ Serie no encontrada.")
 
-            return
+def make_view_counters():
 
-        
+    return CompactViewCounters() if VIEW_COUNTER_STORE == "compact" else RecordViewCounters()
 
-        # APLICACIÓN DE LA SEGURIDAD PARA SERIES AQUÍ (al volver a la lista)
 
-        if not can_view_video(user_id): # Verifica si tiene vistas disponibles
 
-            await query.message.reply_text(
+# --- Identificadores de contenido ---
 
-                f"🚫 Has alcanzado tu límite diario de {FREE_LIMIT_VIDEOS} vistas para series/videos.\n"
+CROCKFORD_BASE32 = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
 
-                "💎 Por favor, considera comprar un plan para acceso ilimitado.",
+CONTENT_ID_EPOCH_MS = 1704067200000  # 2024-01-01 UTC
 
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("💎 Comprar Planes", callback_data="planes")]]),
 
-            )
 
-            return
+class ContentIdGenerator:
 
+    """Ids tipo Snowflake para videos y series: 41 bits de milisegundos desde 2024,
 
+    10 de nodo y 12 de secuencia, en 13 caracteres Crockford base32 tras una "C".
 
-        capitulos = serie.get("capitulos", [])
 
-        if not capitulos:
 
-            await query.message.reply_text("❌ Esta serie no tiene capítulos disponibles aún.")
+    Son crecientes dentro del proceso (la secuencia desempata el mismo milisegundo y
 
-            return
+    un reloj que retrocede no los hace retroceder) y únicos entre nodos distintos.
 
-        
+    La "C" inicial los ordena, como texto, después de los ids numéricos antiguos
 
-        # Reutilizar la función para generar los botones de los capítulos
+    ("1718000000"), que siguen valiendo en los enlaces; tampoco llevan "_", que
 
-        markup = generate_chapter_buttons(serie_id, len(capitulos))
+    separa las partes de los enlaces y callbacks."""
 
 
 
-        await query.edit_message_media(
+    def __init__(self, node):
 
-            media=InputMediaPhoto(
+        self.node = node
 
-                media=serie["photo_id"],
+        self._last_ms = 0
 
-                caption=f"📺 *{serie['title']}*\n\n{serie['caption']}\n\nSelecciona un capítulo:",
+        self._sequence = 0
 
-                parse_mode="Markdown"
+
+
+    def next_id(self):
+
+        now_ms = max(int(time.time() * 1000) - CONTENT_ID_EPOCH_MS, self._last_ms)
+
+        if now_ms == self._last_ms:
+
+            self._sequence = (self._sequence + 1) & 0xFFF
+
+            if self._sequence == 0:
+
+                now_ms += 1  # secuencia agotada: se toma prestado el siguiente milisegundo
+
+        else:
+
+            self._sequence = 0
+
+        self._last_ms = now_ms
+
+        return encode_content_id((now_ms << 22) | (self.node << 12) | self._sequence)
+
+
+
+def encode_content_id(value):
+
+    chars = []
+
+    for _ in range(13):
+
+        chars.append(CROCKFORD_BASE32[value & 31])
+
+        value >>= 5
+
+    return "C" + "".join(reversed(chars))
+
+
+
+def content_id_at(ts):
+
+    # El menor id que puede generarse en el instante ts: cota para consultar por fecha de alta
+
+    return encode_content_id(max(int(ts * 1000) - CONTENT_ID_EPOCH_MS, 0) << 22)
+
+
+
+NODE_WORKER_BITS = (WEB_WORKERS - 1).bit_length()  # 0 con un solo proceso
+
+
+
+def content_node(worker_index):
+
+    # Instancia en los bits altos y worker en los bajos: ni los workers de una instancia ni
+
+    # instancias con NODE_ID distinto comparten nodo
+
+    instance = int(NODE_ID) if NODE_ID else int.from_bytes(os.urandom(2), "big") & ((1 << (10 - NODE_WORKER_BITS)) - 1)
+
+    return (instance << NODE_WORKER_BITS) | (worker_index or 0)
+
+
+
+content_ids = ContentIdGenerator(content_node(None))
+
+
+
+# --- Índice de búsqueda del catálogo ---
+
+NON_WORD_RE = re.compile(r"[\W_]+")
+
+CATALOG_INDEX_CHARS = 256  # se indexa el título y el comienzo de la sinopsis
+
+PREFIX_LETTERS = 4         # prefijos de palabra indexados para la palabra que se está escribiendo
+
+PAIR_BUCKETS = 1 << 16     # listas para pares de palabras seguidas (por hash: pocas y de tamaño fijo)
+
+PAIR_PREFIXES = (2, PREFIX_LETTERS)  # letras de la segunda palabra del par (puede estar a medio escribir)
+
+INLINE_RESULTS = 50        # máximo de resultados por respuesta inline (límite de Telegram)
+
+
+
+def normalize_text(text):
+
+    # Minúsculas, sin tildes ni signos: "¡El Corazón!" -> "el corazon"
+
+    text = unicodedata.normalize("NFKD", text.lower())
+
+    text = unicodedata.normalize("NFKC", "".join(c for c in text if not unicodedata.combining(c)))
+
+    return " ".join(NON_WORD_RE.sub(" ", text).split())
+
+
+
+def catalog_text(kind, item):
+
+    if kind == "serie":
+
+        return f"{item.get('title', '')} {item.get('caption', '')}"
+
+    return item.get("caption", "")
+
+
+
+def new_posting():
+
+    return array("I")
+
+
+
+def pair_bucket(first, prefix):
+
+    # Una palabra y el comienzo de la siguiente
+
+    return hash((first, prefix)) % PAIR_BUCKETS
+
+
+
+class CatalogIndex:
+
+    """Índice invertido de palabras sobre videos y series para la búsqueda inline.
+
+
+
+    Cada contenido recibe un número de documento creciente; cada palabra ("=palabra")
+
+    y cada prefijo de 1 a 4 letras ("^pref") guarda un array con sus documentos en
+
+    orden de alta, y también cada par de palabras seguidas (agrupado por hash). En una
+
+    consulta se intersecan las listas de las palabras completas, del prefijo de la última
+
+    (que el usuario aún está escribiendo) y de sus pares, empezando por la más corta, de
+
+    lo más nuevo a lo más viejo; solo los documentos que están en todas se confirman
+
+    contra el texto hasta llenar la página."""
+
+
+
+    def __init__(self):
+
+        self._keys = []      # doc -> (tipo, id), o None si el contenido se reindexó
+
+        self._texts = []     # doc -> " " + texto normalizado
+
+        self._docs = {}      # (tipo, id) -> doc
+
+        self._postings = defaultdict(new_posting)  # "=palabra" o "^prefijo" -> array de docs
+
+        self._pairs = defaultdict(new_posting)     # pair_bucket(palabra, comienzo de la siguiente) -> array de docs
+
+        self._cache = OrderedDict()  # (consulta, offset) -> (claves, siguiente offset)
+
+
+
+    def __len__(self):
+
+        return len(self._docs)
+
+
+
+    def rebuild(self, packages, series):
+
+        # Se indexa en orden de alta (los ids crecen con el tiempo) para que lo más nuevo salga primero
+
+        self.__init__()
+
+        items = [("video", pkg_id, pkg) for pkg_id, pkg in packages.items()]
+
+        items += [("serie", serie_id, serie) for serie_id, serie in series.items()]
+
+        items.sort(key=lambda item: item[1])
+
+        for kind, item_id, item in items:
+
+            self.add(kind, item_id, item)
+
+
+
+    def add(self, kind, item_id, item):
+
+        key = (kind, item_id)
+
+        text = " " + normalize_text(catalog_text(kind, item))[:CATALOG_INDEX_CHARS]
+
+        old = self._docs.get(key)
+
+        if old is not None:
+
+            if self._texts[old] == text:
+
+                return
+
+            self._keys[old] = None
+
+        doc = len(self._keys)
+
+        self._keys.append(key)
+
+        self._texts.append(text)
+
+        self._docs[key] = doc
+
+        words = text.split()
+
+        grams = {"=" + word for word in words}
+
+        grams.update("^" + word[:size] for word in words for size in range(1, min(len(word), PREFIX_LETTERS) + 1))
+
+        for gram in grams:
+
+            self._postings[gram].append(doc)
+
+        # Igual que pair_bucket, sin una llamada por par (es la mayor parte del tiempo de rebuild)
+
+        pairs = {hash((first, second[:size])) % PAIR_BUCKETS for first, second in zip(words, words[1:]) for size in PAIR_PREFIXES}
+
+        for bucket in pairs:
+
+            self._pairs[bucket].append(doc)
+
+        self._cache.clear()
+
+
+
+    def _candidates(self, query):
+
+        if not query:
+
+            return range(len(self._keys) - 1, -1, -1)
+
+        words = query.split()
+
+        grams = {"=" + word for word in words[:-1]} | {"^" + words[-1][:PREFIX_LETTERS]}
+
+        postings = []
+
+        for gram in grams:
+
+            posting = self._postings.get(gram)
+
+            if posting is None:
+
+                return ()
+
+            postings.append(posting)
+
+        # Palabras comunes aparecen juntas en muchos textos pero seguidas en pocos: los pares
+
+        # descartan casi todo lo que el texto completo no confirmaría
+
+        for i in range(len(words) - 1):
+
+            second = words[i + 1]
+
+            # La última palabra puede estar a medio escribir: el prefijo más largo que ya tenga
+
+            if i + 2 < len(words) or len(second) >= PREFIX_LETTERS:
+
+                prefix = second[:PREFIX_LETTERS]
+
+            elif len(second) >= PAIR_PREFIXES[0]:
+
+                prefix = second[:PAIR_PREFIXES[0]]
+
+            else:
+
+                continue
+
+            posting = self._pairs.get(pair_bucket(words[i], prefix))
+
+            if posting is None:
+
+                return ()
+
+            postings.append(posting)
+
+        postings.sort(key=len)
+
+        # Una lista con más de una cuarta parte del catálogo apenas descarta documentos: buscar
+
+        # en ella cuesta más que confirmar el texto
+
+        others = [posting for posting in postings[1:] if len(posting) * 4 <= len(self._keys)]
+
+        if not others:
+
+            return reversed(postings[0])
+
+        return self._intersect(postings[0], others)
+
+
+
+    @staticmethod
+
+    def _intersect(shortest, others):
+
+        # Las listas están ordenadas: cada documento de la más corta se busca con bisect en
+
+        # las demás, y como se recorre hacia atrás cada búsqueda acota la siguiente
+
+        highs = [len(posting) for posting in others]
+
+        for doc in reversed(shortest):
+
+            for i, posting in enumerate(others):
+
+                pos = bisect_left(posting, doc, 0, highs[i])
+
+                highs[i] = pos
+
+                if pos == len(posting) or posting[pos] != doc:
+
+                    break
+
+            else:
+
+                yield doc
+
+
+
+    def search(self, query, offset=0, limit=INLINE_RESULTS):
+
+        """Devuelve ([(tipo, id), ...], siguiente offset o "") del más nuevo al más viejo."""
+
+        query = normalize_text(query)
+
+        cache_key = (query, offset)
+
+        cached = self._cache.get(cache_key)
+
+        if cached is not None:
+
+            self._cache.move_to_end(cache_key)
+
+            return cached
+
+
+
+        # La consulta debe empezar al inicio de una palabra del texto
+
+        needle = " " + query
+
+        keys, skipped = [], 0
+
+        for doc in self._candidates(query):
+
+            key = self._keys[doc]
+
+            if key is None or needle not in self._texts[doc]:
+
+                continue
+
+            if skipped < offset:
+
+                skipped += 1
+
+                continue
+
+            if len(keys) == limit:
+
+                break
+
+            keys.append(key)
+
+        else:
+
+            limit = None  # no hay más resultados
+
+        result = (keys, str(offset + len(keys)) if limit is not None else "")
+
+
+
+        self._cache[cache_key] = result
+
+        if len(self._cache) > INLINE_CACHE_SIZE:
+
+            self._cache.popitem(last=False)
+
+        return result
+
+
+
+class CatalogOrder:
+
+    """Catálogo ordenado por id [(id, tipo), ...] para paginar /catalogo por cursor.
+
+
+
+    Los ids crecen con el tiempo, así que el orden es el de alta; una página se
+
+    localiza con bisect y cuesta lo mismo sea cual sea el tamaño del catálogo."""
+
+
+
+    def __init__(self):
+
+        self._entries = []
+
+
+
+    def __len__(self):
+
+        return len(self._entries)
+
+
+
+    def rebuild(self, packages, series):
+
+        entries = [(pkg_id, "video") for pkg_id in packages]
+
+        entries += [(serie_id, "serie") for serie_id in series]
+
+        entries.sort()
+
+        self._entries = entries
+
+
+
+    def add(self, kind, item_id):
+
+        entry = (item_id, kind)
+
+        i = bisect_left(self._entries, entry)
+
+        if i == len(self._entries) or self._entries[i] != entry:
+
+            self._entries.insert(i, entry)
+
+
+
+    def page(self, cursor, size):
+
+        """Hasta size entradas anteriores al cursor, de la más nueva a la más vieja, y el siguiente cursor."""
+
+        end = bisect_left(self._entries, cursor) if cursor else len(self._entries)
+
+        start = max(0, end - size)
+
+        return self._entries[start:end][::-1], (self._entries[start] if start > 0 else None)
+
+
+
+# --- Variables en memoria ---
+
+users = {}                 # {user_id (int): UserRecord}
+
+view_counts = make_view_counters()  # vistas de hoy por usuario
+
+content_packages = {}      # {pkg_id: {photo_id, caption, video_id}}
+
+known_chats = set()
+
+known_chat_added = {}      # {chat_id: ts de alta}
+
+current_photo = {}
+
+series_data = {}           # {serie_id: {"title", "photo_id", "caption", "capitulos": [video_id, ...], ...}}
+
+current_series = {}        # {user_id: {"title", "photo_id", "caption", "capitulos": []}}
+
+album_buffers = {}         # {clave de álbum/lote: {"user_id", "videos": [(message_id, file_id)], "updated"}}
+
+catalog_index = CatalogIndex()
+
+catalog_order = CatalogOrder()
+
+
+
+# --- Firestore colecciones ---
+
+COLLECTION_USERS = "users_premium"
+
+COLLECTION_VIDEOS = "videos"
+
+COLLECTION_VIEWS = "user_daily_views"
+
+COLLECTION_CHATS = "known_chats"
+
+COLLECTION_SERIES = "series_data"
+
+COLLECTION_DRAFTS = "admin_drafts"
+
+COLLECTION_CONTENT_STATS = "content_stats"
+
+COLLECTION_SKETCHES = "unique_viewers"
+
+COLLECTION_WORKER_STATS = "worker_stats"
+
+
+
+# --- Funciones Firestore (Síncronas) ---
+
+def user_premium_doc(record):
+
+    return {"expire_at": record.expire_at.isoformat(), "plan_type": record.plan_type}
+
+
+
+@storage_op()
+
+def save_user_premium_firestore():
+
+    batch = db.batch()
+
+    written = 0
+
+    for uid, record in users.items():
+
+        if record.plan_type:
+
+            doc_ref = db.collection(COLLECTION_USERS).document(str(uid))
+
+            batch.set(doc_ref, user_premium_doc(record))
+
+            written += 1
+
+    count_storage_ops("write", written)
+
+    batch.commit()
+
+
+
+@storage_op()
+
+def load_user_premium_firestore():
+
+    docs = stream_docs(db.collection(COLLECTION_USERS))
+
+    result = {}
+
+    for doc in docs:
+
+        data = doc.to_dict()
+
+        try:
+
+            expire_at_str = data.get("expire_at")
+
+            plan_type = data.get("plan_type", "premium_legacy") # MODIFICADO: Cargar plan_type, default para compatibilidad
+
+            if expire_at_str:
+
+                expire_at = datetime.fromisoformat(expire_at_str)
+
+                if expire_at.tzinfo is None:
+
+                    expire_at = expire_at.replace(tzinfo=timezone.utc)
+
+                result[int(doc.id)] = UserRecord(plan_type, expire_at)
+
+        except Exception as e:
+
+            logger.error(f"Error al cargar fecha premium para {doc.id}: {e}")
+
+            pass
+
+    return result
+
+
+
+@storage_op()
+
+def save_videos_firestore():
+
+    batch = db.batch()
+
+    for pkg_id, content in content_packages.items():
+
+        doc_ref = db.collection(COLLECTION_VIDEOS).document(pkg_id)
+
+        batch.set(doc_ref, content)
+
+    count_storage_ops("write", len(content_packages))
+
+    batch.commit()
+
+
+
+@storage_op()
+
+def load_videos_firestore():
+
+    docs = stream_docs(db.collection(COLLECTION_VIDEOS))
+
+    result = {}
+
+    for doc in docs:
+
+        result[doc.id] = doc.to_dict()
+
+    return result
+
+
+
+@storage_op()
+
+def save_user_daily_views_firestore():
+
+    # En memoria solo se guardan las vistas de hoy; el histórico de días anteriores se conserva
+
+    today = utc_day()
+
+    batch = db.batch()
+
+    rows = view_counts.export(today)
+
+    for uid, count in rows:
+
+        doc_ref = db.collection(COLLECTION_VIEWS).document(str(uid))
+
+        batch.set(doc_ref, {day_key(today): count}, merge=True)
+
+    count_storage_ops("write", len(rows))
+
+    batch.commit()
+
+
+
+@storage_op()
+
+def load_user_daily_views_firestore(counters):
+
+    # Carga las vistas de hoy en el contador
+
+    today = utc_day()
+
+    key = day_key(today)
+
+    for doc in stream_docs(db.collection(COLLECTION_VIEWS)):
+
+        count = doc.to_dict().get(key, 0)
+
+        if count:
+
+            counters.set(int(doc.id), today, count)
+
+    return counters
+
+
+
+@storage_op("write")
+
+def save_known_chats_firestore():
+
+    doc_ref = db.collection(COLLECTION_CHATS).document("chats")
+
+    added_at = {str(chat_id): ts for chat_id, ts in known_chat_added.items() if chat_id in known_chats}
+
+    doc_ref.set({"chat_ids": list(known_chats), "added_at": added_at})
+
+
+
+@storage_op("read")
+
+def load_known_chats_firestore():
+
+    doc_ref = db.collection(COLLECTION_CHATS).document("chats")
+
+    doc = doc_ref.get()
+
+    if doc.exists:
+
+        data = doc.to_dict()
+
+        added_at = {int(chat_id): ts for chat_id, ts in data.get("added_at", {}).items()}
+
+        return set(data.get("chat_ids", [])), added_at
+
+    return set(), {}
+
+
+
+@storage_op()
+
+def save_series_firestore():
+
+    batch = db.batch()
+
+    for serie_id, serie in series_data.items():
+
+        doc_ref = db.collection(COLLECTION_SERIES).document(serie_id)
+
+        batch.set(doc_ref, serie)
+
+    count_storage_ops("write", len(series_data))
+
+    batch.commit()
+
+
+
+@storage_op()
+
+def load_series_firestore():
+
+    docs = stream_docs(db.collection(COLLECTION_SERIES))
+
+    result = {}
+
+    for doc in docs:
+
+        result[doc.id] = doc.to_dict()
+
+    return result
+
+
+
+@storage_op()
+
+def load_drafts_firestore():
+
+    photos, series = {}, {}
+
+    for doc in stream_docs(db.collection(COLLECTION_DRAFTS)):
+
+        data = doc.to_dict()
+
+        if data.get("photo"):
+
+            photos[int(doc.id)] = data["photo"]
+
+        if data.get("serie"):
+
+            series[int(doc.id)] = data["serie"]
+
+    return photos, series
+
+
+
+@storage_op()
+
+def load_content_views_firestore():
+
+    # Documentos "<tipo>_<clave>" con el total de vistas de cada video, serie o capítulo
+
+    counters = ContentViewCounters()
+
+    for doc in stream_docs(db.collection(COLLECTION_CONTENT_STATS)):
+
+        kind, key = doc.id.split("_", 1)
+
+        if kind in counters.totals:
+
+            counters.totals[kind][key] = doc.to_dict().get("views", 0)
+
+    return counters
+
+
+
+@storage_op()
+
+def save_content_views_firestore(pending):
+
+    """Un Increment por contenido con vistas nuevas, en lotes de 500 (límite de Firestore).
+
+
+
+    Devuelve los deltas que no se guardaron: si falla un lote, los anteriores ya sumaron
+
+    su Increment y no deben volver a la cola."""
+
+    items = list(pending.items())
+
+    for start in range(0, len(items), 500):
+
+        try:
+
+            batch = db.batch()
+
+            chunk = items[start:start + 500]
+
+            for (kind, key), delta in chunk:
+
+                doc_ref = db.collection(COLLECTION_CONTENT_STATS).document(f"{kind}_{key}")
+
+                batch.set(doc_ref, {"views": firestore.Increment(delta)}, merge=True)
+
+            count_storage_ops("write", len(chunk))
+
+            batch.commit()
+
+        except Exception as e:
+
+            logger.error(f"Error guardando vistas por contenido: {e}")
+
+            return dict(items[start:])
+
+    return {}
+
+
+
+@storage_op()
+
+def load_content_totals_firestore(kind):
+
+    # Totales de un tipo guardados por todos los workers (ids "<tipo>_<clave>")
+
+    query = (
+
+        db.collection(COLLECTION_CONTENT_STATS)
+
+        .order_by("__name__")
+
+        .start_at({"__name__": f"{kind}_"})
+
+        .end_before({"__name__": f"{kind}`"})  # "`" sigue a "_" en ASCII: solo ids con el prefijo
+
+    )
+
+    return {doc.id.split("_", 1)[1]: doc.to_dict().get("views", 0) for doc in stream_docs(query)}
+
+
+
+@storage_op("write")
+
+def save_worker_stats_firestore(worker, data):
+
+    # Agregados de /stats de un worker (sus usuarios): /stats suma los de todos
+
+    db.collection(COLLECTION_WORKER_STATS).document(f"worker_{worker}").set(data)
+
+
+
+def load_worker_stats_firestore(workers):
+
+    # Una lectura por worker; None si aún no ha publicado nada
+
+    return [load_doc(COLLECTION_WORKER_STATS, f"worker_{worker}") for worker in workers]
+
+
+
+# --- Escrituras por documento ---
+
+# Cada operación escribe solo el documento que cambió: evita reescribir todas las
+
+# colecciones en cada vista y que un proceso pise los datos de otro.
+
+@storage_op()
+
+def delete_user_premium_docs(user_ids):
+
+    batch = db.batch()
+
+    for uid in user_ids:
+
+        batch.delete(db.collection(COLLECTION_USERS).document(str(uid)))
+
+    count_storage_ops("write", len(user_ids))
+
+    batch.commit()
+
+
+
+@storage_op("write")
+
+def save_user_premium_doc(user_id):
+
+    db.collection(COLLECTION_USERS).document(str(user_id)).set(user_premium_doc(users[user_id]))
+
+
+
+@storage_op("write")
+
+def save_video_doc(pkg_id):
+
+    db.collection(COLLECTION_VIDEOS).document(pkg_id).set(content_packages[pkg_id])
+
+
+
+@storage_op("write")
+
+def save_serie_doc(serie_id):
+
+    db.collection(COLLECTION_SERIES).document(serie_id).set(series_data[serie_id])
+
+
+
+@storage_op("write")
+
+def add_known_chat_firestore(chat_id, added_ts):
+
+    doc_ref = db.collection(COLLECTION_CHATS).document("chats")
+
+    doc_ref.set({"chat_ids": firestore.ArrayUnion([chat_id]), "added_at": {str(chat_id): added_ts}}, merge=True)
+
+
+
+@storage_op("write")
+
+def remove_known_chat_firestore(chat_id):
+
+    doc_ref = db.collection(COLLECTION_CHATS).document("chats")
+
+    doc_ref.set({"chat_ids": firestore.ArrayRemove([chat_id])}, merge=True)
+
+
+
+@storage_op("write")
+
+def save_draft_doc(user_id, draft):
+
+    # Borradores de contenido del admin (sinopsis pendiente y serie en creación)
+
+    doc_ref = db.collection(COLLECTION_DRAFTS).document(str(user_id))
+
+    if draft is None:
+
+        doc_ref.delete()
+
+    else:
+
+        doc_ref.set(draft)
+
+
+
+async def save_draft(user_id):
+
+    # Copia tomada en el event loop: el hilo no lee la serie mientras un álbum le agrega capítulos
+
+    photo = current_photo.get(user_id)
+
+    serie = current_series.get(user_id)
+
+    draft = None
+
+    if photo is not None or serie is not None:
+
+        draft = {
+
+            "photo": dict(photo) if photo else None,
+
+            "serie": {**serie, "capitulos": list(serie["capitulos"])} if serie else None,
+
+        }
+
+    await asyncio.to_thread(save_draft_doc, user_id, draft)
+
+
+
+@storage_op("read")
+
+def load_doc(collection, doc_id):
+
+    doc = db.collection(collection).document(doc_id).get()
+
+    return doc.to_dict() if doc.exists else None
+
+
+
+@storage_op()
+
+def load_catalog_page_firestore(cursor, size):
+
+    # Página del catálogo por rangos de id (order_by + start_after + limit) sin leer toda la colección
+
+    entries, full = [], False
+
+    for kind, collection in (("video", COLLECTION_VIDEOS), ("serie", COLLECTION_SERIES)):
+
+        query = db.collection(collection).order_by("__name__", direction=firestore.Query.DESCENDING)
+
+        if cursor is not None:
+
+            cursor_id, cursor_kind = cursor
+
+            # Con el mismo id en las dos colecciones desempata el tipo, como en CatalogOrder
+
+            bound = {"__name__": cursor_id}
+
+            query = query.start_at(bound) if kind < cursor_kind else query.start_after(bound)
+
+        docs = list(stream_docs(query.select(["title", "caption"]).limit(size)))
+
+        full = full or len(docs) == size
+
+        entries += [((doc.id, kind), doc.to_dict()) for doc in docs]
+
+    entries.sort(key=lambda entry: entry[0], reverse=True)
+
+    page = entries[:size]
+
+    more = len(entries) > size or full
+
+    return page, (page[-1][0] if page and more else None)
+
+
+
+def index_content(kind, item_id, item):
+
+    # Todo contenido nuevo o leído de Firestore entra en la búsqueda inline y en /catalogo
+
+    catalog_index.add(kind, item_id, item)
+
+    catalog_order.add(kind, item_id)
+
+
+
+# Con varios workers, el contenido creado en otro proceso se lee de Firestore al primer acceso.
+
+# Los ids que no existen se recuerdan un tiempo: un enlace falso no lee Firestore cada vez
+
+MISSING_CONTENT_TTL = 60
+
+MISSING_CONTENT_SIZE = 4096
+
+missing_content = {}  # {(colección, id): instante (monotonic) hasta el que se da por inexistente}
+
+
+
+async def load_shared_content(collection, kind, item_id, cache):
+
+    key = (collection, item_id)
+
+    now = time.monotonic()
+
+    if missing_content.get(key, 0) > now:
+
+        return None
+
+    item = await asyncio.to_thread(load_doc, collection, item_id)
+
+    if item_id in cache:
+
+        return cache[item_id]  # Otro update lo cargó mientras se leía
+
+    if item is None:
+
+        missing_content[key] = now + MISSING_CONTENT_TTL
+
+        if len(missing_content) > MISSING_CONTENT_SIZE:
+
+            del missing_content[next(iter(missing_content))]
+
+        return None
+
+    cache[item_id] = item
+
+    index_content(kind, item_id, item)
+
+    return item
+
+
+
+async def get_content_package(pkg_id):
+
+    pkg = content_packages.get(pkg_id)
+
+    if pkg is None and WEB_WORKERS > 1:
+
+        pkg = await load_shared_content(COLLECTION_VIDEOS, "video", pkg_id, content_packages)
+
+    return pkg
+
+
+
+async def get_serie(serie_id):
+
+    serie = series_data.get(serie_id)
+
+    if serie is None and WEB_WORKERS > 1:
+
+        serie = await load_shared_content(COLLECTION_SERIES, "serie", serie_id, series_data)
+
+    return serie
+
+
+
+@storage_op()
+
+def load_new_content_firestore(collection, since_id):
+
+    query = db.collection(collection).order_by("__name__").start_at({"__name__": since_id})
+
+    return [(doc.id, doc.to_dict()) for doc in stream_docs(query)]
+
+
+
+async def catalog_refresher():
+
+    """Con varios workers, incorpora a la búsqueda inline y a /catalogo lo publicado en otros procesos.
+
+
+
+    Los ids crecen con la hora de publicación: cada pasada lee por rango de id lo creado en
+
+    los dos últimos intervalos (margen para un guardado que tarde) y salta lo ya conocido."""
+
+    while True:
+
+        await asyncio.sleep(CATALOG_REFRESH_INTERVAL)
+
+        since_id = content_id_at(time.time() - 2 * CATALOG_REFRESH_INTERVAL)
+
+        try:
+
+            for kind, collection, cache in (("video", COLLECTION_VIDEOS, content_packages), ("serie", COLLECTION_SERIES, series_data)):
+
+                for item_id, item in await asyncio.to_thread(load_new_content_firestore, collection, since_id):
+
+                    if item_id not in cache:
+
+                        cache[item_id] = item
+
+                        index_content(kind, item_id, item)
+
+                        missing_content.pop((collection, item_id), None)
+
+        except Exception as e:
+
+            logger.error(f"Error actualizando el catálogo: {e}")
+
+
+
+# --- Guardar y cargar todo ---
+
+def save_data():
+
+    save_user_premium_firestore()
+
+    save_videos_firestore()
+
+    save_user_daily_views_firestore()
+
+    save_known_chats_firestore()
+
+    save_series_firestore()
+
+
+
+def load_data():
+
+    global users, view_counts, content_packages, known_chats, known_chat_added, series_data, current_photo, current_series, content_views
+
+    users = load_user_premium_firestore()
+
+    view_counts = load_user_daily_views_firestore(make_view_counters())
+
+    content_packages = load_videos_firestore()
+
+    known_chats, known_chat_added = load_known_chats_firestore()
+
+    series_data = load_series_firestore()
+
+    current_photo, current_series = load_drafts_firestore()
+
+    content_views = load_content_views_firestore()
+
+    load_today_sketch()
+
+    catalog_index.rebuild(content_packages, series_data)
+
+    catalog_order.rebuild(content_packages, series_data)
+
+    rebuild_expiry_schedule()
+
+    rebuild_admin_stats()
+
+
+
+# --- Planes ---
+
+FREE_LIMIT_VIDEOS = 89
+
+PRO_LIMIT_VIDEOS = 50
+
+PLAN_PRO_ITEM = {
+
+    "title": "Plan Pro",
+
+    "description": "50 videos diarios, sin reenvíos ni compartir.",
+
+    "payload": "plan_pro", # Usado como plan_type
+
+    "currency": "XTR",
+
+    "prices": [LabeledPrice("Plan Pro por 30 días", 1)],
+
+}
+
+PLAN_ULTRA_ITEM = {
+
+    "title": "Plan Ultra",
+
+    "description": "Videos y reenvíos ilimitados, sin restricciones.",
+
+    "payload": "plan_ultra", # Usado como plan_type
+
+    "currency": "XTR",
+
+    "prices": [LabeledPrice("Plan Ultra por 30 días", 1)],
+
+}
+
+
+
+# --- Control acceso ---
+
+# Vistas diarias por plan (None = ilimitadas) y planes que permiten reenviar
+
+PLAN_VIEW_LIMITS = {
+
+    "plan_ultra": None,
+
+    "premium_legacy": None,
+
+    "plan_pro": PRO_LIMIT_VIDEOS,
+
+    "free": FREE_LIMIT_VIDEOS,
+
+}
+
+RESEND_PLANS = ("plan_ultra", "premium_legacy")
+
+
+
+class Entitlement:
+
+    """Derechos de un usuario resueltos una sola vez por update."""
+
+    __slots__ = ("plan_type", "expire_at", "limit", "remaining", "can_resend", "day")
+
+
+
+    def __init__(self, plan_type, expire_at, limit, remaining, can_resend, day):
+
+        self.plan_type = plan_type
+
+        self.expire_at = expire_at
+
+        self.limit = limit
+
+        self.remaining = remaining
+
+        self.can_resend = can_resend
+
+        self.day = day
+
+
+
+    @property
+
+    def is_premium(self):
+
+        return self.plan_type != "free"
+
+
+
+    @property
+
+    def can_view(self):
+
+        return self.remaining is None or self.remaining > 0
+
+
+
+def get_or_create_user(user_id):
+
+    record = users.get(user_id)
+
+    if record is None:
+
+        record = users[user_id] = UserRecord()
+
+    return record
+
+
+
+def resolve_entitlement(user_id):
+
+    # Una sola lectura del reloj y del registro para plan, expiración, vistas y reenvío
+
+    now = time.time()
+
+    day = int(now) // 86400
+
+    plan_type, expire_at = "free", None
+
+    record = users.get(user_id)
+
+    if record is not None and record.expire_ts > now:
+
+        plan_type, expire_at = record.plan_type, record.expire_at
+
+    used = view_counts.get(user_id, day)
+
+    limit = PLAN_VIEW_LIMITS.get(plan_type, FREE_LIMIT_VIDEOS)
+
+    remaining = None if limit is None else max(0, limit - used)
+
+    return Entitlement(plan_type, expire_at, limit, remaining, plan_type in RESEND_PLANS, day)
+
+
+
+def is_premium(user_id):
+
+    # Verifica si el usuario tiene CUALQUIER plan pago activo.
+
+    return resolve_entitlement(user_id).is_premium
+
+
+
+def get_user_plan_type(user_id):
+
+    return resolve_entitlement(user_id).plan_type
+
+
+
+def can_resend_content(user_id):
+
+    # SOLO el plan "ultra" (o "premium_legacy" para compatibilidad) permite reenviar.
+
+    return resolve_entitlement(user_id).can_resend
+
+
+
+def can_view_video(user_id):
+
+    return resolve_entitlement(user_id).can_view
+
+
+
+@storage_op("write")
+
+def increment_views_firestore(user_id, key, delta):
+
+    # Incremento atómico en Firestore: no sobrescribe el documento ni pierde vistas concurrentes
+
+    doc_ref = db.collection(COLLECTION_VIEWS).document(str(user_id))
+
+    doc_ref.set({key: firestore.Increment(delta)}, merge=True)
+
+
+
+@firestore.transactional
+
+def reserve_view_transaction(transaction, doc_ref, key, limit):
+
+    snapshot = doc_ref.get(transaction=transaction)
+
+    count = (snapshot.to_dict() or {}).get(key, 0) if snapshot.exists else 0
+
+    if count >= limit:
+
+        return None
+
+    transaction.set(doc_ref, {key: count + 1}, merge=True)
+
+    return count + 1
+
+
+
+@storage_op("read")
+
+def reserve_view_firestore(user_id, key, limit):
+
+    # firestore.transactional devuelve un objeto sin __name__: se mide esta función
+
+    doc_ref = db.collection(COLLECTION_VIEWS).document(str(user_id))
+
+    count = reserve_view_transaction(db.transaction(), doc_ref, key, limit)
+
+    if count is not None:
+
+        count_storage_ops("write")  # Sin vista reservada la transacción no escribe
+
+    return count
+
+
+
+def add_view_count(user_id, day, delta):
+
+    # El total del día de /stats cambia lo mismo que el contador (que no baja de 0 ni toca días cerrados)
+
+    before = view_counts.get(user_id, day)
+
+    view_counts.add(user_id, day, delta)
+
+    admin_stats.add_views(day, view_counts.get(user_id, day) - before)
+
+
+
+def set_view_count(user_id, day, count):
+
+    before = view_counts.get(user_id, day)
+
+    view_counts.set(user_id, day, count)
+
+    admin_stats.add_views(day, view_counts.get(user_id, day) - before)
+
+
+
+async def register_view(user_id, day=None):
+
+    if day is None:
+
+        day = utc_day()
+
+    add_view_count(user_id, day, 1)
+
+    await asyncio.to_thread(increment_views_firestore, user_id, day_key(day), 1)
+
+
+
+async def reserve_view(user_id, ent=None):
+
+    """Comprueba el límite diario y reserva una vista en una sola operación.
+
+
+
+    Devuelve el día reservado (para poder devolver la vista con refund_view) o None si
+
+    el usuario ya alcanzó su límite.
+
+    """
+
+    if ent is None:
+
+        ent = resolve_entitlement(user_id)
+
+    day = ent.day
+
+
+
+    # Camino rápido: los planes ilimitados no necesitan comprobar nada
+
+    if ent.limit is None:
+
+        await register_view(user_id, day)
+
+        return day
+
+
+
+    if QUOTA_MODE == "transaction":
+
+        # Varias instancias: la comprobación y el incremento son atómicos en Firestore
+
+        count = await asyncio.to_thread(reserve_view_firestore, user_id, day_key(day), ent.limit)
+
+        if count is None:
+
+            return None
+
+        set_view_count(user_id, day, count)
+
+        return day
+
+
+
+    # Una instancia: este proceso es dueño del usuario y la comprobación + incremento
+
+    # en memoria no cede el event loop entre medias
+
+    if view_counts.get(user_id, day) >= ent.limit:
+
+        return None
+
+    add_view_count(user_id, day, 1)
+
+    await asyncio.to_thread(increment_views_firestore, user_id, day_key(day), 1)
+
+    return day
+
+
+
+async def refund_view(user_id, day):
+
+    add_view_count(user_id, day, -1)
+
+    await asyncio.to_thread(increment_views_firestore, user_id, day_key(day), -1)
+
+
+
+# --- Vistas por contenido ---
+
+class ContentViewCounters:
+
+    """Vistas por video, serie y capítulo ("<serie_id>_<n>").
+
+
+
+    Cada vista suma en memoria y en los deltas pendientes; stats_flusher los
+
+    guarda cada STATS_FLUSH_INTERVAL con un Increment por contenido, así que muchas
+
+    vistas del mismo contenido cuestan una sola escritura."""
+
+
+
+    def __init__(self):
+
+        self.totals = {"video": {}, "serie": {}, "cap": {}}
+
+        self.pending = {}  # {(tipo, clave): delta}
+
+
+
+    def add(self, kind, key, delta=1):
+
+        totals = self.totals[kind]
+
+        totals[key] = totals.get(key, 0) + delta
+
+        self.pending[(kind, key)] = self.pending.get((kind, key), 0) + delta
+
+
+
+    def take_pending(self):
+
+        pending, self.pending = self.pending, {}
+
+        return pending
+
+
+
+    def restore_pending(self, pending):
+
+        # Si la escritura falló, los deltas vuelven a la cola (los totales ya los incluyen)
+
+        for kind_key, delta in pending.items():
+
+            self.pending[kind_key] = self.pending.get(kind_key, 0) + delta
+
+
+
+    def top(self, kind, n):
+
+        return heapq.nlargest(n, self.totals[kind].items(), key=itemgetter(1))
+
+
+
+content_views = ContentViewCounters()
+
+
+
+def record_content_view(user_id, kind, item_id, chapter=None):
+
+    # Se llama después de entregar el video; chapter empieza en 1
+
+    record_unique_viewer(user_id, kind, item_id)
+
+    if kind == "serie":
+
+        content_views.add("serie", item_id)
+
+        content_views.add("cap", f"{item_id}_{chapter}")
+
+    else:
+
+        content_views.add("video", item_id)
+
+
+
+async def flush_content_views():
+
+    pending = content_views.take_pending()
+
+    if not pending:
+
+        return
+
+    unsaved = await asyncio.to_thread(save_content_views_firestore, pending)
+
+    if unsaved:
+
+        content_views.restore_pending(unsaved)
+
+
+
+async def shared_content_totals(kind):
+
+    # Lo guardado por todos los workers más lo que este aún no ha guardado
+
+    totals = await asyncio.to_thread(load_content_totals_firestore, kind)
+
+    for (pending_kind, key), delta in content_views.pending.items():
+
+        if pending_kind == kind:
+
+            totals[key] = totals.get(key, 0) + delta
+
+    return totals
+
+
+
+published_stats = None  # últimos agregados de /stats publicados por este worker
+
+
+
+async def publish_worker_stats():
+
+    # Solo con varios workers y si algo cambió desde la última vez
+
+    global published_stats
+
+    if WEB_WORKERS == 1 or current_worker is None:
+
+        return
+
+    snapshot = admin_stats.snapshot(time.time())
+
+    data = {
+
+        "plans": {key[len("plan:"):]: count for key, count in snapshot.items() if key.startswith("plan:")},
+
+        "day": utc_day(),
+
+        "views_today": snapshot["views_today"],
+
+    }
+
+    if data == published_stats:
+
+        return
+
+    try:
+
+        await asyncio.to_thread(save_worker_stats_firestore, current_worker, data)
+
+    except Exception as e:
+
+        logger.error(f"Error publicando las estadísticas del worker: {e}")
+
+        return
+
+    published_stats = data
+
+
+
+async def stats_flusher():
+
+    await publish_worker_stats()  # los demás workers no esperan al primer intervalo
+
+    while True:
+
+        await asyncio.sleep(STATS_FLUSH_INTERVAL)
+
+        await flush_content_views()
+
+        await flush_sketches()
+
+        await publish_worker_stats()
+
+
+
+# --- Espectadores únicos (HyperLogLog) ---
+
+MASK64 = (1 << 64) - 1
+
+DAY_SKETCH_PRECISION = 14      # 16 KiB, ~0,8 % de error para espectadores únicos por día
+
+CONTENT_SKETCH_PRECISION = 11  # 2 KiB como máximo, ~2,3 % por video o serie
+
+HLL_POW2 = [2.0 ** -rank for rank in range(65)]
+
+
+
+def hash64(value):
+
+    # splitmix64: reparte ids consecutivos de Telegram por todos los bits
+
+    x = (value + 0x9E3779B97F4A7C15) & MASK64
+
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+
+    return x ^ (x >> 31)
+
+
+
+class HyperLogLog:
+
+    """Estimador de cardinalidad con 2**p registros de 1 byte.
+
+
+
+    Mientras hay pocos espectadores guarda solo los registros usados en un array
+
+    ordenado (índice << 6 | rango, 4 bytes cada uno) y pasa a la forma densa al
+
+    ocupar lo mismo. Dos sketches se combinan con el máximo registro a registro,
+
+    así que combinar es idempotente y el orden entre instancias da igual."""
+
+
+
+    __slots__ = ("p", "dense", "sparse")
+
+
+
+    def __init__(self, p):
+
+        self.p = p
+
+        self.dense = None
+
+        self.sparse = array("I")
+
+
+
+    def _set(self, index, rank):
+
+        if self.dense is not None:
+
+            if rank > self.dense[index]:
+
+                self.dense[index] = rank
+
+            return
+
+        entry = index << 6 | rank
+
+        i = bisect_left(self.sparse, index << 6)
+
+        if i < len(self.sparse) and self.sparse[i] >> 6 == index:
+
+            if rank > self.sparse[i] & 63:
+
+                self.sparse[i] = entry
+
+            return
+
+        self.sparse.insert(i, entry)
+
+        if len(self.sparse) * 4 > 1 << self.p:
+
+            self._densify()
+
+
+
+    def _densify(self):
+
+        self.dense = bytearray(1 << self.p)
+
+        for entry in self.sparse:
+
+            self.dense[entry >> 6] = entry & 63
+
+        self.sparse = array("I")
+
+
+
+    def add(self, value):
+
+        x = hash64(value)
+
+        rest_bits = 64 - self.p
+
+        rest = x & ((1 << rest_bits) - 1)
+
+        self._set(x >> rest_bits, rest_bits - rest.bit_length() + 1)
+
+
+
+    def merge(self, other):
+
+        if other.dense is not None:
+
+            for index, rank in enumerate(other.dense):
+
+                if rank:
+
+                    self._set(index, rank)
+
+        else:
+
+            for entry in other.sparse:
+
+                self._set(entry >> 6, entry & 63)
+
+
+
+    def count(self):
+
+        m = 1 << self.p
+
+        if self.dense is not None:
+
+            zeros = self.dense.count(0)
+
+            total = sum(HLL_POW2[rank] for rank in self.dense)
+
+        else:
+
+            zeros = m - len(self.sparse)
+
+            total = zeros + sum(HLL_POW2[entry & 63] for entry in self.sparse)
+
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / total
+
+        if estimate <= 2.5 * m and zeros:
+
+            estimate = m * math.log(m / zeros)  # corrección para pocos elementos
+
+        return round(estimate)
+
+
+
+    def to_doc(self):
+
+        # Formato compacto para Firestore: precisión y registros comprimidos
+
+        if self.dense is not None:
+
+            return {"p": self.p, "format": "dense", "data": zlib.compress(bytes(self.dense))}
+
+        return {"p": self.p, "format": "sparse", "data": zlib.compress(self.sparse.tobytes())}
+
+
+
+    @classmethod
+
+    def from_doc(cls, doc):
+
+        sketch = cls(doc["p"])
+
+        data = zlib.decompress(doc["data"])
+
+        if doc["format"] == "dense":
+
+            sketch.dense = bytearray(data)
+
+        else:
+
+            sketch.sparse.frombytes(data)
+
+        return sketch
+
+
+
+sketches = {}          # {"day_AAAA-MM-DD" | "video_<id>" | "serie_<id>": HyperLogLog}
+
+dirty_sketches = set()
+
+
+
+def sketch_for(key, p):
+
+    sketch = sketches.get(key)
+
+    if sketch is None:
+
+        sketch = sketches[key] = HyperLogLog(p)
+
+    return sketch
+
+
+
+def record_unique_viewer(user_id, kind, item_id):
+
+    for key, p in ((f"day_{day_key(utc_day())}", DAY_SKETCH_PRECISION), (f"{kind}_{item_id}", CONTENT_SKETCH_PRECISION)):
+
+        sketch_for(key, p).add(user_id)
+
+        dirty_sketches.add(key)
+
+
+
+@firestore.transactional
+
+def merge_sketch_transaction(transaction, doc_ref, sketch):
+
+    # Lee lo guardado por todas las instancias, combina y reescribe
+
+    snapshot = doc_ref.get(transaction=transaction)
+
+    if snapshot.exists:
+
+        sketch.merge(HyperLogLog.from_doc(snapshot.to_dict()))
+
+    transaction.set(doc_ref, sketch.to_doc())
+
+
+
+@storage_op()
+
+def save_sketches_firestore(pending):
+
+    # Una transacción (lectura + escritura) por sketch
+
+    for key, sketch in pending.items():
+
+        doc_ref = db.collection(COLLECTION_SKETCHES).document(key)
+
+        merge_sketch_transaction(db.transaction(), doc_ref, sketch)
+
+        count_storage_ops("read")
+
+        count_storage_ops("write")
+
+
+
+async def flush_sketches():
+
+    keys = list(dirty_sketches)
+
+    dirty_sketches.clear()
+
+    if not keys:
+
+        return
+
+    # Se guardan copias: las vistas que lleguen mientras tanto siguen en el sketch local
+
+    pending = {}
+
+    for key in keys:
+
+        pending[key] = HyperLogLog(sketches[key].p)
+
+        pending[key].merge(sketches[key])
+
+    try:
+
+        await asyncio.to_thread(save_sketches_firestore, pending)
+
+    except Exception as e:
+
+        dirty_sketches.update(keys)
+
+        logger.error(f"Error guardando espectadores únicos: {e}")
+
+        return
+
+    # Ya guardados: fuera de memoria salvo el día en curso (se vuelven a crear con la siguiente vista)
+
+    today = f"day_{day_key(utc_day())}"
+
+    for key in keys:
+
+        if key != today and key not in dirty_sketches:
+
+            sketches.pop(key, None)
+
+
+
+def load_today_sketch():
+
+    # Al arrancar se recupera el día en curso para no contar de nuevo a quien ya vio algo hoy
+
+    key = f"day_{day_key(utc_day())}"
+
+    doc = load_doc(COLLECTION_SKETCHES, key)
+
+    sketches.clear()
+
+    if doc is not None:
+
+        sketches[key] = HyperLogLog.from_doc(doc)
+
+
+
+def load_unique_viewers(key):
+
+    # Estimación global: lo guardado por todas las instancias + lo local sin guardar
+
+    doc = load_doc(COLLECTION_SKETCHES, key)
+
+    local = sketches.get(key)
+
+    if doc is None:
+
+        return local.count() if local else 0
+
+    sketch = HyperLogLog.from_doc(doc)
+
+    if local is not None:
+
+        sketch.merge(local)
+
+    return sketch.count()
+
+
+
+def load_unique_viewers_many(keys):
+
+    # Una lectura por clave, todas en el mismo hilo (/top pide una por contenido listado)
+
+    return {key: load_unique_viewers(key) for key in keys}
+
+
+
+def is_admin(user_id):
+
+    return user_id in ADMIN_IDS
+
+
+
+# --- Estadísticas de administración (/stats) ---
+
+NEW_CHATS_WINDOW = 7 * 86400
+
+STATS_PLANS = {"plan_pro": "💎 Plan Pro", "plan_ultra": "👑 Plan Ultra", "premium_legacy": "⭐ Premium (antiguo)"}
+
+
+
+class AdminStats:
+
+    """Agregados de /stats actualizados en O(1) con cada pago, vista o alta de chat.
+
+    check_admin_stats() los contrasta periódicamente con un recuento completo."""
+
+
+
+    def __init__(self):
+
+        self.plans = {}      # {plan_type: usuarios con plan vigente}
+
+        self.views_day = 0
+
+        self.views = 0       # vistas del día views_day
+
+        self.new_chats = {}  # {chat_id: ts de alta} dentro de la ventana, en orden de alta
+
+
+
+    def count_plan(self, plan_type, delta):
+
+        self.plans[plan_type] = self.plans.get(plan_type, 0) + delta
+
+
+
+    def add_views(self, day, delta):
+
+        if day != self.views_day:
+
+            if day < self.views_day:
+
+                return  # Devolución de un día ya cerrado
+
+            self.views_day, self.views = day, 0
+
+        self.views += delta
+
+
+
+    def chat_added(self, chat_id, ts):
+
+        self.new_chats.pop(chat_id, None)  # una nueva alta lo pasa al final
+
+        self.new_chats[chat_id] = ts
+
+
+
+    def chat_removed(self, chat_id):
+
+        self.new_chats.pop(chat_id, None)
+
+
+
+    def snapshot(self, now):
+
+        cutoff = now - NEW_CHATS_WINDOW
+
+        while self.new_chats:
+
+            chat_id, ts = next(iter(self.new_chats.items()))
+
+            if ts >= cutoff:
+
+                break
+
+            del self.new_chats[chat_id]
+
+        result = {f"plan:{plan}": count for plan, count in self.plans.items() if count}
+
+        result["views_today"] = self.views if self.views_day == utc_day() else 0
+
+        result["new_chats_week"] = len(self.new_chats)
+
+        return result
+
+
+
+admin_stats = AdminStats()
+
+
+
+def recount_admin_stats(now):
+
+    # Recuento completo, O(usuarios + chats): solo al cargar y en la comprobación periódica
+
+    result = {}
+
+    for user_id, record in users.items():
+
+        if record.plan_type and owns_user(user_id):
+
+            key = f"plan:{record.plan_type}"
+
+            result[key] = result.get(key, 0) + 1
+
+    result["views_today"] = sum(count for _, count in view_counts.export(utc_day()))
+
+    cutoff = now - NEW_CHATS_WINDOW
+
+    result["new_chats_week"] = sum(1 for chat_id in known_chats if known_chat_added.get(chat_id, 0) >= cutoff)
+
+    return result
+
+
+
+def rebuild_admin_stats():
+
+    # Los planes ya los cuenta rebuild_expiry_schedule(); aquí las vistas de hoy y los chats nuevos
+
+    now = time.time()
+
+    admin_stats.views_day = utc_day()
+
+    admin_stats.views = sum(count for _, count in view_counts.export(admin_stats.views_day))
+
+    admin_stats.new_chats = {}
+
+    for chat_id, ts in sorted(known_chat_added.items(), key=itemgetter(1)):
+
+        if chat_id in known_chats and ts >= now - NEW_CHATS_WINDOW:
+
+            admin_stats.new_chats[chat_id] = ts
+
+
+
+def check_admin_stats():
+
+    now = time.time()
+
+    started = time.perf_counter()
+
+    expected = recount_admin_stats(now)
+
+    current = admin_stats.snapshot(now)
+
+    drift = {key: (current.get(key, 0), expected.get(key, 0)) for key in expected.keys() | current.keys()
+
+             if current.get(key, 0) != expected.get(key, 0)}
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    if not drift:
+
+        logger.info(f"/stats coincide con el recuento completo ({elapsed_ms:.0f} ms)")
+
+        return
+
+    for key, (value, real) in drift.items():
+
+        stats_drift_total.inc(key)
+
+        logger.warning(f"/stats desviado en {key}: {value} (recuento: {real})")
+
+    if any(key.startswith("plan:") for key in drift):
+
+        rebuild_expiry_schedule()
+
+    rebuild_admin_stats()
+
+
+
+async def admin_stats_checker():
+
+    while True:
+
+        await asyncio.sleep(STATS_RECOUNT_INTERVAL)
+
+        try:
+
+            check_admin_stats()
+
+        except Exception as e:
+
+            logger.error(f"Error comprobando /stats: {e}")
+
+
+
+# --- Expiración de planes ---
+
+# Montículos de expiraciones y de avisos. Las entradas no se borran al renovar: al salir
+
+# se descartan si ya no coinciden con la expiración actual del usuario.
+
+expiry_heap = []       # [(expire_ts, user_id)]
+
+notice_heap = []       # [(notify_ts, expire_ts, user_id, days)]
+
+active_premium = {}    # {user_id: plan_type} de los usuarios con plan vigente
+
+notice_queue = asyncio.Queue()
+
+current_worker = None  # índice de este proceso en modo multiproceso
+
+
+
+def owns_user(user_id):
+
+    # En modo multiproceso cada worker solo gestiona a sus usuarios (mismo reparto que el router)
+
+    return WEB_WORKERS == 1 or current_worker is None or user_id % WEB_WORKERS == current_worker
+
+
+
+def set_active_plan(user_id, plan_type):
+
+    previous = active_premium.get(user_id)
+
+    if previous is not None:
+
+        admin_stats.count_plan(previous, -1)
+
+    active_premium[user_id] = plan_type
+
+    admin_stats.count_plan(plan_type, 1)
+
+
+
+def clear_active_plan(user_id):
+
+    previous = active_premium.pop(user_id, None)
+
+    if previous is not None:
+
+        admin_stats.count_plan(previous, -1)
+
+
+
+def schedule_plan_expiry(user_id, record, now=None):
+
+    if not owns_user(user_id):
+
+        return
+
+    now = now or time.time()
+
+    heapq.heappush(expiry_heap, (record.expire_ts, user_id))
+
+    if record.expire_ts > now:
+
+        set_active_plan(user_id, record.plan_type)
+
+    for days in EXPIRY_NOTICE_DAYS:
+
+        notify_ts = record.expire_ts - days * 86400
+
+        if notify_ts > now:
+
+            heapq.heappush(notice_heap, (notify_ts, record.expire_ts, user_id, days))
+
+
+
+def rebuild_expiry_schedule():
+
+    expiry_heap.clear()
+
+    notice_heap.clear()
+
+    active_premium.clear()
+
+    admin_stats.plans.clear()
+
+    now = time.time()
+
+    for user_id, record in users.items():
+
+        if record.plan_type:
+
+            schedule_plan_expiry(user_id, record, now)
+
+
+
+def pop_expired_plans(now, limit):
+
+    expired = []
+
+    while expiry_heap and expiry_heap[0][0] <= now and len(expired) < limit:
+
+        expire_ts, user_id = heapq.heappop(expiry_heap)
+
+        record = users.get(user_id)
+
+        if record is None or record.expire_ts != expire_ts:
+
+            continue  # Renovado o ya limpiado
+
+        record.plan_type = None
+
+        record.expire_at = None
+
+        record.expire_ts = 0.0
+
+        clear_active_plan(user_id)
+
+        if not record.views_on(utc_day()):
+
+            del users[user_id]
+
+        expired.append(user_id)
+
+    return expired
+
+
+
+def pop_due_notices(now):
+
+    due = []
+
+    while notice_heap and notice_heap[0][0] <= now:
+
+        _, expire_ts, user_id, days = heapq.heappop(notice_heap)
+
+        record = users.get(user_id)
+
+        if record is not None and record.expire_ts == expire_ts:
+
+            due.append((user_id, days, record.plan_type, record.expire_at))
+
+    return due
+
+
+
+async def expiry_worker():
+
+    """Elimina en lotes los planes vencidos (memoria y Firestore) y encola los avisos."""
+
+    while True:
+
+        try:
+
+            now = time.time()
+
+            while True:
+
+                expired = pop_expired_plans(now, EXPIRY_BATCH_SIZE)
+
+                if not expired:
+
+                    break
+
+                await asyncio.to_thread(delete_user_premium_docs, expired)
+
+                # Un pago guardado mientras se borraba se habría perdido: se vuelve a guardar
+
+                for user_id in expired:
+
+                    record = users.get(user_id)
+
+                    if record is not None and record.expire_ts > time.time():
+
+                        await asyncio.to_thread(save_user_premium_doc, user_id)
+
+                logger.info(f"Planes expirados eliminados: {len(expired)}")
+
+            for notice in pop_due_notices(now):
+
+                notice_queue.put_nowait(notice)
+
+        except Exception as e:
+
+            logger.error(f"Error revisando expiraciones: {e}")
+
+
+
+        next_events = [heap[0][0] for heap in (expiry_heap, notice_heap) if heap]
+
+        delay = min(next_events, default=now + EXPIRY_CHECK_INTERVAL) - time.time()
+
+        await asyncio.sleep(min(max(delay, 1), EXPIRY_CHECK_INTERVAL))
+
+
+
+async def expiry_notice_sender(bot):
+
+    """Envía los avisos de "tu plan vence en N días" sin superar EXPIRY_NOTICE_RATE."""
+
+    while True:
+
+        user_id, days, plan_type, expire_at = await notice_queue.get()
+
+        await wait_for_admission()
+
+        plan_name = plan_type.replace("plan_", "").replace("premium_legacy", "Ultra").capitalize()
+
+        try:
+
+            await bot.send_message(
+
+                chat_id=user_id,
+
+                text=f"⏳ Tu *Plan {plan_name}* vence en {days} día(s) ({expire_at.strftime('%Y-%m-%d')}).\n"
+
+                     "💎 Renuévalo para no perder tus beneficios: los días se suman a tu plan actual.",
+
+                parse_mode="Markdown",
+
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("💎 Planes", callback_data="planes")]]),
+
+            )
+
+        except Exception as e:
+
+            logger.warning(f"No se pudo avisar la expiración a {user_id}: {e}")
+
+        await asyncio.sleep(1 / EXPIRY_NOTICE_RATE)
+
+
+
+# --- Canales para verificación ---
+
+CHANNELS = {
+
+    "canal_1": "@hsitotv",
+
+    "canal_2": "@Jhonmaxs",
+
+}
+
+
+
+# --- Menú principal ---
+
+def get_main_menu():
+
+    return InlineKeyboardMarkup(
+
+        [
+
+            [
+
+                InlineKeyboardButton("🎧 Audio Libros", url="https://t.me/+3lDaURwlx-g4NWJk"),
+
+                InlineKeyboardButton("📚 Libro PDF", url="https://t.me/+iJ5D1VLCAW5hYzhk"),
+
+            ],
+
+            [
+
+                InlineKeyboardButton("💬 Chat Pedido", url="https://t.me/+6eA7AdRfgq81NzBh"),
+
+                InlineKeyboardButton("📽️ doramas", url="https://t.me/+YIXdwQ9Sa-I3ODYx"),
+
+            ],
+
+            [
+
+                InlineKeyboardButton("📽️ peliculas", url="https://t.me/+rvYUEq-c96kzODE0"),
+
+                InlineKeyboardButton("🎬 series", url="https://t.me/+eYI6JZq72o4xNWFh"),
+
+            ],
+
+            [
+
+                InlineKeyboardButton("📚 Catálogo", callback_data="catalogo_"),
+
+                InlineKeyboardButton("💎 Planes", callback_data="planes"),
+
+               ],
+
+            [
+
+                InlineKeyboardButton("🧑 Perfil", callback_data="perfil"),
+
+            ],
+
+            [
+
+                InlineKeyboardButton("ℹ️ Info", callback_data="info"),
+
+                InlineKeyboardButton("❓ soporte", url="https://t.me/Hsito"),
+
+            ],
+
+        ]
+
+    )
+
+
+
+# --- Catálogo paginado ---
+
+def encode_catalog_cursor(cursor):
+
+    # callback_data "catalogo_" (primera página) o "catalogo_<v|s><id>"
+
+    return "catalogo_" + (cursor[1][0] + cursor[0] if cursor else "")
+
+
+
+def decode_catalog_cursor(data):
+
+    value = data[len("catalogo_"):]
+
+    if not value:
+
+        return None
+
+    return value[1:], "video" if value[0] == "v" else "serie"
+
+
+
+async def catalog_page(cursor):
+
+    # Con un solo worker todo el catálogo está en memoria; con varios, se consulta Firestore
+
+    if WEB_WORKERS > 1:
+
+        return await asyncio.to_thread(load_catalog_page_firestore, cursor, CATALOG_PAGE_SIZE)
+
+    entries, next_cursor = catalog_order.page(cursor, CATALOG_PAGE_SIZE)
+
+    page = []
+
+    for item_id, kind in entries:
+
+        item = content_packages.get(item_id) if kind == "video" else series_data.get(item_id)
+
+        if item is not None:
+
+            page.append(((item_id, kind), item))
+
+    return page, next_cursor
+
+
+
+def content_title(kind, item):
+
+    # Las series guardan su título; en los videos es la primera línea de la sinopsis
+
+    if kind == "serie" and item.get("title"):
+
+        return item["title"]
+
+    return item.get("caption", "").split("\n")[0]
+
+
+
+def catalog_markup(page, next_cursor, first_page, bot_username):
+
+    rows = []
+
+    for (item_id, kind), item in page:
+
+        label = f"📺 {content_title(kind, item)}" if kind == "serie" else f"🎬 {content_title(kind, item)}"
+
+        url = f"https://t.me/{bot_username}?start={kind}_{item_id}"
+
+        rows.append([InlineKeyboardButton(label[:60], url=url)])
+
+    nav = []
+
+    if not first_page:
+
+        nav.append(InlineKeyboardButton("⏮️ Inicio", callback_data="catalogo_"))
+
+    if next_cursor is not None:
+
+        nav.append(InlineKeyboardButton("Siguiente ⏭️", callback_data=encode_catalog_cursor(next_cursor)))
+
+    if nav:
+
+        rows.append(nav)
+
+    rows.append([InlineKeyboardButton("🔙 Menú principal", callback_data="menu_principal")])
+
+    return InlineKeyboardMarkup(rows)
+
+
+
+async def catalogo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    page, next_cursor = await catalog_page(None)
+
+    if not page:
+
+        await update.message.reply_text("📚 El catálogo está vacío por ahora.")
+
+        return
+
+    await update.message.reply_text(
+
+        "📚 Catálogo (lo más nuevo primero):",
+
+        reply_markup=catalog_markup(page, next_cursor, True, context.bot.username),
+
+    )
+
+
+
+# --- Ranking de contenido (admin) ---
+
+TOP_KINDS = {"video": "🎬 Videos", "serie": "📺 Series", "cap": "🎞️ Capítulos"}
+
+
+
+def top_line(kind, key, views, viewers=None):
+
+    if kind == "cap":
+
+        serie_id, chapter = key.rsplit("_", 1)
+
+        serie = series_data.get(serie_id)
+
+        name = f"{serie['title'] if serie else serie_id} - Capítulo {chapter}"
+
+    else:
+
+        item = content_packages.get(key) if kind == "video" else series_data.get(key)
+
+        name = content_title(kind, item) if item else key
+
+    if viewers is None:
+
+        return f"{views} · {name}"
+
+    return f"{views} · 👥 ~{viewers} · {name}"
+
+
+
+async def top(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    """/top [video|serie|cap] [n]: contenido más visto, desde los contadores en memoria
+
+    (con varios workers, desde los totales de Firestore), con sus espectadores únicos."""
+
+    if not is_admin(update.effective_user.id):
+
+        await update.message.reply_text("❌ Comando solo para administradores.")
+
+        return
+
+    args = context.args
+
+    kinds = [args[0]] if args and args[0] in TOP_KINDS else ["video", "serie"]
+
+    n = int(args[-1]) if args and args[-1].isdigit() else 10
+
+    n = max(1, min(n, 50))
+
+
+
+    today = f"day_{day_key(utc_day())}"
+
+    if WEB_WORKERS > 1:
+
+        viewers = await asyncio.to_thread(load_unique_viewers, today)
+
+    else:
+
+        viewers = sketches[today].count() if today in sketches else 0
+
+
+
+    sections = [f"👥 Espectadores únicos hoy: ~{viewers}"]
+
+    for kind in kinds:
+
+        if WEB_WORKERS > 1:
+
+            # Cada worker solo cuenta sus propias vistas en memoria
+
+            ranking = heapq.nlargest(n, (await shared_content_totals(kind)).items(), key=itemgetter(1))
+
+        else:
+
+            ranking = content_views.top(kind, n)
+
+        # Los capítulos no tienen sketch propio; videos y series, sí (ya guardados o aún en memoria)
+
+        viewers = {}
+
+        if kind != "cap":
+
+            viewers = await asyncio.to_thread(load_unique_viewers_many, [f"{kind}_{key}" for key, _ in ranking])
+
+        lines = [
+
+            f"{i}. {top_line(kind, key, views, viewers.get(f'{kind}_{key}'))}"
+
+            for i, (key, views) in enumerate(ranking, 1)
+
+        ]
+
+        sections.append(f"{TOP_KINDS[kind]}\n" + ("\n".join(lines) or "Sin vistas todavía."))
+
+    if WEB_WORKERS > 1:
+
+        sections.append(f"ℹ️ Vistas de todos los workers, con hasta {STATS_FLUSH_INTERVAL} s de retraso")
+
+    await update.message.reply_text(f"🏆 Top {n} por vistas\n\n" + "\n\n".join(sections))
+
+
+
+# --- Resumen de estadísticas (admin) ---
+
+async def shared_admin_stats(now):
+
+    """Agregados de todos los workers: los de este al momento más los que publicaron
+
+    los demás (con hasta STATS_FLUSH_INTERVAL s de retraso). Devuelve también cuántos
+
+    workers no han publicado todavía."""
+
+    others = [worker for worker in range(WEB_WORKERS) if worker != current_worker]
+
+    docs = await asyncio.to_thread(load_worker_stats_firestore, others)
+
+    chat_ids, added_at = await asyncio.to_thread(load_known_chats_firestore)
+
+    snapshot = admin_stats.snapshot(now)
+
+    today = utc_day()
+
+    for doc in filter(None, docs):
+
+        for plan, count in doc.get("plans", {}).items():
+
+            snapshot[f"plan:{plan}"] = snapshot.get(f"plan:{plan}", 0) + count
+
+        if doc.get("day") == today:
+
+            snapshot["views_today"] += doc.get("views_today", 0)
+
+    # Los chats están en un solo documento compartido por todos
+
+    cutoff = now - NEW_CHATS_WINDOW
+
+    snapshot["new_chats_week"] = sum(1 for chat_id in chat_ids if added_at.get(chat_id, 0) >= cutoff)
+
+    return snapshot, len(chat_ids), docs.count(None)
+
+
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    """/stats: resumen para administradores desde los agregados, sin recorrer usuarios ni chats
+
+    (con varios workers, sumando los que publica cada uno en Firestore)."""
+
+    if not is_admin(update.effective_user.id):
+
+        await update.message.reply_text("❌ Comando solo para administradores.")
+
+        return
+
+    today = f"day_{day_key(utc_day())}"
+
+    missing = 0
+
+    if WEB_WORKERS > 1:
+
+        snapshot, chat_count, missing = await shared_admin_stats(time.time())
+
+        viewers = await asyncio.to_thread(load_unique_viewers, today)
+
+    else:
+
+        snapshot, chat_count = admin_stats.snapshot(time.time()), len(known_chats)
+
+        viewers = sketches[today].count() if today in sketches else 0
+
+
+
+    lines = ["📊 Estadísticas", ""]
+
+    for plan, label in STATS_PLANS.items():
+
+        count = snapshot.get(f"plan:{plan}", 0)
+
+        if count or plan != "premium_legacy":
+
+            lines.append(f"{label} activos: {count}")
+
+    lines += [
+
+        f"▶️ Vistas hoy: {snapshot['views_today']}",
+
+        f"👥 Espectadores únicos hoy: ~{viewers}",
+
+        f"📢 Chats registrados: {chat_count} (+{snapshot['new_chats_week']} en 7 días)",
+
+        f"🎬 Catálogo: {len(content_packages)} videos, {len(series_data)} series",
+
+    ]
+
+    if WEB_WORKERS > 1:
+
+        lines.append(f"\nℹ️ Todos los workers, con hasta {STATS_FLUSH_INTERVAL} s de retraso")
+
+        if missing:
+
+            lines.append(f"⚠️ {missing} worker(s) aún sin publicar sus planes y vistas")
+
+    await update.message.reply_text("\n".join(lines))
+
+
+
+# --- Función auxiliar para generar botones de capítulos en cuadrícula ---
+
+def generate_chapter_buttons(serie_id, num_chapters, chapters_per_row=5):
+
+    buttons = []
+
+    row = []
+
+    for i in range(num_chapters):
+
+        row.append(InlineKeyboardButton(str(i + 1), callback_data=f"cap_{serie_id}_{i}"))
+
+        if len(row) == chapters_per_row:
+
+            buttons.append(row)
+
+            row = []
+
+    if row: # Añadir la última fila si no está completa
+
+        buttons.append(row)
+
+    
+
+    # Añadir botón "Volver al menú principal" al final
+
+    buttons.append([InlineKeyboardButton("🔙 Volver al menú principal", callback_data="menu_principal")])
+
+    return InlineKeyboardMarkup(buttons)
+
+
+
+# --- Función auxiliar para verificar suscripción a canales ---
+
+async def check_channel_subscription(user_id, context: ContextTypes.DEFAULT_TYPE):
+
+    not_joined = []
+
+    for name, username in CHANNELS.items():
+
+        try:
+
+            member = await context.bot.get_chat_member(chat_id=username, user_id=user_id)
+
+            if member.status not in ["member", "administrator", "creator"]:
+
+                not_joined.append(username)
+
+        except Exception as e:
+
+            logger.warning(f"Error verificando canal {username} para user {user_id}: {e}")
+
+            not_joined.append(username) # Asumir no unido si hay error
+
+    return not_joined
+
+
+
+# --- Control de flujo por usuario y admisión global ---
+
+flood_stats = {"rate_limited": 0, "user_pending": 0, "merged": 0, "shed": 0, "deferred": 0}
+
+
+
+class TokenBucketLimiter:
+
+    """Token bucket por usuario: `rate` tokens por segundo, hasta `burst` acumulados."""
+
+
+
+    def __init__(self, rate, burst, max_users=100000):
+
+        self.rate = rate
+
+        self.burst = burst
+
+        self.max_users = max_users
+
+        self._buckets = {}  # {user_id: [tokens, último instante]}
+
+
+
+    def allow(self, user_id):
+
+        now = time.monotonic()
+
+        bucket = self._buckets.get(user_id)
+
+        if bucket is None:
+
+            if len(self._buckets) >= self.max_users:
+
+                self._prune(now)
+
+            self._buckets[user_id] = [self.burst - 1, now]
+
+            return True
+
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+
+        bucket[1] = now
+
+        if tokens < 1:
+
+            bucket[0] = tokens
+
+            return False
+
+        bucket[0] = tokens - 1
+
+        return True
+
+
+
+    def _prune(self, now):
+
+        # Un bucket que ya se habría recargado por completo equivale a no tenerlo
+
+        full_after = self.burst / self.rate if self.rate > 0 else float("inf")
+
+        for user_id in [uid for uid, (_, last) in self._buckets.items() if now - last >= full_after]:
+
+            del self._buckets[user_id]
+
+
+
+callback_limiter = TokenBucketLimiter(CALLBACK_RATE, CALLBACK_BURST)
+
+pending_navigation = {}  # {user_id: update_id del último callback de navegación recibido}
+
+
+
+# Callbacks que nunca se descartan por carga: reproducción, verificación y compras
+
+CRITICAL_CALLBACK_PREFIXES = ("play_video_", "cap_", "serie_list_", "verify", "comprar_")
+
+
+
+def is_overloaded():
+
+    return app_telegram.pending_updates() >= ADMISSION_QUEUE_HIGH
+
+
+
+def is_payment_update(update):
+
+    return bool(update.pre_checkout_query or (update.message and update.message.successful_payment))
+
+
+
+async def admit_update(update, user_pending):
+
+    """Control de flujo a la llegada, antes de esperar el turno del usuario o un hueco de
+
+    handler: devuelve False si el update se descarta (los callbacks se responden aquí)."""
+
+    query = update.callback_query
+
+    user = update.effective_user
+
+    if user_pending >= USER_PENDING_MAX and not is_payment_update(update) and not (user and is_admin(user.id)):
+
+        flood_stats["user_pending"] += 1
+
+        rate_limited_total.inc("user_pending")
+
+        if query:
+
+            await query.answer("⏳ Vas muy rápido, espera un momento.")
+
+        return False
+
+    if query is None:
+
+        return True
+
+
+
+    if not callback_limiter.allow(query.from_user.id):
+
+        flood_stats["rate_limited"] += 1
+
+        rate_limited_total.inc("callback")
+
+        await query.answer("⏳ Vas muy rápido, espera un momento.")
+
+        return False
+
+
+
+    if is_overloaded() and not (query.data or "").startswith(CRITICAL_CALLBACK_PREFIXES):
+
+        flood_stats["shed"] += 1
+
+        await query.answer("⏳ El bot está muy ocupado, inténtalo de nuevo en unos segundos.", show_alert=True)
+
+        return False
+
+    return True
+
+
+
+async def wait_for_admission():
+
+    # Cede el paso al tráfico de usuarios mientras la cola esté por encima del umbral
+
+    if is_overloaded():
+
+        flood_stats["deferred"] += 1
+
+        while is_overloaded():
+
+            await asyncio.sleep(1)
+
+
+
+async def broadcast_photo(bot, photo_id, caption):
+
+    """Envía el anuncio de nuevo contenido a los grupos conocidos en segundo plano."""
+
+    # Con varios workers cada proceso solo conoce los chats que registró: leer la lista compartida
+
+    chats = (await asyncio.to_thread(load_known_chats_firestore))[0] if WEB_WORKERS > 1 else list(known_chats)
+
+    for chat_id in chats:
+
+        await wait_for_admission()
+
+        try:
+
+            await bot.send_photo(
+
+                chat_id=chat_id,
+
+                photo=photo_id,
+
+                caption=caption,
+
+                parse_mode="Markdown",
+
+                protect_content=False,
+
+            )
+
+        except Exception as e:
+
+            logger.warning(f"No se pudo enviar a {chat_id}: {e}")
+
+
+
+# --- Handlers ---
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    args = context.args
+
+    user_id = update.effective_user.id
+
+    bot_username = (await context.bot.get_me()).username
+
+
+
+    # Verificar suscripción a canales al inicio
+
+    not_joined_channels = await check_channel_subscription(user_id, context)
+
+
+
+    # Si el usuario NO está unido a todos los canales, pedir verificación
+
+    if not_joined_channels:
+
+        await update.message.reply_text(
+
+            "👋 ¡Hola! Primero debes unirte a todos nuestros canales para usar este bot. Una vez te hayas unido, haz clic en 'Verificar suscripción' para continuar.",
+
+            reply_markup=InlineKeyboardMarkup(
+
+                [
+
+                    [
+
+                        InlineKeyboardButton("🔗 Unirse a canal 1", url=f"https://t.me/{CHANNELS['canal_1'][1:]}"),
+
+                        InlineKeyboardButton("🔗 Unirse a canal 2", url=f"https://t.me/{CHANNELS['canal_2'][1:]}"),
+
+                    ],
+
+                    [InlineKeyboardButton("✅ Verificar suscripción", callback_data="verify")],
+
+                ]
+
+            ),
+
+        )
+
+        return # Salir de la función si no está verificado
+
+
+
+    # Si el usuario YA está unido a todos los canales, proceder con la lógica normal o menú principal
+
+    # Manejo del start link para mostrar sinopsis + botón "Ver Video" (Videos individuales)
+
+    if args and args[0].startswith("video_"):
+
+        pkg_id = args[0].split("_")[1]
+
+        pkg = await get_content_package(pkg_id)
+
+        if not pkg:
+
+            await update.message.reply_text("❌ Contenido no disponible.")
+
+            return
+
+
+
+        # Mostrar sinopsis y botón "Ver Video"
+
+        ver_video_button = InlineKeyboardMarkup(
+
+            [
+
+                [
+
+                    InlineKeyboardButton(
+
+                        "▶️ Ver Video", callback_data=f"play_video_{pkg_id}" # Callback para cargar el video
+
+                    )
+
+                ]
+
+            ]
+
+        )
+
+        # MODIFICACIÓN AQUI: Enviar la foto junto con la sinopsis para videos individuales
+
+        if pkg.get("photo_id"):
+
+            await update.message.reply_photo(
+
+                photo=pkg["photo_id"],
+
+                caption=f"🎬 **{pkg.get('caption', 'Contenido:')}**\n\nPresiona 'Ver Video' para iniciar la reproducción.",
+
+                reply_markup=ver_video_button,
+
+                parse_mode="Markdown"
+
+            )
+
+        else: # Si por alguna razón no hay photo_id, enviar solo el texto como fallback
+
+            await update.message.reply_text(
+
+                f"🎬 **{pkg.get('caption', 'Contenido:')}**\n\nPresiona 'Ver Video' para iniciar la reproducción.",
+
+                reply_markup=ver_video_button,
+
+                parse_mode="Markdown"
+
+            )
+
+        return
+
+
+
+    # Manejo del start link para reproducir video (Videos individuales)
+
+    elif args and args[0].startswith("play_video_"):
+
+        pkg_id = args[0].split("_")[2]
+
+        pkg = await get_content_package(pkg_id)
+
+        if not pkg or "video_id" not in pkg:
+
+            await update.message.reply_text("❌ Video no disponible.")
+
+            return
+
+
+
+        ent = resolve_entitlement(user_id)
+
+        reservation = await reserve_view(user_id, ent)
+
+        if reservation is not None:
+
+            title_caption = pkg.get("caption", "🎬 Aquí tienes el video completo.")
+
+            
+
+            # Añadir el botón "Volver al menú principal"
+
+            reply_markup_video = InlineKeyboardMarkup(
+
+                [
+
+                    [InlineKeyboardButton("🔙 Volver al menú principal", callback_data="menu_principal")]
+
+                ]
+
+            )
+
+
+
+            try:
+
+                # Enviar la imagen junto con el video al hacer clic en "Ver Video" (opcional, si se desea reenviar la imagen)
+
+                if pkg.get("photo_id"):
+
+                    await update.message.reply_photo(
+
+                        photo=pkg["photo_id"],
+
+                        caption=f"Aquí tienes la sinopsis de tu contenido: {title_caption}", # Puedes ajustar este caption
+
+                        parse_mode="Markdown"
+
+                    )
+
+
+
+                await update.message.reply_video(
+
+                    video=pkg["video_id"],
+
+                    caption=title_caption,
+
+                    protect_content=not ent.can_resend,
+
+                    reply_markup=reply_markup_video
+
+                )
+
+            except Exception:
+
+                await refund_view(user_id, reservation) # El video no llegó: devolver la vista
+
+                raise
+
+            record_content_view(user_id, "video", pkg_id)
+
+            # await update.message.delete() # Comentado porque el mensaje original ya se borra en handle_callback
+
+
+
+        else:
+
+            await update.message.reply_text(
+
+                f"🚫 Has alcanzado tu límite diario de {FREE_LIMIT_VIDEOS} videos.\n"
+
+                "💎 Por favor, considera comprar un plan para acceso ilimitado.",
+
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("💎 Comprar Planes", callback_data="planes")]]),
+
+            )
+
+            return
+
+
+
+    # Modificado: Manejo de argumentos para series (directo a capítulos)
+
+    elif args and args[0].startswith("serie_"):
+
+        serie_id = args[0].split("_", 1)[1]
+
+        serie = await get_serie(serie_id)
+
+        if not serie:
+
+            await update.message.reply_text("❌ Serie no encontrada.")
+
+            return
+
+
+
+        # APLICACIÓN DE LA SEGURIDAD PARA SERIES AQUÍ
+
+        if not can_view_video(user_id): # Verifica si tiene vistas disponibles
+
+            await update.message.reply_text(
+
+                f"🚫 Has alcanzado tu límite diario de {FREE_LIMIT_VIDEOS} vistas para series/videos.\n"
+
+                "💎 Por favor, considera comprar un plan para acceso ilimitado.",
+
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("💎 Comprar Planes", callback_data="planes")]]),
+
+            )
+
+            return
+
+
+
+        # Si puede ver, mostrar capítulos
+
+        capitulos = serie.get("capitulos", [])
+
+        if not capitulos:
+
+            await update.message.reply_text("❌ Esta serie no tiene capítulos disponibles aún.")
+
+            return
+
+        
+
+        # Usar la nueva función para generar los botones de los capítulos
+
+        markup = generate_chapter_buttons(serie_id, len(capitulos))
+
+
+
+        await update.message.reply_photo(
+
+            photo=serie["photo_id"],
+
+            caption=f"📺 *{serie['title']}*\n\n{serie['caption']}\n\nSelecciona un capítulo:",
+
+            reply_markup=markup,
+
+            parse_mode="Markdown"
+
+        )
+
+    else:
+
+        # Si no hay argumentos específicos y el usuario ya está verificado, mostrar menú principal
+
+        await update.message.reply_text("📋 Menú principal:", reply_markup=get_main_menu())
+
+
+
+
+
+async def verify(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    query = update.callback_query
+
+    await query.answer()
+
+    user_id = query.from_user.id
+
+    
+
+    not_joined = await check_channel_subscription(user_id, context)
+
+
+
+    if not not_joined:
+
+        await query.edit_message_text("✅ Verificación completada. Menú disponible:")
+
+        await query.message.reply_text("📋 Menú principal:", reply_markup=get_main_menu())
+
+    else:
+
+        await query.edit_message_text("❌ Aún no estás suscrito a:\n" + "\n".join(not_joined))
+
+
+
+async def delete_previous_message(message):
+
+    # Telegram no borra mensajes de más de 48 h ni los ya borrados (doble toque): se ignora
+
+    try:
+
+        await message.delete()
+
+    except BadRequest as e:
+
+        logger.info(f"No se pudo borrar el mensaje anterior: {e}")
+
+
+
+async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    query = update.callback_query
+
+    await query.answer()
+
+    user = query.from_user
+
+    user_id = user.id
+
+    data = query.data
+
+
+
+    if data == "planes":
+
+        texto_planes = (
+
+            f"💎 *Planes disponibles:*\n\n"
+
+            f"🔹 Free – Hasta {FREE_LIMIT_VIDEOS} videos por día.\n\n"
+
+            "🔸 *Plan Pro*\n"
+
+            "Precio: 25 estrellas\n"
+
+            "Beneficios: 50 videos diarios, sin reenvíos ni compartir.\n\n"
+
+            "🔸 *Plan Ultra*\n"
+
+            "Precio: 50 estrellas\n"
+
+            "Beneficios: Videos y reenvíos ilimitados, sin restricciones.\n"
+
+        )
+
+        botones_planes = InlineKeyboardMarkup(
+
+            [
+
+                [InlineKeyboardButton("💸 Comprar Plan Pro (25 ⭐)", callback_data="comprar_pro")],
+
+                [InlineKeyboardButton("💸 Comprar Plan Ultra (50 ⭐)", callback_data="comprar_ultra")],
+
+                [InlineKeyboardButton("🔙 Volver", callback_data="menu_principal")],
+
+            ]
+
+        )
+
+        await query.message.reply_text(texto_planes, parse_mode="Markdown", reply_markup=botones_planes)
+
+
+
+    elif data == "comprar_pro":
+
+        ent = resolve_entitlement(user_id)
+
+        if ent.is_premium:
+
+            # Renovación: el pago suma 30 días a la fecha de expiración actual
+
+            exp_date = ent.expire_at.strftime("%Y-%m-%d")
+
+            await query.message.reply_text(f"✅ Ya tienes un plan activo hasta {exp_date}. Si compras de nuevo, se sumarán 30 días.")
+
+        await context.bot.send_invoice(
+
+            chat_id=query.message.chat_id,
+
+            title=PLAN_PRO_ITEM["title"],
+
+            description=PLAN_PRO_ITEM["description"],
+
+            payload=PLAN_PRO_ITEM["payload"],
+
+            provider_token=PROVIDER_TOKEN,
+
+            currency=PLAN_PRO_ITEM["currency"],
+
+            prices=PLAN_PRO_ITEM["prices"],
+
+            start_parameter="buy-plan-pro",
+
+        )
+
+
+
+    elif data == "comprar_ultra":
+
+        ent = resolve_entitlement(user_id)
+
+        if ent.is_premium:
+
+            # Renovación: el pago suma 30 días a la fecha de expiración actual
+
+            exp_date = ent.expire_at.strftime("%Y-%m-%d")
+
+            await query.message.reply_text(f"✅ Ya tienes un plan activo hasta {exp_date}. Si compras de nuevo, se sumarán 30 días.")
+
+        await context.bot.send_invoice(
+
+            chat_id=query.message.chat_id,
+
+            title=PLAN_ULTRA_ITEM["title"],
+
+            description=PLAN_ULTRA_ITEM["description"],
+
+            payload=PLAN_ULTRA_ITEM["payload"],
+
+            provider_token=PROVIDER_TOKEN,
+
+            currency=PLAN_ULTRA_ITEM["currency"],
+
+            prices=PLAN_ULTRA_ITEM["prices"],
+
+            start_parameter="buy-plan-ultra",
+
+        )
+
+
+
+    elif data == "perfil":
+
+        ent = resolve_entitlement(user_id)
+
+        plan_type = ent.plan_type
+
+        exp_date_str = ent.expire_at.strftime('%Y-%m-%d') if ent.is_premium else "N/A"
+
+
+
+        await query.message.reply_text(
+
+            f"🧑 Perfil:\n• {user.full_name}\n• @{user.username or 'Sin usuario'}\n"
+
+            f"• ID: {user_id}\n• Plan: {plan_type.replace('plan_', '').replace('premium_legacy', 'Ultra').capitalize()}\n• Expira: {exp_date_str}",
+
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Volver", callback_data="planes")]]),
+
+        )
+
+
+
+    elif data == "menu_principal":
+
+        await query.message.reply_text("📋 Menú principal:", reply_markup=get_main_menu())
+
+
+
+    elif data == "audio_libros":
+
+        await query.message.reply_text("🎧 Aquí estará el contenido de Audio Libros.")
+
+    elif data == "libro_pdf":
+
+        await query.message.reply_text("📚 Aquí estará el contenido de Libro PDF.")
+
+    elif data == "chat_pedido":
+
+        await query.message.reply_text("💬 Aquí puedes hacer tu pedido en el chat.")
+
+    elif data == "cursos":
+
+        await query.message.reply_text("🎓 Aquí estarán los cursos disponibles.")
+
+
+
+    elif data.startswith("catalogo_"):
+
+        cursor = decode_catalog_cursor(data)
+
+        page, next_cursor = await catalog_page(cursor)
+
+        if not page:
+
+            await query.edit_message_text("📚 No hay más contenido en el catálogo.", reply_markup=catalog_markup([], None, False, context.bot.username))
+
+            return
+
+        await query.edit_message_text(
+
+            "📚 Catálogo (lo más nuevo primero):",
+
+            reply_markup=catalog_markup(page, next_cursor, cursor is None, context.bot.username),
+
+        )
+
+
+
+    # Manejo del callback para reproducir el video individual
+
+    elif data.startswith("play_video_"):
+
+        pkg_id = data.split("_")[2]
+
+        pkg = await get_content_package(pkg_id)
+
+        if not pkg or "video_id" not in pkg:
+
+            await query.message.reply_text("❌ Video no disponible.")
+
+            return
+
+
+
+        # Verificación de seguridad (similar a 'start' handler)
+
+        not_joined_channels = await check_channel_subscription(user_id, context)
+
+        if not_joined_channels:
+
+            await query.message.reply_text(
+
+                "🔒 Para ver este contenido debes unirte a los canales.",
+
+                reply_markup=InlineKeyboardMarkup(
+
+                    [
+
+                        [
+
+                            InlineKeyboardButton(
+
+                                "🔗 Unirse a canal 1", url=f"https://t.me/{CHANNELS['canal_1'][1:]}"
+
+                            )
+
+                        ],
+
+                        [
+
+                            InlineKeyboardButton(
+
+                                "🔗 Unirse a canal 2", url=f"https://t.me/{CHANNELS['canal_2'][1:]}"
+
+                            )
+
+                        ],
+
+                        [InlineKeyboardButton("✅ Verificar suscripción", callback_data="verify")],
+
+                    ]
+
+                ),
+
+            )
+
+            return
+
+
+
+        ent = resolve_entitlement(user_id)
+
+        reservation = await reserve_view(user_id, ent)
+
+        if reservation is not None:
+
+            title_caption = pkg.get("caption", "🎬 Aquí tienes el video completo.")
+
+
+
+            # Añadir el botón "Volver al menú principal"
+
+            reply_markup_video = InlineKeyboardMarkup(
+
+                [
+
+                    [InlineKeyboardButton("🔙 Volver al menú principal", callback_data="menu_principal")]
+
+                ]
+
+            )
+
+
+
+            try:
+
+                # --- MODIFICACIÓN SUGERIDA: Enviar la imagen junto con el video ---
+
+                if pkg.get("photo_id"):
+
+                    await query.message.reply_photo(
+
+                        photo=pkg["photo_id"],
+
+                        caption=f"Aquí tienes la sinopsis de tu contenido: {title_caption}", # Optional: Add a specific caption for the photo
+
+                        parse_mode="Markdown"
+
+                    )
+
+                # --- FIN MODIFICACIÓN ---
+
+
+
+                await query.message.reply_video(
+
+                    video=pkg["video_id"],
+
+                    caption=title_caption,
+
+                    protect_content=not ent.can_resend,
+
+                    reply_markup=reply_markup_video # Asignar el nuevo markup
+
+                )
+
+            except Exception:
+
+                await refund_view(user_id, reservation) # El video no llegó: devolver la vista
+
+                raise
+
+            record_content_view(user_id, "video", pkg_id)
+
+            await delete_previous_message(query.message)
+
+        else:
+
+            await query.answer("🚫 Has alcanzado tu límite diario de videos. Compra un plan para más acceso.", show_alert=True)
+
+            await query.message.reply_text(
+
+                f"🚫 Has alcanzado tu límite diario de {FREE_LIMIT_VIDEOS} videos.\n"
+
+                "💎 Por favor, considera comprar un plan para acceso ilimitado.",
+
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("💎 Comprar Planes", callback_data="planes")]]),
+
+            )
+
+
+
+    # Mostrar video capítulo con navegación (series)
+
+    elif data.startswith("cap_"):
+
+        _, serie_id, index = data.split("_")
+
+        index = int(index)
+
+        serie = await get_serie(serie_id)
+
+
+
+        if not serie or "capitulos" not in serie:
+
+            await query.message.reply_text("❌ Serie o capítulos no disponibles.")
+
+            return
+
+
+
+        capitulos = serie["capitulos"]
+
+        total = len(capitulos)
+
+        if index < 0 or index >= total:
+
+            await query.message.reply_text("❌ Capítulo fuera de rango.")
+
+            return
+
+
+
+        ent = resolve_entitlement(user_id)
+
+        reservation = await reserve_view(user_id, ent)
+
+        if reservation is not None:
+
+            video_id = capitulos[index]
+
+
+
+            botones = []
+
+            if index > 0:
+
+                botones.append(InlineKeyboardButton("⬅️ Anterior", callback_data=f"cap_{serie_id}_{index - 1}"))
+
+            if index < total - 1:
+
+                botones.append(InlineKeyboardButton("➡️ Siguiente", callback_data=f"cap_{serie_id}_{index + 1}"))
+
+            botones.append(InlineKeyboardButton("🔙 Volver a la Serie", callback_data=f"serie_list_{serie_id}"))
+
+
+
+            markup = InlineKeyboardMarkup([botones])
+
+
+
+            # 🧨 Evitar edit_message_media, usar send_video con protect_content
+
+            try:
+
+                await context.bot.send_video(
+
+                    chat_id=query.message.chat_id,
+
+                    video=video_id,
+
+                    caption=f"{serie['title']} - Capítulo {index + 1}",
+
+                    parse_mode="Markdown",
+
+                    protect_content=not ent.can_resend,
+
+                    reply_markup=markup
+
+                )
+
+            except Exception:
+
+                await refund_view(user_id, reservation) # El video no llegó: devolver la vista
+
+                raise
+
+            record_content_view(user_id, "serie", serie_id, index + 1)
+
+            # Solo tras enviar el video: un borrado fallido no debe costar la vista
+
+            await delete_previous_message(query.message)
+
+        else:
+
+            await query.answer("🚫 Has alcanzado tu límite diario de videos. Compra un plan para más acceso.", show_alert=True)
+
+            await query.message.reply_text(
+
+                f"🚫 Has alcanzado tu límite diario de {FREE_LIMIT_VIDEOS} videos.\n"
+
+                "💎 Por favor, considera comprar un plan para acceso ilimitado.",
+
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("💎 Comprar Planes", callback_data="planes")]]),
+
+            )
+
+    
+
+    # Nuevo callback para mostrar la lista de capítulos de una serie
+
+    elif data.startswith("serie_list_"):
+
+        serie_id = data.split("_")[2]
+
+        serie = await get_serie(serie_id)
+
+        if not serie:
+
+            await query.message.reply_text("❌ Serie no encontrada.")
+
+            return
+
+        
+
+        # APLICACIÓN DE LA SEGURIDAD PARA SERIES AQUÍ (al volver a la lista)
+
+        if not can_view_video(user_id): # Verifica si tiene vistas disponibles
+
+            await query.message.reply_text(
+
+                f"🚫 Has alcanzado tu límite diario de {FREE_LIMIT_VIDEOS} vistas para series/videos.\n"
+
+                "💎 Por favor, considera comprar un plan para acceso ilimitado.",
+
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("💎 Comprar Planes", callback_data="planes")]]),
+
+            )
+
+            return
+
+
+
+        capitulos = serie.get("capitulos", [])
+
+        if not capitulos:
+
+            await query.message.reply_text("❌ Esta serie no tiene capítulos disponibles aún.")
+
+            return
+
+        
+
+        # Reutilizar la función para generar los botones de los capítulos
+
+        markup = generate_chapter_buttons(serie_id, len(capitulos))
+
+
+
+        await query.edit_message_media(
+
+            media=InputMediaPhoto(
+
+                media=serie["photo_id"],
+
+                caption=f"📺 *{serie['title']}*\n\n{serie['caption']}\n\nSelecciona un capítulo:",
+
+                parse_mode="Markdown"
 
             ),
 
-            reply_markup=markup,
+            reply_markup=markup,
+
+        )
+
+
+
+
+
+# --- Pagos ---
+
+PLAN_ITEMS = {item["payload"]: item for item in (PLAN_PRO_ITEM, PLAN_ULTRA_ITEM)}
+
+PLAN_RANK = {"plan_pro": 1, "plan_ultra": 2, "premium_legacy": 2}
+
+PLAN_DAYS = 30
+
+
+
+def plan_price(plan_type):
+
+    item = PLAN_ITEMS.get(plan_type, PLAN_ULTRA_ITEM)  # premium_legacy equivale a Ultra
+
+    return sum(price.amount for price in item["prices"])
+
+
+
+def plan_after_purchase(record, bought, now):
+
+    """Plan y expiración tras comprar 30 días de `bought` con el plan actual de `record`.
+
+
+
+    El mismo plan se renueva desde su expiración. Con otro plan activo nunca se pierde
+
+    tiempo pagado ni se rebaja: el tiempo del plan inferior se convierte por precio al
+
+    superior (comprar Ultra con Pro activo empieza ahora y suma lo que quedaba de Pro;
+
+    comprar Pro con Ultra activo alarga Ultra)."""
+
+    period = timedelta(days=PLAN_DAYS)
+
+    if not record.plan_type or record.expire_ts <= now.timestamp():
+
+        return bought, now + period
+
+    current = record.plan_type
+
+    current_rank, bought_rank = PLAN_RANK.get(current, 2), PLAN_RANK[bought]
+
+    if current_rank == bought_rank:
+
+        return bought, record.expire_at + period
+
+    if bought_rank > current_rank:
+
+        remaining = (record.expire_at - now) * plan_price(current) / plan_price(bought)
+
+        return bought, now + period + remaining
+
+    return current, record.expire_at + period * plan_price(bought) / plan_price(current)
+
+
+
+async def precheckout_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    await update.pre_checkout_query.answer(ok=True)
+
+
+
+async def successful_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    user_id = update.effective_user.id
+
+    payload = update.message.successful_payment.invoice_payload
+
+    # Si tienes un 'PREMIUM_ITEM' original, añádelo a PLAN_ITEMS (su plan_type es "premium_legacy")
+
+    if payload not in PLAN_ITEMS:
+
+        return
+
+    record = get_or_create_user(user_id)
+
+    # MODIFICADO: Guardar el tipo de plan junto con la fecha de expiración
+
+    plan_type, expire_at = plan_after_purchase(record, payload, datetime.now(timezone.utc))
+
+    record.set_plan(plan_type, expire_at)
+
+    schedule_plan_expiry(user_id, record)
+
+    await asyncio.to_thread(save_user_premium_doc, user_id)
+
+
+
+    plan_name = plan_type.replace("plan_", "").replace("premium_legacy", "Ultra").capitalize()
+
+    if plan_type == payload:
+
+        text = f"🎉 ¡Gracias por tu compra! Tu *Plan {plan_name}* está activo hasta el {expire_at.strftime('%Y-%m-%d')}."
+
+    else:
+
+        text = f"🎉 ¡Gracias por tu compra! Se sumó a tu *Plan {plan_name}*, que ahora está activo hasta el {expire_at.strftime('%Y-%m-%d')}."
+
+    await update.message.reply_text(text)
+
+
+
+
+
+# --- Recepción contenido (sinopsis + video) ---
+
+def content_caption(caption, direct_url):
+
+    # Formato mejorado para clicable
+
+    return (
+
+        f"{caption}\n\n"
+
+        f"🎬 *haga click aqui:👇*\n"
+
+        f"➡️ [ver contenido ]({direct_url})\n" # Enlace clicable
+
+    )
+
+
+
+async def recibir_foto(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    msg = update.message
+
+    user_id = msg.from_user.id
+
+    if msg.photo and msg.caption:
+
+        current_photo[user_id] = {
+
+            "photo_id": msg.photo[-1].file_id,
+
+            "caption": msg.caption,
+
+        }
+
+        await save_draft(user_id)
+
+        await msg.reply_text("✅ Sinopsis recibida. Ahora envía el video o usa /crear_serie para series.")
+
+    else:
+
+        await msg.reply_text("❌ Envía una imagen con sinopsis.")
+
+
+
+async def recibir_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    msg = update.message
+
+    user_id = msg.from_user.id
+
+    bot_username = (await context.bot.get_me()).username
+
+
+
+    if user_id not in current_photo:
+
+        await msg.reply_text("❌ Primero envía una sinopsis con imagen.")
+
+        return
+
+
+
+    pkg_id = content_ids.next_id()
+
+    photo_id = current_photo[user_id]["photo_id"]
+
+    caption = current_photo[user_id]["caption"]
+
+    video_id = msg.video.file_id
+
+
+
+    content_packages[pkg_id] = {
+
+        "photo_id": photo_id,
+
+        "caption": caption,
+
+        "video_id": video_id,
+
+    }
+
+    del current_photo[user_id]
+
+
+
+    await asyncio.to_thread(save_video_doc, pkg_id)
+
+    await save_draft(user_id)
+
+
+
+    index_content("video", pkg_id, content_packages[pkg_id])
+
+
+
+    direct_url = f"https://t.me/{bot_username}?start=video_{pkg_id}"
+
+    full_caption = content_caption(caption, direct_url)
+
+
+
+    # El envío a los grupos no bloquea al admin y se aplaza si el bot está saturado
+
+    context.application.create_task(broadcast_photo(context.bot, photo_id, full_caption), update=update)
+
+
+
+    await msg.reply_text("✅ Contenido guardado. Enviándolo a los grupos...")
+
+
+
+# --- Comandos para series (simplificado) ---
+
+async def crear_serie(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    """Comando para iniciar creación de serie (sinopsis + foto)."""
+
+    user_id = update.message.from_user.id
+
+    if user_id not in current_photo:
+
+        await update.message.reply_text("❌ Primero envía la sinopsis con imagen.")
+
+        return
+
+    data = current_photo[user_id]
+
+    current_series[user_id] = {
+
+        "title": data["caption"].split("\n")[0],
+
+        "photo_id": data["photo_id"],
+
+        "caption": data["caption"],
+
+        "capitulos": [],
+
+    }
+
+    del current_photo[user_id]
+
+    await save_draft(user_id)
+
+    await update.message.reply_text(
+
+        "✅ Serie creada temporalmente.\n"
+
+        "Ahora envía el primer video para el capítulo 1 usando /agregar_capitulo."
+
+    )
+
+
+
+async def agregar_capitulo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    """Comando para agregar capítulo a la serie actual."""
+
+    user_id = update.message.from_user.id
+
+    if user_id not in current_series:
+
+        await update.message.reply_text("❌ No hay serie en creación. Usa /crear_serie primero.")
+
+        return
+
+    
+
+    await update.message.reply_text(
+
+        "📽️ Por favor envía ahora el video para el capítulo de la serie."
+
+    )
+
+
+
+async def recibir_video_serie(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    """Para recibir video y asignarlo como capítulo si el usuario está en proceso de agregar capítulo a serie."""
+
+    msg = update.message
+
+    user_id = msg.from_user.id
+
+    if user_id not in current_series:
+
+        # If not creating a series, treat it as a regular video
+
+        await recibir_video(update, context)
+
+        return
+
+
+
+    if not msg.video:
+
+        await msg.reply_text("❌ Envía un video válido para el capítulo.")
+
+        return
+
+
+
+    # Álbumes y lotes reenviados se acumulan y se agregan juntos, con una sola escritura
+
+    if msg.media_group_id or msg.forward_date:
+
+        buffer_album_video(msg, context)
+
+        return
+
+
+
+    serie = current_series[user_id]
+
+    # Los álbumes y reenvíos pendientes llegaron antes que este video: se agregan primero
+
+    added = append_user_albums(user_id)
+
+    video_id = msg.video.file_id
+
+    serie["capitulos"].append(video_id)
+
+    await save_draft(user_id)
+
+
+
+    if added:
+
+        await msg.reply_text(f"✅ Capítulos {added[0]}-{len(serie['capitulos'])} agregados a la serie. Usa /finalizar_serie para guardar la serie o envía otro video para añadir el siguiente capítulo.")
+
+        return
+
+    await msg.reply_text(f"✅ Capítulo {len(serie['capitulos'])} agregado a la serie. Usa /finalizar_serie para guardar la serie o envía otro video para añadir el siguiente capítulo.")
+
+
+
+def buffer_album_video(msg, context):
+
+    user_id = msg.from_user.id
+
+    # Todos los reenvíos de un usuario van a un único lote aunque Telegram los entregue como
+
+    # varios álbumes; solo los álbumes enviados directamente se agrupan por media_group_id
+
+    key = f"forward_{user_id}" if msg.forward_date else msg.media_group_id
+
+    buffer = album_buffers.get(key)
+
+    if buffer is None:
+
+        buffer = album_buffers[key] = {"user_id": user_id, "videos": [], "updated": 0.0}
+
+        context.application.create_task(flush_album_later(key, context.bot))
+
+    buffer["videos"].append((msg.message_id, msg.video.file_id))
+
+    buffer["updated"] = time.monotonic()
+
+
+
+def append_user_albums(user_id, until_key=None):
+
+    """Agrega como capítulos los lotes pendientes del usuario, todos juntos en orden de
+
+    message_id; con until_key, solo los que empezaron antes que ese lote y el propio lote.
+
+
+
+    Devuelve (primer capítulo, último capítulo) o None. Quien llama guarda el borrador."""
+
+    keys = sorted(
+
+        (key for key, buffer in album_buffers.items() if buffer["user_id"] == user_id),
+
+        key=lambda key: min(album_buffers[key]["videos"]),
+
+    )
+
+    if until_key is not None:
+
+        if until_key not in keys:
+
+            return None  # Ya se agregó junto con otro lote
+
+        keys = keys[:keys.index(until_key) + 1]
+
+    videos = sorted(video for key in keys for video in album_buffers.pop(key)["videos"])
+
+    serie = current_series.get(user_id)
+
+    if serie is None or not videos:
+
+        return None
+
+    first = len(serie["capitulos"]) + 1
+
+    serie["capitulos"].extend(file_id for _, file_id in videos)
+
+    return first, len(serie["capitulos"])
+
+
+
+async def flush_album_later(key, bot):
+
+    # Espera a que el álbum deje de recibir videos durante ALBUM_FLUSH_DELAY segundos
+
+    while key in album_buffers:
+
+        wait = album_buffers[key]["updated"] + ALBUM_FLUSH_DELAY - time.monotonic()
+
+        if wait <= 0:
+
+            break
+
+        await asyncio.sleep(wait)
+
+    if key not in album_buffers:
+
+        return
+
+    user_id = album_buffers[key]["user_id"]
+
+    added = append_user_albums(user_id, key)
+
+    if added is not None:
+
+        await save_draft(user_id)
+
+        first, last = added
+
+        chapters = f"Capítulo {first} agregado" if first == last else f"Capítulos {first}-{last} agregados"
+
+        await bot.send_message(
+
+            user_id,
+
+            f"✅ {chapters} a la serie. Usa /finalizar_serie para guardar la serie o envía más videos.",
+
+        )
+
+
+
+async def finalizar_serie(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    """Finaliza y guarda la serie creada en Firestore y memoria."""
+
+    user_id = update.message.from_user.id
+
+    if user_id not in current_series:
+
+        await update.message.reply_text("❌ No hay serie en creación.")
+
+        return
+
+    append_user_albums(user_id)  # Lo pendiente del usuario antes de guardar la serie
+
+    serie = current_series[user_id]
+
+    # El id se genera al publicar: ordena /catalogo por publicación y entra en la ventana de
+
+    # catalog_refresher de los demás workers aunque la serie se creara horas antes
+
+    serie_id = content_ids.next_id()
+
+    
+
+    series_data[serie_id] = {
+
+        "title": serie["title"],
+
+        "photo_id": serie["photo_id"],
+
+        "caption": serie["caption"],
+
+        "capitulos": serie["capitulos"],
+
+    }
+
+    del current_series[user_id]
+
+    await asyncio.to_thread(save_serie_doc, serie_id)
+
+    await save_draft(user_id)
+
+    index_content("serie", serie_id, series_data[serie_id])
+
+
+
+    bot_username = (await context.bot.get_me()).username
+
+    direct_url = f"https://t.me/{bot_username}?start=serie_{serie_id}"
+
+    full_caption = content_caption(serie["caption"], direct_url)
+
+
+
+    context.application.create_task(broadcast_photo(context.bot, serie["photo_id"], full_caption), update=update)
+
+
+
+    await update.message.reply_text("✅ Serie guardada. Enviándola a los grupos...")
+
+
+
+# --- Búsqueda inline (@bot nombre) ---
+
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    inline_query = update.inline_query
+
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+
+    keys, next_offset = catalog_index.search(inline_query.query, offset)
+
+
+
+    bot_username = context.bot.username
+
+    results = []
+
+    for kind, item_id in keys:
+
+        item = content_packages.get(item_id) if kind == "video" else series_data.get(item_id)
+
+        if item is None:
+
+            continue
+
+        direct_url = f"https://t.me/{bot_username}?start={kind}_{item_id}"
+
+        results.append(
+
+            InlineQueryResultCachedPhoto(
+
+                id=f"{kind}_{item_id}",
+
+                photo_file_id=item["photo_id"],
+
+                caption=content_caption(item["caption"], direct_url),
+
+                parse_mode="Markdown",
+
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("▶️ Ver contenido", url=direct_url)]]),
+
+            )
+
+        )
+
+    # Misma consulta = misma respuesta para todos: Telegram puede servirla desde su caché
+
+    await inline_query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=False, next_offset=next_offset)
+
+
+
+async def register_known_chat(chat_id):
+
+    added_ts = int(time.time())
+
+    known_chats.add(chat_id)
+
+    known_chat_added[chat_id] = added_ts
+
+    admin_stats.chat_added(chat_id, added_ts)
+
+    await asyncio.to_thread(add_known_chat_firestore, chat_id, added_ts)
+
+
+
+# Registro de grupos y canales: Telegram avisa con my_chat_member cuando el bot entra o sale
+
+async def registrar_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    member_update = update.my_chat_member
+
+    chat = member_update.chat
+
+    if chat.type not in ["group", "supergroup", "channel"]:
+
+        return
+
+    status = member_update.new_chat_member.status
+
+
+
+    if status in ["member", "administrator"]:
+
+        if chat.id in known_chats:
+
+            return
+
+        await register_known_chat(chat.id)
+
+        if chat.type == "channel":
+
+            logger.info(f"Canal registrado: {chat.id}")
+
+            text = (f"✅ ¡Este canal ha sido registrado para envíos! ID: `{chat.id}`\n\n"
+
+                    "Asegúrate de que el bot tenga permisos de 'Publicar mensajes' y 'Editar mensajes' en este canal.")
+
+        else:
+
+            logger.info(f"Grupo registrado: {chat.id}")
+
+            text = f"✅ ¡Este grupo ha sido registrado para envíos! ID: `{chat.id}`"
+
+        try:
+
+            await context.bot.send_message(chat_id=chat.id, text=text, parse_mode="Markdown")
+
+        except Exception as e:
+
+            # En canales el bot puede haber entrado sin permiso para publicar todavía
+
+            logger.warning(f"No se pudo confirmar el registro en {chat.id}: {e}")
+
+
+
+    elif status in ["left", "kicked"] and chat.id in known_chats:
+
+        known_chats.discard(chat.id)
+
+        known_chat_added.pop(chat.id, None)
+
+        admin_stats.chat_removed(chat.id)
+
+        await asyncio.to_thread(remove_known_chat_firestore, chat.id)
+
+        logger.info(f"Chat eliminado de los envíos: {chat.id}")
+
+
+
+# Registro manual de un canal reenviando al bot (en privado) un mensaje del canal
+
+async def detectar_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    if update.message and update.message.forward_from_chat and update.message.forward_from_chat.type == "channel":
+
+        channel_id = update.message.forward_from_chat.id
+
+        if channel_id not in known_chats:
+
+            await register_known_chat(channel_id)
+
+            logger.info(f"Canal registrado via forward: {channel_id}")
+
+            await update.message.reply_text(f"✅ ¡Canal registrado exitosamente! ID: `{channel_id}`\n\n"
+
+                                             "Asegúrate de que el bot sea administrador con permisos de 'Publicar mensajes' y 'Editar mensajes' en tu canal para que pueda enviar contenido automáticamente.",
+
+                                             parse_mode="Markdown")
+
+
+
+
+
+# --- Grabación anonimizada del webhook ---
+
+RECORD_ID_PARENTS = {"from", "chat", "user", "sender_chat", "forward_from", "forward_from_chat", "via_bot", "new_chat_members", "left_chat_member"}
+
+RECORD_DROPPED_KEYS = {
+
+    "last_name", "username", "phone_number", "bio", "contact", "location", "venue", "order_info", "shipping_address",
+
+    "forward_sender_name", "author_signature", "file_name", "email", "invite_link", "custom_title",
+
+}
+
+RECORD_REPLACED_KEYS = {"first_name": "u", "title": "x"}  # obligatorios al reconstruir User/Chat/Invoice
+
+RECORD_TEXT_KEYS = {"text", "caption", "query", "question", "explanation"}  # query: búsquedas inline
+
+RECORD_CHARGE_KEYS = {"telegram_payment_charge_id", "provider_payment_charge_id"}
+
+record_salt = WEBHOOK_RECORD_SALT.encode() or os.urandom(16)
+
+record_file = None
+
+
+
+def pseudonymize(value):
+
+    return hmac.new(record_salt, str(value).encode(), hashlib.sha256).digest()
+
+
+
+def pseudonymize_id(user_id):
+
+    # Mismo id, mismo seudónimo: se conservan las secuencias por usuario (y el signo de los grupos)
+
+    pseudo = int.from_bytes(pseudonymize(abs(user_id))[:6], "big") + 1
+
+    return -pseudo if user_id < 0 else pseudo
+
+
+
+def anonymize_update(value, parent=None):
+
+    """Copia del update sin nombres ni datos de contacto, con ids seudónimos y el texto libre
+
+    sustituido por "x" de la misma longitud (se conservan comandos, deep links y callback_data)."""
+
+    if isinstance(value, dict):
+
+        result = {}
+
+        for key, item in value.items():
+
+            if key in RECORD_DROPPED_KEYS:
+
+                continue
+
+            if key in RECORD_REPLACED_KEYS:
+
+                result[key] = RECORD_REPLACED_KEYS[key]
+
+            elif key == "id" and parent in RECORD_ID_PARENTS and isinstance(item, int):
+
+                result[key] = pseudonymize_id(item)
+
+            elif key in RECORD_TEXT_KEYS and isinstance(item, str) and not (key == "text" and item.startswith("/")):
+
+                result[key] = "x" * len(item)
+
+            elif key in RECORD_CHARGE_KEYS:
+
+                result[key] = pseudonymize(item).hex()[:24]
+
+            else:
+
+                result[key] = anonymize_update(item, key)
+
+        return result
+
+    if isinstance(value, list):
+
+        return [anonymize_update(item, parent) for item in value]
+
+    return value
+
+
+
+def record_webhook_update(data):
+
+    global record_file
+
+    if record_file is None:
+
+        path = WEBHOOK_RECORD_FILE if current_worker is None else f"{WEBHOOK_RECORD_FILE}.{current_worker}"
+
+        record_file = open(path, "a", encoding="utf-8", buffering=1)
+
+    record = {"ts": time.time(), "update": anonymize_update(data)}
+
+    record_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+
+# --- WEBHOOK aiohttp ---
+
+# Métricas de ingreso del webhook (profundidad de cola y latencia de ingesta)
+
+ingest_stats = {
+
+    "received": 0,
+
+    "enqueued": 0,
+
+    "unauthorized": 0,
+
+    "invalid": 0,
+
+    "rejected": 0,
+
+    "dropped": 0,
+
+    "duplicates": 0,
+
+    "filtered": 0,
+
+    "latency_total": 0.0,
+
+    "latency_max": 0.0,
+
+}
+
+ingest_latencies = deque(maxlen=1024)  # últimas latencias de ingesta en segundos
+
+update_arrivals = {}  # {update_id: (llegada al webhook, encolado) en perf_counter}, hasta que empieza su handler
+
+
+
+def record_ingest_latency(started):
+
+    elapsed = time.perf_counter() - started
+
+    ingest_stats["latency_total"] += elapsed
+
+    if elapsed > ingest_stats["latency_max"]:
+
+        ingest_stats["latency_max"] = elapsed
+
+    ingest_latencies.append(elapsed)
+
+
+
+class UpdateDeduplicator:
+
+    """Recuerda los update_id recientes (acotado en tamaño y en tiempo) para
+
+    descartar las reentregas de Telegram."""
+
+
+
+    def __init__(self, max_size, ttl):
+
+        self.max_size = max_size
+
+        self.ttl = ttl
+
+        self._seen = OrderedDict()  # {update_id: instante de llegada}, del más antiguo al más nuevo
+
+
+
+    def _expire(self, now):
+
+        while self._seen:
+
+            update_id, seen_at = next(iter(self._seen.items()))
+
+            if now - seen_at < self.ttl and len(self._seen) <= self.max_size:
+
+                break
+
+            self._seen.popitem(last=False)
+
+
+
+    def is_duplicate(self, update_id):
+
+        self._expire(time.monotonic())
+
+        return update_id in self._seen
+
+
+
+    def remember(self, update_id):
+
+        self._seen[update_id] = time.monotonic()
+
+        self._seen.move_to_end(update_id)
+
+        if len(self._seen) > self.max_size:
+
+            self._seen.popitem(last=False)
+
+
+
+    def __len__(self):
+
+        return len(self._seen)
+
+
+
+update_dedup = UpdateDeduplicator(UPDATE_DEDUP_SIZE, UPDATE_DEDUP_TTL)
+
+UPDATE_ID_RE = re.compile(rb'"update_id"\s*:\s*(\d+)')
+
+
+
+def extract_update_id(body):
+
+    # Telegram envía update_id como primer campo: basta mirar el inicio del cuerpo
+
+    match = UPDATE_ID_RE.search(body, 0, 64)
+
+    return int(match.group(1)) if match else None
+
+
+
+def is_relevant_update(data):
+
+    # Pre-filtro sobre el dict crudo, antes de Update.de_json: de los mensajes solo
+
+    # interesan los privados (comandos, contenido del admin, pagos)
+
+    message = data.get("message")
+
+    if message is not None:
+
+        return message.get("chat", {}).get("type") == "private"
+
+    return any(key in data for key in ALLOWED_UPDATES)
+
+
+
+def has_valid_secret(request):
+
+    secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+
+    return hmac.compare_digest(secret.encode(), WEBHOOK_SECRET.encode())
+
+
+
+async def webhook_handler(request):
+
+    started = time.perf_counter()
+
+    ingest_stats["received"] += 1
+
+
+
+    # Validar el secret token antes de leer o parsear el cuerpo
+
+    if not has_valid_secret(request):
+
+        ingest_stats["unauthorized"] += 1
+
+        return web.Response(status=401, text="Unauthorized")
+
+
+
+    body = await request.read()
+
+    # Descartar reentregas antes de decodificar el update completo
+
+    update_id = extract_update_id(body)
+
+    if update_id is not None and update_dedup.is_duplicate(update_id):
+
+        ingest_stats["duplicates"] += 1
+
+        record_ingest_latency(started)
+
+        return web.Response(text="OK")
+
+
+
+    try:
+
+        data = json_loads(body)
+
+    except ValueError:
+
+        ingest_stats["invalid"] += 1
+
+        return web.Response(status=400, text="Bad Request")
+
+    if update_id is None and isinstance(data, dict) and isinstance(data.get("update_id"), int):
+
+        update_id = data["update_id"]
+
+        if update_dedup.is_duplicate(update_id):
+
+            ingest_stats["duplicates"] += 1
+
+            record_ingest_latency(started)
+
+            return web.Response(text="OK")
+
+
+
+    if WEBHOOK_RECORD_FILE and isinstance(data, dict):
+
+        record_webhook_update(data)
+
+
+
+    if not isinstance(data, dict) or not is_relevant_update(data):
+
+        ingest_stats["filtered"] += 1
+
+        if update_id is not None:
+
+            update_dedup.remember(update_id)
+
+        record_ingest_latency(started)
+
+        return web.Response(text="OK")
+
+
+
+    # PTB saca cada update de la cola en cuanto llega: el límite se aplica a los pendientes
+
+    if app_telegram.pending_updates() >= UPDATE_QUEUE_MAXSIZE:
+
+        if UPDATE_QUEUE_OVERFLOW == "reject":
+
+            # Telegram reintentará la entrega más tarde
+
+            ingest_stats["rejected"] += 1
+
+            record_ingest_latency(started)
+
+            return web.Response(status=503, text="Busy", headers={"Retry-After": "1"})
+
+        if UPDATE_QUEUE_OVERFLOW == "drop_new":
+
+            ingest_stats["dropped"] += 1
+
+            record_ingest_latency(started)
+
+            return web.Response(text="OK")
+
+        # drop_oldest: descartar el pendiente más antiguo que aún no ha empezado su handler
+
+        ingest_stats["dropped"] += 1
+
+        if not app_telegram.drop_oldest_pending():
+
+            # Todos los pendientes se están ejecutando: se descarta el nuevo
+
+            record_ingest_latency(started)
+
+            return web.Response(text="OK")
+
+
+
+    update = Update.de_json(data, app_telegram.bot)
+
+    update_arrivals[update.update_id] = (started, time.perf_counter())
+
+    app_telegram.enqueue_update(update)
+
+    # Solo se recuerda una vez encolado: si se rechazó con 503, la reentrega debe procesarse
+
+    if update_id is not None:
+
+        update_dedup.remember(update_id)
+
+    ingest_stats["enqueued"] += 1
+
+    record_ingest_latency(started)
+
+    return web.Response(text="OK")
+
+
+
+async def metrics_handler(request):
+
+    # Exposición en texto para Prometheus: histogramas, errores y los contadores de ingesta y flood
+
+    lines = []
+
+    metrics = (
+
+        queue_wait_seconds, handler_seconds, bot_api_seconds, storage_seconds,
+
+        errors_total, rate_limited_total, storage_ops_total, loop_lag, loop_blocked_total, stats_drift_total,
+
+    )
+
+    for metric in metrics:
+
+        lines += metric.render()
+
+    lines += [
+
+        "# HELP bot_update_queue_depth Updates pendientes (en cola, esperando turno o en su handler)",
+
+        "# TYPE bot_update_queue_depth gauge",
+
+        f"bot_update_queue_depth {app_telegram.pending_updates()}",
+
+        "# HELP bot_ingest_updates_total Updates recibidos en el webhook por resultado",
+
+        "# TYPE bot_ingest_updates_total counter",
+
+    ]
+
+    lines += [f'bot_ingest_updates_total{{result="{key}"}} {value}' for key, value in ingest_stats.items() if isinstance(value, int)]
+
+    lines += ["# HELP bot_flood_events_total Eventos del control de flujo", "# TYPE bot_flood_events_total counter"]
+
+    lines += [f'bot_flood_events_total{{event="{key}"}} {value}' for key, value in flood_stats.items()]
+
+    return web.Response(text="\n".join(lines) + "\n", content_type="text/plain")
+
+
+
+async def profile_handler(request):
+
+    # Solo administradores: vuelca el perfil agregado a PROFILE_DIR (?reset=1 lo vacía después)
+
+    token = request.headers.get("X-Admin-Token", "")
+
+    if not ADMIN_TOKEN or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+
+        return web.Response(status=403, text="Forbidden")
+
+    if not profiler.enabled:
+
+        return web.json_response({"error": "profiler desactivado (PROFILE_SLOW_MS / PROFILE_SAMPLE_RATE)"}, status=409)
+
+    stacks, updates = profiler.snapshot(reset=request.query.get("reset") == "1")
+
+    path = os.path.join(PROFILE_DIR, f"profile-{os.getpid()}-{int(time.time())}.folded")
+
+    await asyncio.to_thread(write_collapsed_stacks, path, stacks)
+
+    return web.json_response({
+
+        "path": path,
+
+        "updates": updates,
+
+        "samples": sum(stacks.values()),
+
+        "interval_ms": PROFILE_INTERVAL_MS,
+
+    })
+
+
+
+async def ingest_stats_handler(request):
+
+    latencies = sorted(ingest_latencies)
+
+    def percentile(p):
+
+        if not latencies:
+
+            return 0.0
+
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+    return web.json_response({
+
+        **ingest_stats,
+
+        **flood_stats,
+
+        "queue_depth": app_telegram.pending_updates(),
+
+        "queue_maxsize": UPDATE_QUEUE_MAXSIZE,
+
+        "overflow_policy": UPDATE_QUEUE_OVERFLOW,
+
+        "dedup_size": len(update_dedup),
+
+        "dedup_hit_rate": ingest_stats["duplicates"] / max(1, ingest_stats["received"] - ingest_stats["unauthorized"]),
+
+        "latency_p50": percentile(0.50),
+
+        "latency_p99": percentile(0.99),
+
+    })
+
+
+
+async def on_startup(app):
+
+    webhook_url = f"{APP_URL}/webhook"
+
+    await app_telegram.bot.set_webhook(webhook_url, secret_token=WEBHOOK_SECRET, allowed_updates=ALLOWED_UPDATES)
+
+    logger.info(f"Webhook configurado en {webhook_url}")
+
+
+
+async def on_shutdown(app):
+
+    await app_telegram.bot.delete_webhook()
+
+    logger.info("Webhook eliminado")
+
+
+
+# --- Procesamiento concurrente con orden por usuario ---
+
+def update_user_key(update):
+
+    # Clave de orden: el usuario que originó el update (o el chat si no hay usuario)
+
+    if isinstance(update, Update):
+
+        if update.effective_user:
+
+            return update.effective_user.id
+
+        if update.effective_chat:
+
+            return update.effective_chat.id
+
+    return None
+
+
+
+def record_storage_ops(handler, ops):
+
+    # Totales por handler en /metrics y detalle por update en el log (nivel DEBUG)
+
+    for kind, count in ops.items():
+
+        if count:
+
+            storage_ops_total.inc((handler, kind), count)
+
+    if ops["read"] or ops["write"]:
+
+        logger.debug(f"Firestore {handler}: {ops['read']} lecturas, {ops['write']} escrituras")
+
+
+
+UPDATE_TYPES = ("message", "callback_query", "inline_query", "pre_checkout_query", "my_chat_member")
+
+CALLBACK_LABELS = ("play_video", "cap", "serie_list", "catalogo", "comprar", "planes", "perfil", "menu_principal", "info")
+
+COMMAND_LABELS = {"start", "catalogo", "top", "stats", "crear_serie", "agregar_capitulo", "finalizar_serie"}
+
+
+
+def update_type(update):
+
+    for name in UPDATE_TYPES:
+
+        if getattr(update, name) is not None:
+
+            return name
+
+    return "otro"
+
+
+
+def handler_label(update):
+
+    # Etiqueta de métricas con cardinalidad acotada: handler y, en callbacks, su tipo
+
+    if update.callback_query:
+
+        data = update.callback_query.data or ""
+
+        if data == "verify":
+
+            return "verify"
+
+        for prefix in CALLBACK_LABELS:
+
+            if data.startswith(prefix):
+
+                return f"handle_callback:{prefix}"
+
+        return "handle_callback:otro"
+
+    message = update.message
+
+    if message:
+
+        if message.successful_payment:
+
+            return "successful_payment"
+
+        if message.text and message.text.startswith("/"):
+
+            command = message.text.split()[0][1:].split("@")[0]
+
+            return command if command in COMMAND_LABELS else "comando"
+
+        if message.photo:
+
+            return "recibir_foto"
+
+        if message.video:
+
+            return "recibir_video_serie"
+
+        if message.forward_date:
+
+            return "detectar_chat"
+
+        return "mensaje"
+
+    if update.inline_query:
 
-        )
+        return "inline_search"
 
+    if update.pre_checkout_query:
 
+        return "precheckout_handler"
 
+    if update.my_chat_member:
 
+        return "registrar_chat"
 
-# --- Pagos ---
+    return "otro"
 
-async def precheckout_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
-    await update.pre_checkout_query.answer(ok=True)
 
+class OrderedApplication(Application):
 
+    """Application que procesa updates de usuarios distintos en paralelo,
 
-async def successful_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    manteniendo estrictamente el orden de llegada para un mismo usuario."""
 
-    user_id = update.effective_user.id
 
-    payload = update.message.successful_payment.invoice_payload
 
-    # MODIFICADO: Guardar el tipo de plan junto con la fecha de expiración
+    def __init__(self, *args, **kwargs):
 
-    if payload == PLAN_PRO_ITEM["payload"]:
+        super().__init__(*args, **kwargs)
 
-        expire_at = datetime.now(timezone.utc) + timedelta(days=30)
+        self._user_locks = {}  # {user_id: [asyncio.Lock, updates pendientes]}
 
-        user_premium[user_id] = {"expire_at": expire_at, "plan_type": "plan_pro"}
+        self._handler_slots = asyncio.Semaphore(CONCURRENT_UPDATES)
 
-        await update.message.reply_text("🎉 ¡Gracias por tu compra! Tu *Plan Pro* se activó por 30 días.")
+        self._waiting = {}     # {update_id: update} aceptados que aún no han empezado su handler, por llegada
 
-    elif payload == PLAN_ULTRA_ITEM["payload"]:
+        self._dropped = set()  # update_ids descartados mientras esperaban
 
-        expire_at = datetime.now(timezone.utc) + timedelta(days=30)
+        self._running = 0      # handlers en curso
 
-        user_premium[user_id] = {"expire_at": expire_at, "plan_type": "plan_ultra"}
 
-        await update.message.reply_text("🎉 ¡Gracias por tu compra! Tu *Plan Ultra* se activó por 30 días.")
 
-    # Si tienes un 'PREMIUM_ITEM' original, asegúrate de manejarlo también.
+    def enqueue_update(self, update):
 
-    # Ejemplo de manejo para el viejo "premium_plan" si aún lo usas:
+        # Entrada del webhook: el update cuenta como pendiente desde ahora hasta que termina su handler
 
-    # elif payload == PREMIUM_ITEM["payload"]:
+        self._waiting[update.update_id] = update
 
-    #     expire_at = datetime.now(timezone.utc) + timedelta(days=30)
+        self.update_queue.put_nowait(update)
 
-    #     user_premium[user_id] = {"expire_at": expire_at, "plan_type": "premium_legacy"}
 
-    #     await update.message.reply_text("🎉 ¡Gracias por tu compra! Tu *Plan Premium* se activó por 30 días.")
 
-    
+    def pending_updates(self):
 
-    save_data()
+        # El fetcher de PTB crea una tarea por update al instante (la cola casi siempre está
 
+        # vacía): lo pendiente son los aceptados que esperan más los handlers en curso
 
+        return len(self._waiting) + self._running
 
 
 
-# --- Recepción contenido (sinopsis + video) ---
+    def drop_oldest_pending(self):
 
-async def recibir_foto(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        update_id = next(iter(self._waiting), None)
 
-    msg = update.message
+        if update_id is None:
 
-    user_id = msg.from_user.id
+            return False
 
-    if msg.photo and msg.caption:
+        self._drop_waiting(update_id)
 
-        current_photo[user_id] = {
+        return True
 
-            "photo_id": msg.photo[-1].file_id,
 
-            "caption": msg.caption,
 
-        }
+    def _drop_waiting(self, update_id):
 
-        await msg.reply_text("✅ Sinopsis recibida. Ahora envía el video o usa /crear_serie para series.")
+        del self._waiting[update_id]
 
-    else:
+        self._dropped.add(update_id)
 
-        await msg.reply_text("❌ Envía una imagen con sinopsis.")
+        update_arrivals.pop(update_id, None)
 
 
 
-async def recibir_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    def _take_turn(self, update, key):
 
-    msg = update.message
+        # False si el update se descartó mientras esperaba
 
-    user_id = msg.from_user.id
+        if not isinstance(update, Update):
 
-    bot_username = (await context.bot.get_me()).username
+            return True
 
+        if update.update_id in self._dropped:
 
+            self._dropped.discard(update.update_id)
 
-    if user_id not in current_photo:
+            return False
 
-        await msg.reply_text("❌ Primero envía una sinopsis con imagen.")
+        self._waiting.pop(update.update_id, None)
 
-        return
+        if pending_navigation.get(key) == update.update_id:
 
+            del pending_navigation[key]
 
+        return True
 
-    pkg_id = str(int(datetime.utcnow().timestamp()))
 
-    photo_id = current_photo[user_id]["photo_id"]
 
-    caption = current_photo[user_id]["caption"]
+    async def _admit(self, update, key):
 
-    video_id = msg.video.file_id
+        entry = self._user_locks.get(key)
 
+        if not await admit_update(update, entry[1] if entry else 0):
 
+            # Pudo descartarse mientras se respondía: no llegará a _take_turn
 
-    content_packages[pkg_id] = {
+            self._waiting.pop(update.update_id, None)
 
-        "photo_id": photo_id,
+            self._dropped.discard(update.update_id)
 
-        "caption": caption,
+            update_arrivals.pop(update.update_id, None)
 
-        "video_id": video_id,
+            return False
 
-    }
+        query = update.callback_query
 
-    del current_photo[user_id]
+        if query and (query.data or "").startswith("cap_"):
 
+            # Varios "Siguiente" seguidos: el anterior que aún espera turno se fusiona con este
 
+            previous = self._waiting.get(pending_navigation.get(key))
 
-    save_data()
+            pending_navigation[key] = update.update_id
 
+            if previous is not None and previous is not update:
 
+                self._drop_waiting(previous.update_id)
 
-    direct_url = f"https://t.me/{bot_username}?start=video_{pkg_id}"
+                flood_stats["merged"] += 1
 
-    
+                self.create_task(previous.callback_query.answer())
 
-    # Formato mejorado para clicable
+        return True
 
-    full_caption = (
 
-        f"{caption}\n\n"
 
-        f"🎬 *haga click aqui:👇*\n"
+    async def process_update(self, update):
 
-        f"➡️ [ver contenido ]({direct_url})\n" # Enlace clicable
+        key = update_user_key(update)
 
-    )
+        # Antes de esperar nada: un usuario con cola no ocupa turnos ni huecos de handler
+
+        if isinstance(update, Update) and not await self._admit(update, key):
+
+            return
 
+        if key is None:
 
+            async with self._handler_slots:
 
-    for chat_id in known_chats:
+                if self._take_turn(update, key):
+
+                    await self._run_handler(update)
+
+            return
+
+
+
+        entry = self._user_locks.get(key)
+
+        if entry is None:
+
+            entry = self._user_locks[key] = [asyncio.Lock(), 0]
+
+        entry[1] += 1
 
         try:
 
-            await context.bot.send_photo(
+            # asyncio.Lock es FIFO: los updates del mismo usuario se ejecutan en orden de llegada
 
-                chat_id=chat_id,
+            async with entry[0]:
 
-                photo=photo_id,
+                async with self._handler_slots:
 
-                caption=full_caption,
+                    if self._take_turn(update, key):
 
-                parse_mode="Markdown",
+                        await self._run_handler(update)
 
-                protect_content=False,
+        finally:
 
-            )
+            entry[1] -= 1
 
-        except Exception as e:
+            if entry[1] == 0:
 
-            logger.warning(f"No se pudo enviar a {chat_id}: {e}")
+                del self._user_locks[key]
 
 
 
-    await msg.reply_text("✅ Contenido enviado a los grupos.")
+    async def _run_handler(self, update):
 
+        self._running += 1
 
+        try:
 
-# --- Comandos para series (simplificado) ---
+            await self._process_measured(update)
 
-async def crear_serie(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        finally:
 
-    """Comando para iniciar creación de serie (sinopsis + foto)."""
+            self._running -= 1
 
-    user_id = update.message.from_user.id
 
-    if user_id not in current_photo:
 
-        await update.message.reply_text("❌ Primero envía la sinopsis con imagen.")
+    async def _process_measured(self, update):
 
-        return
+        if not isinstance(update, Update):
 
-    serie_id = str(int(datetime.utcnow().timestamp()))
+            return await super().process_update(update)
 
-    data = current_photo[user_id]
+        started = time.perf_counter()
 
-    current_series[user_id] = {
+        arrival = update_arrivals.pop(update.update_id, None)
 
-        "serie_id": serie_id,
+        if arrival is not None:
 
-        "title": data["caption"].split("\n")[0],
+            queue_wait_seconds.observe(update_type(update), started - arrival[0])
 
-        "photo_id": data["photo_id"],
 
-        "caption": data["caption"],
 
-        "capitulos": [],
+        ops = {"read": 0, "write": 0}
 
-    }
+        ops_token = current_storage_ops.set(ops)
 
-    del current_photo[user_id]
+        if profiler.enabled:
 
-    await update.message.reply_text(
+            profiler.begin(update.update_id)
 
-        "✅ Serie creada temporalmente.\n"
+        trace = token = None
 
-        "Ahora envía el primer video para el capítulo 1 usando /agregar_capitulo."
+        if TRACE_FILE:
 
-    )
+            received, enqueued = arrival or (started, started)
 
+            trace = Trace(update.update_id, received)
 
+            trace.add("webhook", received, enqueued)
 
-async def agregar_capitulo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            trace.add("queue_wait", enqueued, started)
 
-    """Comando para agregar capítulo a la serie actual."""
+            token = current_trace.set(trace)
 
-    user_id = update.message.from_user.id
+        try:
 
-    if user_id not in current_series:
+            await super().process_update(update)
 
-        await update.message.reply_text("❌ No hay serie en creación. Usa /crear_serie primero.")
+        finally:
 
-        return
+            ended = time.perf_counter()
 
-    
+            handler = handler_label(update)
 
-    await update.message.reply_text(
+            handler_seconds.observe(handler, ended - started)
 
-        "📽️ Por favor envía ahora el video para el capítulo de la serie."
+            current_storage_ops.reset(ops_token)
 
-    )
+            record_storage_ops(handler, ops)
 
+            if profiler.enabled:
 
+                profiler.end(update.update_id, handler, ended - started)
 
-async def recibir_video_serie(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            if trace is not None:
 
-    """Para recibir video y asignarlo como capítulo si el usuario está en proceso de agregar capítulo a serie."""
+                current_trace.reset(token)
 
-    msg = update.message
+                trace.add("handler", started, ended)
 
-    user_id = msg.from_user.id
+                write_trace(trace, update_type(update), handler, ended)
 
-    if user_id not in current_series:
 
-        # If not creating a series, treat it as a regular video
 
-        await recibir_video(update, context)
+# --- App Telegram ---
 
-        return
+builder = (
 
+    Application.builder()
 
+    .application_class(OrderedApplication)
 
-    if not msg.video:
+    .token(TOKEN)
 
-        await msg.reply_text("❌ Envía un video válido para el capítulo.")
+    .request(MeteredRequest(HTTPXRequest(connection_pool_size=256)))
 
-        return
+    .update_queue(asyncio.Queue(maxsize=UPDATE_QUEUE_MAXSIZE))
 
+    # Sin espera en el semáforo de PTB: los pendientes ya están acotados en webhook_handler
 
+    .concurrent_updates(UPDATE_QUEUE_MAXSIZE)
 
-    serie = current_series[user_id]
+)
 
-    video_id = msg.video.file_id
+if TELEGRAM_API_URL:
 
-    serie["capitulos"].append(video_id)
+    builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
 
+app_telegram = builder.build()
 
 
-    await msg.reply_text(f"✅ Capítulo {len(serie['capitulos'])} agregado a la serie. Usa /finalizar_serie para guardar la serie o envía otro video para añadir el siguiente capítulo.")
 
+async def on_error(update, context: ContextTypes.DEFAULT_TYPE):
 
+    errors_total.inc("handler")
 
-async def finalizar_serie(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    logger.error(f"Error procesando update: {context.error}", exc_info=context.error)
 
-    """Finaliza y guarda la serie creada en Firestore y memoria."""
 
-    user_id = update.message.from_user.id
 
-    if user_id not in current_series:
+# Agregar handlers
 
-        await update.message.reply_text("❌ No hay serie en creación.")
+app_telegram.add_error_handler(on_error)
 
-        return
+app_telegram.add_handler(CommandHandler("start", start))
 
-    serie = current_series[user_id]
+app_telegram.add_handler(CommandHandler("catalogo", catalogo))
 
-    serie_id = serie["serie_id"]
+app_telegram.add_handler(CommandHandler("top", top))
 
-    
+app_telegram.add_handler(CommandHandler("stats", stats))
 
-    series_data[serie_id] = {
+app_telegram.add_handler(CallbackQueryHandler(verify, pattern="^verify$"))
 
-        "title": serie["title"],
+app_telegram.add_handler(CallbackQueryHandler(handle_callback, pattern="^play_video_.*$"))
 
-        "photo_id": serie["photo_id"],
+app_telegram.add_handler(CallbackQueryHandler(handle_callback))
 
-        "caption": serie["caption"],
+app_telegram.add_handler(PreCheckoutQueryHandler(precheckout_handler))
 
-        "capitulos": serie["capitulos"],
+app_telegram.add_handler(InlineQueryHandler(inline_search))
 
-    }
+app_telegram.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, successful_payment))
 
-    save_data()
+app_telegram.add_handler(MessageHandler(filters.PHOTO & filters.ChatType.PRIVATE, recibir_foto))
 
-    del current_series[user_id]
+app_telegram.add_handler(MessageHandler(filters.VIDEO & filters.ChatType.PRIVATE, recibir_video_serie))
 
+# Grupos y canales se registran al añadir el bot (my_chat_member), no con cada mensaje
 
+app_telegram.add_handler(ChatMemberHandler(registrar_chat, ChatMemberHandler.MY_CHAT_MEMBER))
 
-    bot_username = (await context.bot.get_me()).username
+app_telegram.add_handler(MessageHandler(filters.FORWARDED & filters.ChatType.PRIVATE, detectar_chat)) 
 
-    direct_url = f"https://t.me/{bot_username}?start=serie_{serie_id}"
 
-    
 
-    # Formato mejorado para clicable
+# Comandos para series
 
-    full_caption = (
+app_telegram.add_handler(CommandHandler("crear_serie", crear_serie))
 
-        f"{serie['caption']}\n\n"
+app_telegram.add_handler(CommandHandler("agregar_capitulo", agregar_capitulo))
 
-        f"🎬 *haga click aqui:👇*\n"
+app_telegram.add_handler(CommandHandler("finalizar_serie", finalizar_serie))
 
-        f"➡️ [ver contenido ]({direct_url})\n" # Enlace clicable
 
-    )
 
+# --- Servidor aiohttp ---
 
+web_app = web.Application()
 
-    for chat_id in known_chats:
+web_app.router.add_post("/webhook", webhook_handler)
 
-        try:
+web_app.router.add_get("/ping", lambda request: web.Response(text="✅ Bot activo."))
 
-            await context.bot.send_photo(
+web_app.router.add_get("/ingest", ingest_stats_handler)
 
-                chat_id=chat_id,
+web_app.router.add_get("/metrics", metrics_handler)
 
-                photo=serie["photo_id"],
+web_app.router.add_get("/profile", profile_handler)
 
-                caption=full_caption,
+web_app.on_startup.append(on_startup)
 
-                parse_mode="Markdown",
+web_app.on_shutdown.append(on_shutdown)
 
-                protect_content=False,
 
-            )
 
-        except Exception as e:
+# --- Modo multiproceso (router + workers) ---
 
-            logger.warning(f"No se pudo enviar serie a {chat_id}: {e}")
+# El router recibe el webhook de Telegram y reenvía cada update, sin decodificarlo, al worker
 
+# dueño de su usuario (user_id % WEB_WORKERS). Así cada usuario lo atiende siempre el mismo
 
+# proceso: sus vistas diarias, plan y borradores no se comparten en memoria entre procesos
 
-    await update.message.reply_text("✅ Serie guardada y enviada a los grupos.")
+# (los límites de can_view_video siguen siendo exactos y el orden por usuario se mantiene),
 
+# y Firestore, escrito documento a documento, es el estado compartido y persistente.
 
+ROUTE_FROM_RE = re.compile(rb'"from"\s*:\s*\{\s*"id"\s*:\s*(\d+)')
 
-# MODIFICADO: Función para detectar grupos y canales
+ROUTE_CHAT_RE = re.compile(rb'"chat"\s*:\s*\{\s*"id"\s*:\s*(-?\d+)')
 
-async def detectar_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
+router_session = None
 
-    chat = update.effective_chat
 
-    # Check for group/supergroup messages
 
-    if chat.type in ["group", "supergroup"]:
+def route_key(body):
 
-        if chat.id not in known_chats:
+    # El primer "from" del update es quien lo originó (mensaje, callback, pago, my_chat_member)
 
-            known_chats.add(chat.id)
+    match = ROUTE_FROM_RE.search(body) or ROUTE_CHAT_RE.search(body)
 
-            save_data()
+    return abs(int(match.group(1))) if match else 0
 
-            logger.info(f"Grupo registrado: {chat.id}")
 
-            await update.message.reply_text(f"✅ ¡Este grupo ha sido registrado para envíos! ID: `{chat.id}`", parse_mode="Markdown")
 
-    # Check for forwarded channel posts or bot added to channel
+async def router_webhook_handler(request):
 
-    elif update.channel_post: # This catches messages directly from a channel where the bot is admin
+    ingest_stats["received"] += 1
 
-        channel_id = update.channel_post.chat.id
+    if not has_valid_secret(request):
 
-        if channel_id not in known_chats:
+        ingest_stats["unauthorized"] += 1
 
-            known_chats.add(channel_id)
+        return web.Response(status=401, text="Unauthorized")
 
-            save_data()
 
-            logger.info(f"Canal registrado: {channel_id}")
 
-            await context.bot.send_message(
+    body = await request.read()
 
-                chat_id=channel_id,
+    update_id = extract_update_id(body)
 
-                text=f"✅ ¡Este canal ha sido registrado para envíos! ID: `{channel_id}`\n\n"
+    if update_id is not None and update_dedup.is_duplicate(update_id):
 
-                     "Asegúrate de que el bot tenga permisos de 'Publicar mensajes' y 'Editar mensajes' en este canal.",
+        ingest_stats["duplicates"] += 1
 
-                parse_mode="Markdown"
+        return web.Response(text="OK")
 
-            )
 
-    elif update.message and update.message.forward_from_chat and update.message.forward_from_chat.type == "channel":
 
-        channel_id = update.message.forward_from_chat.id
+    worker = route_key(body) % WEB_WORKERS
 
-        if channel_id not in known_chats:
+    async with router_session.post(
 
-            known_chats.add(channel_id)
+        f"http://127.0.0.1:{WORKER_BASE_PORT + worker}/webhook",
 
-            save_data()
+        data=body,
 
-            logger.info(f"Canal registrado via forward: {channel_id}")
+        headers={"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET, "Content-Type": "application/json"},
 
-            await update.message.reply_text(f"✅ ¡Canal registrado exitosamente! ID: `{channel_id}`\n\n"
+    ) as resp:
 
-                                             "Asegúrate de que el bot sea administrador con permisos de 'Publicar mensajes' y 'Editar mensajes' en tu canal para que pueda enviar contenido automáticamente.",
+        status = resp.status
 
-                                             parse_mode="Markdown")
+        text = await resp.text()
 
-    else:
+    # Las respuestas del worker (503 por cola llena, 400...) se devuelven tal cual a Telegram
 
-        # If it's a private chat and not a command, ignore, or provide info
+    if status == 200:
 
-        pass
+        ingest_stats["enqueued"] += 1
 
+        if update_id is not None:
 
+            update_dedup.remember(update_id)
 
+    return web.Response(status=status, text=text)
 
 
-# --- WEBHOOK aiohttp ---
 
-async def webhook_handler(request):
+async def router_startup(app):
 
-    data = await request.json()
+    global router_session
 
-    update = Update.de_json(data, app_telegram.bot)
+    router_session = ClientSession()
 
-    await app_telegram.update_queue.put(update)
+    await app_telegram.bot.initialize()
 
-    return web.Response(text="OK")
+    await on_startup(app)
 
 
 
-async def on_startup(app):
+async def router_shutdown(app):
 
-    webhook_url = f"{APP_URL}/webhook"
+    await on_shutdown(app)
 
-    await app_telegram.bot.set_webhook(webhook_url)
+    await app_telegram.bot.shutdown()
 
-    logger.info(f"Webhook configurado en {webhook_url}")
+    await router_session.close()
 
 
 
-async def on_shutdown(app):
+async def run_router():
 
-    await app_telegram.bot.delete_webhook()
+    router_app = web.Application()
 
-    logger.info("Webhook eliminado")
+    router_app.router.add_post("/webhook", router_webhook_handler)
 
+    router_app.router.add_get("/ping", lambda request: web.Response(text="✅ Bot activo."))
 
+    router_app.on_startup.append(router_startup)
 
-# --- App Telegram ---
+    router_app.on_shutdown.append(router_shutdown)
 
-app_telegram = Application.builder().token(TOKEN).build()
 
 
+    runner = web.AppRunner(router_app)
 
-# Agregar handlers
+    await runner.setup()
 
-app_telegram.add_handler(CommandHandler("start", start))
+    site = web.TCPSite(runner, "0.0.0.0", PORT)
 
-app_telegram.add_handler(CallbackQueryHandler(verify, pattern="^verify$"))
+    await site.start()
 
-app_telegram.add_handler(CallbackQueryHandler(handle_callback, pattern="^play_video_.*$"))
+    logger.info(f"🌐 Router corriendo en puerto {PORT} con {WEB_WORKERS} workers")
 
-app_telegram.add_handler(CallbackQueryHandler(handle_callback))
+    try:
 
-app_telegram.add_handler(PreCheckoutQueryHandler(precheckout_handler))
+        while True:
 
-app_telegram.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, successful_payment))
+            await asyncio.sleep(3600)
 
-app_telegram.add_handler(MessageHandler(filters.PHOTO & filters.ChatType.PRIVATE, recibir_foto))
+    finally:
 
-app_telegram.add_handler(MessageHandler(filters.VIDEO & filters.ChatType.PRIVATE, recibir_video_serie))
+        await runner.cleanup()
 
-# MODIFICADO: Usar la función detectar_chat para todos los tipos de chat
 
-app_telegram.add_handler(MessageHandler(filters.ALL & (filters.ChatType.GROUPS | filters.ChatType.CHANNEL), detectar_chat)) 
 
-app_telegram.add_handler(MessageHandler(filters.FORWARDED & filters.ChatType.PRIVATE, detectar_chat)) 
+def worker_entry(worker_index):
 
+    asyncio.run(main(worker_index))
 
 
-# Comandos para series
 
-app_telegram.add_handler(CommandHandler("crear_serie", crear_serie))
+def run_workers():
 
-app_telegram.add_handler(CommandHandler("agregar_capitulo", agregar_capitulo))
+    ctx = multiprocessing.get_context("spawn")
 
-app_telegram.add_handler(CommandHandler("finalizar_serie", finalizar_serie))
+    workers = [ctx.Process(target=worker_entry, args=(i,), daemon=True) for i in range(WEB_WORKERS)]
 
+    for process in workers:
 
+        process.start()
 
-# --- Servidor aiohttp ---
+    try:
 
-web_app = web.Application()
+        asyncio.run(run_router())
 
-web_app.router.add_post("/webhook", webhook_handler)
+    except (KeyboardInterrupt, SystemExit):
 
-web_app.router.add_get("/ping", lambda request: web.Response(text="✅ Bot activo."))
+        logger.info("🛑 Deteniendo router...")
 
-web_app.on_startup.append(on_startup)
+    finally:
 
-web_app.on_shutdown.append(on_shutdown)
+        for process in workers:
+
+            process.terminate()
+
+        for process in workers:
 
+            process.join()
 
 
-async def main():
+
+async def main(worker_index=None):
+
+    global current_worker
+
+    current_worker = worker_index
+
+    if worker_index is not None:
+
+        content_ids.node = content_node(worker_index)
 
     load_data()
 
@@ -1928,15 +7174,57 @@ async def main():
 
 
 
+    if worker_index is None:
+
+        host, port = "0.0.0.0", PORT
+
+    else:
+
+        # Los workers solo escuchan en local; el webhook lo registra el router
+
+        host, port = "127.0.0.1", WORKER_BASE_PORT + worker_index
+
+        web_app.on_startup.remove(on_startup)
+
+        web_app.on_shutdown.remove(on_shutdown)
+
+
+
     runner = web.AppRunner(web_app)
 
     await runner.setup()
 
-    site = web.TCPSite(runner, "0.0.0.0", PORT)
+    site = web.TCPSite(runner, host, port)
 
     await site.start()
 
-    logger.info(f"🌐 Webhook corriendo en puerto {PORT}")
+    logger.info(f"🌐 Webhook corriendo en puerto {port}")
+
+
+
+    background = [
+
+        asyncio.create_task(expiry_worker()),
+
+        asyncio.create_task(expiry_notice_sender(app_telegram.bot)),
+
+        asyncio.create_task(stats_flusher()),
+
+        asyncio.create_task(admin_stats_checker()),
+
+    ]
+
+    if WEB_WORKERS > 1 and CATALOG_REFRESH_INTERVAL > 0:
+
+        background.append(asyncio.create_task(catalog_refresher()))
+
+    if LOOP_LAG_INTERVAL > 0:
+
+        background.append(asyncio.create_task(loop_lag.run()))
+
+    if profiler.enabled:
+
+        profiler.start()
 
 
 
@@ -1952,6 +7240,18 @@ async def main():
 
     finally:
 
+        for task in background:
+
+            task.cancel()
+
+        profiler.stop()
+
+        await flush_content_views()
+
+        await flush_sketches()
+
+        await publish_worker_stats()
+
         await app_telegram.stop()
 
         await app_telegram.shutdown()
@@ -1962,4 +7262,10 @@ async def main():
 
 if __name__ == "__main__":
 
-    asyncio.run(main())
+    if WEB_WORKERS > 1:
+
+        run_workers()
+
+    else:
+
+        asyncio.run(main())
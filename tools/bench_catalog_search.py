@@ -0,0 +1,114 @@
+"""Latencia de la búsqueda inline sobre un catálogo sintético.
+
+Construye CatalogIndex con N títulos (videos y series con sinopsis) y mide el tiempo
+de search() para consultas sacadas de los títulos (palabras sueltas, pares, títulos
+completos, a medio escribir) y consultas sin resultados, sin la caché de consultas,
+y el de una página de /catalogo según su posición.
+
+    python tools/bench_catalog_search.py --titles 50000
+"""
+import argparse
+import random
+import time
+import timeit
+import tracemalloc
+
+from fakes import install_fakes
+
+install_fakes()
+
+import bot  # noqa: E402
+
+SYLLABLES = "a e i o u ma me mi mo na ne ni no ra re ri ro sa se si so ta te ti to la le li lo co ca cu da de do".split()
+
+
+def vocabulary(size, rng):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def synthetic_catalog(n, rng, words):
+    # Frecuencia de palabras tipo Zipf: unas pocas muy comunes y una cola larga
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    packages, series = {}, {}
+    for i in range(n):
+        title = " ".join(rng.choices(words, weights, k=rng.randint(2, 4))).title()
+        caption = f"{title} ({2000 + i % 25})\nSinopsis: " + " ".join(rng.choices(words, weights, k=30))
+        if i % 5:
+            packages[str(1_700_000_000 + i)] = {"photo_id": f"p{i}", "caption": caption, "video_id": f"v{i}"}
+        else:
+            series[str(1_700_000_000 + i)] = {"title": title, "photo_id": f"p{i}", "caption": caption, "capitulos": []}
+    return packages, series
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--titles", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    words = vocabulary(20000, rng)
+    packages, series = synthetic_catalog(args.titles, rng, words)
+    index = bot.CatalogIndex()
+    started = time.perf_counter()
+    index.rebuild(packages, series)
+    build_s = time.perf_counter() - started
+    tracemalloc.start()
+    measured = bot.CatalogIndex()
+    measured.rebuild(packages, series)
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del measured
+    print(f"{len(index)} títulos indexados en {build_s:.2f} s, {used / 2**20:.1f} MiB")
+
+    # Las consultas salen de títulos reales del catálogo, como las de los usuarios
+    titles = [item["caption"].split(" (")[0] for item in list(packages.values()) + list(series.values())]
+
+    def title_words(count):
+        title = rng.choice(titles).split()
+        start = rng.randint(0, max(0, len(title) - count))
+        return " ".join(title[start:start + count])
+
+    kinds = {
+        "1 palabra": lambda: title_words(1),
+        "2 palabras": lambda: title_words(2),
+        "título completo": lambda: rng.choice(titles),
+        "prefijo 2 letras": lambda: rng.choice(words)[:2],
+        "escribiendo": lambda: title_words(2)[:-2],
+        "sin resultados": lambda: f"zq{rng.choice(words)}",
+    }
+    print(f"{'consulta':>17} {'p50 (ms)':>9} {'p99 (ms)':>9} {'máx (ms)':>9} {'resultados':>11}")
+    for name, make in kinds.items():
+        timings, found = [], 0
+        for _ in range(args.queries):
+            query = make()
+            index._cache.clear()
+            started = time.perf_counter()
+            keys, _ = index.search(query)
+            timings.append((time.perf_counter() - started) * 1000)
+            found += len(keys)
+        print(
+            f"{name:>17} {percentile(timings, 0.5):>9.3f} {percentile(timings, 0.99):>9.3f} "
+            f"{max(timings):>9.3f} {found / args.queries:>11.1f}"
+        )
+
+    # Páginas de /catalogo (CatalogOrder): mismo coste al principio, en medio y al final
+    order = bot.CatalogOrder()
+    order.rebuild(packages, series)
+    entries = order._entries
+    for name, position in (("primera", None), ("mitad", len(entries) // 2), ("última", 5)):
+        cursor = entries[position] if position is not None else None
+        elapsed = min(timeit.repeat(lambda: order.page(cursor, 8), number=1000, repeat=3)) / 1000
+        print(f"página {name:>8} de /catalogo: {elapsed * 1e6:6.1f} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Micro-benchmark de la resolución de derechos en el camino de reproducción.
+
+Compara, para una reproducción (comprobar límite + permiso de reenvío), la versión
+anterior (user_premium/user_daily_views con varias llamadas a is_premium) con
+resolve_entitlement(), usando N usuarios con una mezcla de planes free/pro/ultra.
+
+    python tools/bench_playback.py --users 100000
+"""
+import argparse
+import random
+import timeit
+from datetime import datetime, timedelta, timezone
+
+from fakes import install_fakes
+
+install_fakes()
+
+import bot  # noqa: E402
+
+
+# --- Implementación anterior (referencia) ---
+legacy_premium = {}
+legacy_views = {}
+
+
+def legacy_is_premium(user_id):
+    if user_id in legacy_premium:
+        data = legacy_premium[user_id]
+        if isinstance(data, dict) and "expire_at" in data:
+            return data["expire_at"] > datetime.now(timezone.utc)
+        elif isinstance(data, datetime):
+            return data > datetime.now(timezone.utc)
+    return False
+
+
+def legacy_plan_type(user_id):
+    if legacy_is_premium(user_id):
+        data = legacy_premium[user_id]
+        if isinstance(data, dict) and "plan_type" in data:
+            return data["plan_type"]
+        return "plan_ultra"
+    return "free"
+
+
+def legacy_can_view(user_id):
+    plan_type = legacy_plan_type(user_id)
+    today = str(datetime.utcnow().date())
+    current = legacy_views.get(str(user_id), {}).get(today, 0)
+    if plan_type in ("plan_ultra", "premium_legacy"):
+        return True
+    if plan_type == "plan_pro":
+        return current < bot.PRO_LIMIT_VIDEOS
+    return current < bot.FREE_LIMIT_VIDEOS
+
+
+def legacy_playback(user_id):
+    return legacy_can_view(user_id), legacy_plan_type(user_id) in ("plan_ultra", "premium_legacy")
+
+
+def new_playback(user_id):
+    ent = bot.resolve_entitlement(user_id)
+    return ent.can_view, ent.can_resend
+
+
+def populate(n):
+    rng = random.Random(1)
+    expire = datetime.now(timezone.utc) + timedelta(days=10)
+    today = str(datetime.utcnow().date())
+    bot.users.clear()
+    for user_id in range(1, n + 1):
+        plan = rng.choice(["free", "free", "free", "plan_pro", "plan_ultra"])
+        views = rng.randint(0, 60)
+        record = bot.get_or_create_user(user_id)
+        record.views_day, record.views = bot.utc_day(), views
+        legacy_views[str(user_id)] = {today: views}
+        if plan != "free":
+            record.set_plan(plan, expire)
+            legacy_premium[user_id] = {"expire_at": expire, "plan_type": plan}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--calls", type=int, default=200000)
+    args = parser.parse_args()
+
+    populate(args.users)
+    ids = [random.randint(1, args.users) for _ in range(args.calls)]
+    for name, func in (("anterior", legacy_playback), ("resolve_entitlement", new_playback)):
+        elapsed = min(timeit.repeat(lambda: [func(u) for u in ids], number=1, repeat=3))
+        print(f"{name:>20}: {elapsed / args.calls * 1e9:8.0f} ns/reproducción")
+
+
+if __name__ == "__main__":
+    main()
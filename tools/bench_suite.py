@@ -0,0 +1,227 @@
+"""Micro-benchmarks de los caminos calientes de bot.py.
+
+Importa bot.py sin Firestore ni red (tools/fakes.py) y mide, con el mejor de --repeat:
+permisos (is_premium, get_user_plan_type, can_view_video), register_view,
+generate_chapter_buttons con 10-1000 capítulos, handle_callback para cada tipo de
+callback, Update.de_json de payloads típicos y save_data() con --users usuarios.
+
+Cada ejecución se añade como una línea a --results (JSONL con commit, versión de
+Python y tiempo por operación de cada caso) y se compara con la anterior:
+
+    python tools/bench_suite.py
+    python tools/bench_suite.py --only handle_callback --repeat 10
+    python tools/bench_suite.py --users 100000 --no-save
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import time
+from datetime import datetime, timedelta, timezone
+
+from fakes import install_fakes, use_fake_bot_api
+
+store = install_fakes()
+
+import bot  # noqa: E402
+from telegram import Update  # noqa: E402
+from telegram.ext import CallbackContext  # noqa: E402
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RESULTS = os.path.join(TOOLS, "bench_results.jsonl")
+USER = 20  # usuario con plan ultra para los callbacks (sin límite de vistas)
+# Un callback_data de cada rama de handle_callback
+CALLBACKS = {
+    "menu_principal": "menu_principal",
+    "planes": "planes",
+    "perfil": "perfil",
+    "comprar_pro": "comprar_pro",
+    "comprar_ultra": "comprar_ultra",
+    "audio_libros": "audio_libros",
+    "libro_pdf": "libro_pdf",
+    "chat_pedido": "chat_pedido",
+    "cursos": "cursos",
+    "catalogo": "catalogo_",
+    "serie_list": "serie_list_S0",
+    "play_video": "play_video_V0",
+    "cap": "cap_S0_0",
+}
+
+
+def seed_catalog():
+    store.data["videos"] = {
+        f"V{i}": {"photo_id": f"photo{i}", "caption": f"Video {i}\nsinopsis", "video_id": f"video{i}"} for i in range(100)
+    }
+    store.data["series_data"] = {
+        f"S{i}": {"title": f"Serie {i}", "photo_id": f"sphoto{i}", "caption": f"Serie {i}", "capitulos": [f"S{i}cap{c}" for c in range(24)]}
+        for i in range(20)
+    }
+    bot.load_data()
+
+
+def populate_users(n):
+    # Mezcla de planes como en producción: la mayoría free, con vistas de hoy
+    expire = datetime.now(timezone.utc) + timedelta(days=10)
+    today = bot.utc_day()
+    for user_id in range(1, n + 1):
+        record = bot.get_or_create_user(user_id)
+        plan = ("free", "free", "free", "plan_pro", "plan_ultra")[user_id % 5]
+        if plan != "free":
+            record.set_plan(plan, expire)
+        bot.view_counts.set(user_id, today, user_id % 60)
+    bot.get_or_create_user(USER).set_plan("plan_ultra", expire)
+
+
+def payloads(data="play_video_V1"):
+    sender = {"id": USER, "is_bot": False, "first_name": "u", "language_code": "es"}
+    chat = {"id": USER, "type": "private", "first_name": "u"}
+    message = {"message_id": 1, "date": int(time.time()), "chat": chat, "from": sender}
+    return {
+        "command": {"update_id": 1, "message": {**message, "text": "/start video_V1", "entities": [{"type": "bot_command", "offset": 0, "length": 6}]}},
+        "callback_query": {
+            "update_id": 2,
+            "callback_query": {"id": "2", "from": sender, "chat_instance": "1", "data": data, "message": {**message, "text": "menu"}},
+        },
+        "inline_query": {"update_id": 3, "inline_query": {"id": "3", "from": sender, "query": "serie", "offset": ""}},
+        "video": {
+            "update_id": 4,
+            "message": {**message, "video": {"file_id": "v", "file_unique_id": "u", "width": 1280, "height": 720, "duration": 1500}},
+        },
+        "successful_payment": {
+            "update_id": 5,
+            "message": {
+                **message,
+                "successful_payment": {
+                    "currency": "XTR", "total_amount": 1, "invoice_payload": "plan_pro",
+                    "telegram_payment_charge_id": "c", "provider_payment_charge_id": "p",
+                },
+            },
+        },
+    }
+
+
+# --- Casos: cada uno recibe n y ejecuta n operaciones ---
+def build_cases(args, loop):
+    ids = [1 + (i * 7919) % args.users for i in range(10000)]
+    cases = []
+
+    for func in (bot.is_premium, bot.get_user_plan_type, bot.can_view_video):
+        def run(n, func=func):
+            for i in range(n):
+                func(ids[i % len(ids)])
+        cases.append((func.__name__, run, 100000))
+
+    async def register(n):
+        for i in range(n):
+            await bot.register_view(ids[i % len(ids)])
+    cases.append(("register_view", lambda n: loop.run_until_complete(register(n)), 2000))
+
+    for chapters in (10, 100, 1000):
+        cases.append((
+            f"generate_chapter_buttons[{chapters}]",
+            lambda n, chapters=chapters: [bot.generate_chapter_buttons("S0", chapters) for _ in range(n)],
+            max(10, 20000 // chapters),
+        ))
+
+    for label, data in CALLBACKS.items():
+        update = Update.de_json(payloads(data)["callback_query"], bot.app_telegram.bot)
+        context = CallbackContext.from_update(update, bot.app_telegram)
+
+        async def dispatch(n, update=update, context=context):
+            for _ in range(n):
+                await bot.handle_callback(update, context)
+        cases.append((f"handle_callback[{label}]", lambda n, dispatch=dispatch: loop.run_until_complete(dispatch(n)), 500))
+
+    for name, payload in payloads().items():
+        def parse(n, payload=payload):
+            for _ in range(n):
+                Update.de_json(payload, bot.app_telegram.bot)
+        cases.append((f"de_json[{name}]", parse, 20000))
+
+    cases.append((f"save_data[{args.users}]", lambda n: [bot.save_data() for _ in range(n)], 1))
+    return cases
+
+
+def measure(run, number, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run(number)
+        elapsed = (time.perf_counter() - started) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1e9
+
+
+def format_ns(ns):
+    for unit, scale in (("s", 1e9), ("ms", 1e6), ("µs", 1e3)):
+        if ns >= scale:
+            return f"{ns / scale:.2f} {unit}"
+    return f"{ns:.0f} ns"
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=TOOLS, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def last_run(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        lines = [line for line in f if line.strip()]
+    return json.loads(lines[-1]) if lines else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", default="", help="solo los casos cuyo nombre contiene este texto")
+    parser.add_argument("--results", default=DEFAULT_RESULTS)
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    fake_api = use_fake_bot_api(bot.app_telegram)
+    loop.run_until_complete(bot.app_telegram.initialize())
+    seed_catalog()
+    populate_users(args.users)
+
+    previous = last_run(args.results)
+    before = previous["results"] if previous else {}
+    if previous:
+        print(f"comparando con {previous['commit'] or '?'} ({previous['ts']})")
+    print(f"{'caso':>34} {'por operación':>14} {'anterior':>12} {'cambio':>8}")
+    results = {}
+    for name, run, number in build_cases(args, loop):
+        if args.only not in name:
+            continue
+        run(min(number, 10))  # calentamiento (cachés, índices, imports perezosos)
+        results[name] = ns = measure(run, number, args.repeat)
+        old = before.get(name)
+        change = f"{(ns - old) / old * 100:+7.1f}%" if old else ""
+        print(f"{name:>34} {format_ns(ns):>14} {format_ns(old) if old else '-':>12} {change:>8}")
+        fake_api.calls.clear()
+
+    if not args.no_save:
+        record = {
+            "ts": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "users": args.users,
+            "results": {name: round(ns, 1) for name, ns in results.items()},
+        }
+        with open(args.results, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+        print(f"resultados guardados en {args.results}")
+    loop.run_until_complete(bot.app_telegram.shutdown())
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
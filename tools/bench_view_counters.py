@@ -0,0 +1,83 @@
+"""Memoria por usuario de los contadores de vistas diarias.
+
+Compara el formato antiguo (dict de dicts con claves str y fechas str), los
+UserRecord (VIEW_COUNTER_STORE=records) y CompactViewCounters
+(VIEW_COUNTER_STORE=compact), más el tiempo de exportar el día completo y el de
+una consulta get() del contador.
+
+    python tools/bench_view_counters.py --users 300000
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+from fakes import install_fakes
+
+install_fakes()
+
+import bot  # noqa: E402
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    obj = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, after - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=300000)
+    args = parser.parse_args()
+
+    n = args.users
+    today = bot.utc_day()
+    today_key = bot.day_key(today)
+    base_id = 5_000_000_000  # ids reales de Telegram: enteros grandes
+
+    def legacy():
+        return {str(base_id + i): {str(today_key): i % 50 + 1} for i in range(n)}
+
+    def records():
+        bot.users = {}
+        counters = bot.RecordViewCounters()
+        for i in range(n):
+            counters.set(base_id + i, today, i % 50 + 1)
+        return bot.users
+
+    def compact():
+        counters = bot.CompactViewCounters()
+        for i in range(n):
+            counters.set(base_id + i, today, i % 50 + 1)
+        return counters
+
+    print(f"{n} usuarios con vistas hoy")
+    print(f"{'formato':>22} {'bytes/usuario':>14} {'export (ms)':>12} {'get (ns)':>9}")
+    sample = [base_id + (i * 7919) % n for i in range(100000)]
+    for name, build in (("dict de dicts (antes)", legacy), ("UserRecord", records), ("CompactViewCounters", compact)):
+        obj, used = measure(build)
+        if name == "dict de dicts (antes)":
+            started = time.perf_counter()
+            [(uid, views[today_key]) for uid, views in obj.items() if views.get(today_key)]
+            export_ms = (time.perf_counter() - started) * 1000
+            started = time.perf_counter()
+            [obj.get(str(uid), {}).get(today_key, 0) for uid in sample]
+        else:
+            counters = bot.RecordViewCounters() if name == "UserRecord" else obj
+            started = time.perf_counter()
+            counters.export(today)
+            export_ms = (time.perf_counter() - started) * 1000
+            started = time.perf_counter()
+            [counters.get(uid, today) for uid in sample]
+        get_ns = (time.perf_counter() - started) / len(sample) * 1e9
+        print(f"{name:>22} {used / n:>14.1f} {export_ms:>12.1f} {get_ns:>9.0f}")
+        del obj
+    print(f"export con NumPy: {'sí' if bot.np is not None else 'no (array puro)'}")
+
+
+if __name__ == "__main__":
+    main()
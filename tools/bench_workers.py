@@ -0,0 +1,159 @@
+"""Benchmark de throughput del bot con 1..N workers (WEB_WORKERS).
+
+Levanta tools/fake_bot_api.py y, para cada número de workers, tools/run_fake_bot.py;
+envía updates sintéticos al webhook (callbacks de menú y de reproducción de muchos
+usuarios) y mide updates/s hasta que la Bot API falsa deja de recibir llamadas.
+
+    python tools/bench_workers.py --workers 1,2,4 --updates 4000
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from aiohttp import ClientSession
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+TOKEN = "123456:FAKE-TOKEN"
+
+
+def callback_update(update_id, user_id, data):
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": "u"},
+            "chat_instance": "1",
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "Bot"},
+                "text": "menu",
+            },
+        },
+    }
+
+
+def synthetic_updates(count, users):
+    for i in range(count):
+        user_id = 1000 + i % users
+        data = f"play_video_{i % 100}" if i % 2 else "menu_principal"
+        yield json.dumps(callback_update(i + 1, user_id, data)).encode()
+
+
+async def wait_http(session, url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(url) as resp:
+                if resp.status == 200:
+                    return
+        except OSError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} no respondió")
+
+
+async def api_calls(session, api_url):
+    async with session.get(f"{api_url}/stats") as resp:
+        return (await resp.json())["total"]
+
+
+async def run_level(session, workers, args, api_url):
+    port = args.port
+    env = dict(
+        os.environ,
+        TOKEN=TOKEN,
+        PORT=str(port),
+        WEB_WORKERS=str(workers),
+        WORKER_BASE_PORT=str(port + 1),
+        TELEGRAM_API_URL=api_url,
+        CALLBACK_RATE="1000000",
+        CALLBACK_BURST="1000000",
+        UPDATE_QUEUE_MAXSIZE="100000",
+    )
+    bot_proc = subprocess.Popen(
+        [sys.executable, os.path.join(TOOLS, "run_fake_bot.py")],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        await wait_http(session, f"http://127.0.0.1:{port}/ping")
+        if workers > 1:
+            for i in range(workers):
+                await wait_http(session, f"http://127.0.0.1:{port + 1 + i}/ping")
+        async with session.post(f"{api_url}/reset"):
+            pass
+
+        headers = {
+            "X-Telegram-Bot-Api-Secret-Token": hashlib.sha256(TOKEN.encode()).hexdigest(),
+            "Content-Type": "application/json",
+        }
+        webhook = f"http://127.0.0.1:{port}/webhook"
+        sem = asyncio.Semaphore(args.concurrency)
+
+        async def send(body):
+            async with sem:
+                async with session.post(webhook, data=body, headers=headers) as resp:
+                    await resp.read()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(send(b) for b in synthetic_updates(args.updates, args.users)))
+
+        # Terminado cuando la Bot API falsa deja de recibir llamadas
+        last_total, last_change = -1, time.perf_counter()
+        while time.perf_counter() - last_change < 1.0:
+            total = await api_calls(session, api_url)
+            if total != last_total:
+                last_total, last_change = total, time.perf_counter()
+            await asyncio.sleep(0.1)
+        return args.updates / (last_change - started), last_total
+    finally:
+        bot_proc.send_signal(signal.SIGINT)
+        try:
+            bot_proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            bot_proc.kill()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--updates", type=int, default=4000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=64, help="peticiones webhook en vuelo")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--api-port", type=int, default=18070)
+    args = parser.parse_args()
+
+    api_url = f"http://127.0.0.1:{args.api_port}"
+    api_proc = subprocess.Popen(
+        [sys.executable, os.path.join(TOOLS, "fake_bot_api.py"), "--port", str(args.api_port)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        async with ClientSession() as session:
+            await wait_http(session, f"{api_url}/stats")
+            print(f"CPUs disponibles: {os.cpu_count()}")
+            print(f"{'workers':>8} {'updates/s':>10} {'speedup':>8} {'llamadas API':>13}")
+            baseline = None
+            for workers in (int(x) for x in args.workers.split(",")):
+                throughput, calls = await run_level(session, workers, args, api_url)
+                baseline = baseline or throughput
+                print(f"{workers:>8} {throughput:>10.1f} {throughput / baseline:>7.2f}x {calls:>13}")
+    finally:
+        api_proc.terminate()
+        api_proc.wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
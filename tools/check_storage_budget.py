@@ -0,0 +1,142 @@
+"""Comprueba el presupuesto de operaciones de Firestore por tipo de update.
+
+Procesa updates de ejemplo (callbacks de menú y reproducción, deep links, subida de
+contenido, pagos, búsqueda inline...) con Firestore en memoria y la Bot API falsa,
+y compara las lecturas/escrituras que bot.py atribuye a cada handler
+(bot_storage_ops_total) con BUDGETS. Sale con código 1 si alguno se pasa, así que
+sirve como prueba local antes de subir cambios:
+
+    python tools/check_storage_budget.py
+"""
+import asyncio
+import sys
+import time
+
+from fakes import install_fakes, use_fake_bot_api
+
+# Sin límite de callbacks: aquí se mide el coste de cada handler, no el control de flujo
+store = install_fakes({"CALLBACK_RATE": "1000", "CALLBACK_BURST": "1000", "ADMIN_IDS": "10"})
+
+import bot  # noqa: E402
+from telegram import Update  # noqa: E402
+
+ADMIN = 10
+USER = 20
+
+# handler: (máximo de lecturas, máximo de escrituras) por update
+BUDGETS = {
+    "start": (0, 0),
+    "catalogo": (0, 0),
+    "stats": (0, 0),
+    "handle_callback:menu_principal": (0, 0),
+    "handle_callback:planes": (0, 0),
+    "handle_callback:catalogo": (0, 0),
+    "handle_callback:serie_list": (0, 0),
+    "handle_callback:play_video": (0, 1),
+    "handle_callback:cap": (0, 1),
+    "inline_search": (0, 0),
+    "recibir_foto": (0, 1),
+    "recibir_video_serie": (0, 2),
+    "crear_serie": (0, 1),
+    "finalizar_serie": (0, 2),
+    "successful_payment": (0, 1),
+    "registrar_chat": (0, 1),
+}
+
+
+def user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": "u"}
+
+
+def message(update_id, user_id, **fields):
+    msg = {"message_id": update_id, "date": int(time.time()), "chat": {"id": user_id, "type": "private"}, "from": user(user_id)}
+    msg.update(fields)
+    return {"update_id": update_id, "message": msg}
+
+
+def command(update_id, user_id, text):
+    name = text.split()[0]
+    return message(update_id, user_id, text=text, entities=[{"type": "bot_command", "offset": 0, "length": len(name)}])
+
+
+def callback(update_id, user_id, data):
+    msg = {"message_id": update_id, "date": int(time.time()), "chat": {"id": user_id, "type": "private"}, "text": "menu"}
+    return {"update_id": update_id, "callback_query": {"id": str(update_id), "from": user(user_id), "chat_instance": "1", "data": data, "message": msg}}
+
+
+def scenarios():
+    video = {"file_id": "nuevo", "file_unique_id": "u", "width": 1, "height": 1, "duration": 1}
+    photo = [{"file_id": "foto", "file_unique_id": "f", "width": 1, "height": 1}]
+    invoice = {"currency": "XTR", "total_amount": 1, "invoice_payload": "plan_pro", "telegram_payment_charge_id": "c", "provider_payment_charge_id": "p"}
+    yield "start", command(1, USER, "/start video_V1")
+    yield "catalogo", command(2, USER, "/catalogo")
+    yield "handle_callback:menu_principal", callback(3, USER, "menu_principal")
+    yield "handle_callback:planes", callback(4, USER, "planes")
+    yield "handle_callback:catalogo", callback(5, USER, "catalogo_")
+    yield "handle_callback:serie_list", callback(6, USER, "serie_list_S1")
+    yield "handle_callback:play_video", callback(7, USER, "play_video_V1")
+    yield "handle_callback:cap", callback(8, USER, "cap_S1_0")
+    yield "inline_search", {"update_id": 9, "inline_query": {"id": "q", "from": user(USER), "query": "serie", "offset": ""}}
+    yield "recibir_foto", message(10, ADMIN, photo=photo, caption="Nuevo video\nsinopsis")
+    yield "recibir_video_serie", message(11, ADMIN, video=video)
+    yield "recibir_foto", message(12, ADMIN, photo=photo, caption="Nueva serie\nsinopsis")
+    yield "crear_serie", command(13, ADMIN, "/crear_serie")
+    yield "recibir_video_serie", message(14, ADMIN, video=video)
+    yield "finalizar_serie", command(15, ADMIN, "/finalizar_serie")
+    yield "successful_payment", message(16, USER, successful_payment=invoice)
+    yield "registrar_chat", {"update_id": 17, "my_chat_member": {
+        "chat": {"id": -100, "type": "supergroup", "title": "g"}, "from": user(ADMIN), "date": int(time.time()),
+        "old_chat_member": {"status": "left", "user": bot_user()},
+        "new_chat_member": {"status": "member", "user": bot_user()},
+    }}
+    yield "stats", command(18, ADMIN, "/stats")
+
+
+def bot_user():
+    return {"id": 1, "is_bot": True, "first_name": "Bot", "username": "fake_bot"}
+
+
+def seed():
+    store.data["videos"] = {"V1": {"photo_id": "p1", "caption": "Video uno", "video_id": "v1"}}
+    store.data["series_data"] = {"S1": {"title": "Serie uno", "photo_id": "p2", "caption": "Serie uno", "capitulos": ["c1", "c2"]}}
+
+
+def ops_by_handler():
+    return dict(bot.storage_ops_total.values)
+
+
+async def main():
+    seed()
+    bot.load_data()
+    app = bot.app_telegram
+    use_fake_bot_api(app)
+    await app.initialize()
+    await app.start()
+
+    failures = 0
+    print(f"{'handler':>32} {'lecturas':>9} {'escrituras':>11} {'presupuesto':>12}")
+    for expected, data in scenarios():
+        update = Update.de_json(data, app.bot)
+        label = bot.handler_label(update)
+        before = ops_by_handler()
+        await app.process_update(update)
+        after = ops_by_handler()
+        reads = after.get((label, "read"), 0) - before.get((label, "read"), 0)
+        writes = after.get((label, "write"), 0) - before.get((label, "write"), 0)
+        max_reads, max_writes = BUDGETS[expected]
+        ok = label == expected and reads <= max_reads and writes <= max_writes
+        failures += not ok
+        mark = "ok" if ok else "EXCEDIDO" if label == expected else f"handler {label}"
+        print(f"{expected:>32} {reads:>9} {writes:>11} {f'≤{max_reads}/≤{max_writes}':>12}  {mark}")
+
+    await app.stop()
+    await app.shutdown()
+    if failures:
+        print(f"\n❌ {failures} update(s) fuera de presupuesto")
+        return 1
+    print("\n✅ Todos los updates dentro de presupuesto")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
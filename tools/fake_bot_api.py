@@ -0,0 +1,120 @@
+"""Servidor aiohttp que sustituye a api.telegram.org para pruebas locales.
+
+Responde a /bot<TOKEN>/<método> con las mismas respuestas que FakeRequest y
+cuenta las llamadas por método (GET /stats las devuelve, POST /reset las borra).
+El bot lo usa con TELEGRAM_API_URL=http://127.0.0.1:<puerto>.
+
+Puede simular los límites de Telegram en los métodos de envío: --max-rps responde
+429 con retry_after cuando se supera el máximo de envíos por segundo (y sigue
+respondiendo 429 hasta que pasa ese tiempo), y --error-rate devuelve 429 al azar.
+
+    python tools/fake_bot_api.py --port 8081 --latency 0.05
+    python tools/fake_bot_api.py --port 8081 --max-rps 30 --retry-after 2
+"""
+import argparse
+import asyncio
+import math
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+from fakes import SEND_METHODS, FakeRequest
+
+LIMITED_METHODS = SEND_METHODS | {"editMessageMedia", "editMessageText", "copyMessage", "forwardMessage"}
+
+
+class FakeBotApi:
+    def __init__(self, latency=0.0, max_rps=0, error_rate=0.0, retry_after=1):
+        self.latency = latency
+        self.max_rps = max_rps
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.counts = Counter()
+        self.rate_limited = Counter()
+        self.on_call = None  # callable(método, parámetros, status) para los arneses en el mismo proceso
+        self._responder = FakeRequest()
+        self._window = (0, 0)  # (segundo, envíos en ese segundo)
+        self._blocked_until = 0.0
+
+    def check_limit(self, method):
+        # Devuelve los segundos de retry_after si la llamada debe responder 429
+        if method not in LIMITED_METHODS:
+            return None
+        now = time.monotonic()
+        if now < self._blocked_until:
+            return math.ceil(self._blocked_until - now)
+        if self.error_rate and random.random() < self.error_rate:
+            return self.retry_after
+        if self.max_rps:
+            second, sent = self._window
+            if int(now) != second:
+                second, sent = int(now), 0
+            self._window = (second, sent + 1)
+            if sent >= self.max_rps:
+                self._blocked_until = now + self.retry_after
+                return self.retry_after
+        return None
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        self.counts[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        retry_after = self.check_limit(method)
+        status = 200 if retry_after is None else 429
+        if self.on_call is not None:
+            self.on_call(method, params, status)
+        if retry_after is not None:
+            self.rate_limited[method] += 1
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {retry_after}",
+                    "parameters": {"retry_after": retry_after},
+                },
+                status=429,
+            )
+        return web.json_response({"ok": True, "result": self._responder.result_for(method, params)})
+
+    async def stats(self, request):
+        return web.json_response({
+            "total": sum(self.counts.values()),
+            "methods": dict(self.counts),
+            "rate_limited": dict(self.rate_limited),
+        })
+
+    async def reset(self, request):
+        self.counts.clear()
+        self.rate_limited.clear()
+        self._blocked_until = 0.0
+        return web.json_response({"ok": True})
+
+    def make_app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/stats", self.stats)
+        app.router.add_post("/reset", self.reset)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="segundos por llamada")
+    parser.add_argument("--max-rps", type=int, default=0, help="envíos por segundo antes de responder 429 (0 = sin límite)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fracción de envíos que responden 429 al azar")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after de las respuestas 429 (segundos)")
+    args = parser.parse_args()
+    api = FakeBotApi(args.latency, args.max_rps, args.error_rate, args.retry_after)
+    web.run_app(api.make_app(), host="127.0.0.1", port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
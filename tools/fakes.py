@@ -0,0 +1,341 @@
+"""Fakes para importar bot.py sin Firestore ni credenciales reales.
+
+Uso:
+    from fakes import install_fakes
+    install_fakes()
+    import bot
+"""
+import asyncio
+import copy
+import json
+import os
+import sys
+import time
+import types
+
+from telegram.request import BaseRequest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# --- Firestore en memoria ---
+class ArrayUnion:
+    def __init__(self, values):
+        self.values = list(values)
+
+
+class ArrayRemove:
+    def __init__(self, values):
+        self.values = list(values)
+
+
+class Increment:
+    def __init__(self, value):
+        self.value = value
+
+
+def apply_transforms(current, data):
+    # Resuelve los valores especiales (ArrayUnion) contra el documento actual
+    result = {}
+    for key, value in data.items():
+        if isinstance(value, ArrayUnion):
+            existing = list((current or {}).get(key, []))
+            result[key] = existing + [v for v in value.values if v not in existing]
+        elif isinstance(value, ArrayRemove):
+            result[key] = [v for v in (current or {}).get(key, []) if v not in value.values]
+        elif isinstance(value, Increment):
+            result[key] = (current or {}).get(key, 0) + value.value
+        else:
+            result[key] = copy.deepcopy(value)
+    return result
+
+
+def merge_into(current, data):
+    # set(merge=True) de Firestore: los mapas anidados se combinan campo a campo
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(current.get(key), dict):
+            merge_into(current[key], value)
+        else:
+            current[key] = value
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+
+class FakeDocumentReference:
+    def __init__(self, client, collection, doc_id):
+        self._client = client
+        self._collection = collection
+        self.id = doc_id
+
+    def _docs(self):
+        return self._client.data.setdefault(self._collection, {})
+
+    def get(self, transaction=None):
+        self._client.reads += 1
+        return FakeDocumentSnapshot(self.id, self._docs().get(self.id))
+
+    def set(self, data, merge=False):
+        self._client.writes += 1
+        current = self._docs().get(self.id)
+        if merge and current is not None:
+            merge_into(current, apply_transforms(current, data))
+        else:
+            self._docs()[self.id] = apply_transforms(current, data)
+
+    def update(self, data):
+        self._client.writes += 1
+        current = self._docs().setdefault(self.id, {})
+        current.update(apply_transforms(current, data))
+
+    def delete(self):
+        self._client.writes += 1
+        self._docs().pop(self.id, None)
+
+
+class Query:
+    ASCENDING = "ASCENDING"
+    DESCENDING = "DESCENDING"
+
+
+class FakeQuery:
+    """Consultas por id de documento: order_by("__name__"), start_at/start_after, end_before, select, limit."""
+
+    def __init__(self, client, name, descending=False, bound=None, end=None, fields=None, limit=None):
+        self._client = client
+        self._name = name
+        self._descending = descending
+        self._bound = bound  # (inclusivo, doc_id)
+        self._end = end      # doc_id (exclusivo)
+        self._fields = fields
+        self._limit = limit
+
+    def _copy(self, **changes):
+        state = dict(descending=self._descending, bound=self._bound, end=self._end, fields=self._fields, limit=self._limit)
+        state.update(changes)
+        return FakeQuery(self._client, self._name, **state)
+
+    def order_by(self, field_path, direction=Query.ASCENDING):
+        assert field_path == "__name__", "FakeQuery solo ordena por id de documento"
+        return self._copy(descending=direction == Query.DESCENDING)
+
+    def start_at(self, values):
+        return self._copy(bound=(True, values["__name__"]))
+
+    def start_after(self, values):
+        return self._copy(bound=(False, values["__name__"]))
+
+    def end_before(self, values):
+        return self._copy(end=values["__name__"])
+
+    def select(self, field_paths):
+        return self._copy(fields=list(field_paths))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def stream(self):
+        docs = self._client.data.get(self._name, {})
+        doc_ids = sorted(docs, reverse=self._descending)
+        if self._bound is not None:
+            inclusive, bound = self._bound
+            if self._descending:
+                doc_ids = [d for d in doc_ids if d < bound or (inclusive and d == bound)]
+            else:
+                doc_ids = [d for d in doc_ids if d > bound or (inclusive and d == bound)]
+        if self._end is not None:
+            doc_ids = [d for d in doc_ids if (d > self._end if self._descending else d < self._end)]
+        if self._limit is not None:
+            doc_ids = doc_ids[:self._limit]
+        for doc_id in doc_ids:
+            self._client.reads += 1
+            data = docs[doc_id]
+            if self._fields is not None:
+                data = {key: data[key] for key in self._fields if key in data}
+            yield FakeDocumentSnapshot(doc_id, data)
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client, name):
+        super().__init__(client, name)
+
+    def document(self, doc_id):
+        return FakeDocumentReference(self._client, self._name, str(doc_id))
+
+    def stream(self):
+        docs = self._client.data.get(self._name, {})
+        for doc_id in list(docs):
+            self._client.reads += 1
+            yield FakeDocumentSnapshot(doc_id, docs[doc_id])
+
+
+class FakeWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._ops = []
+
+    def set(self, doc_ref, data, merge=False):
+        self._ops.append((doc_ref, data, merge))
+
+    def delete(self, doc_ref):
+        self._ops.append((doc_ref, None, False))
+
+    def commit(self):
+        for doc_ref, data, merge in self._ops:
+            if data is None:
+                doc_ref.delete()
+            else:
+                doc_ref.set(data, merge=merge)
+        self._ops = []
+
+
+class FakeTransaction:
+    """Transacción que aplica las escrituras al confirmar (el fake es de un solo hilo)."""
+
+    def __init__(self, client):
+        self._client = client
+        self._batch = FakeWriteBatch(client)
+
+    def set(self, doc_ref, data, merge=False):
+        self._batch.set(doc_ref, data, merge=merge)
+
+    def commit(self):
+        self._batch.commit()
+
+
+class transactional:
+    """Como firestore.transactional: devuelve un objeto invocable, no una función (sin __name__)."""
+
+    def __init__(self, func):
+        self._func = func
+
+    def __call__(self, transaction, *args, **kwargs):
+        result = self._func(transaction, *args, **kwargs)
+        transaction.commit()
+        return result
+
+
+class FakeFirestoreClient:
+    """Subconjunto de google.cloud.firestore.Client guardado en dicts."""
+
+    def __init__(self):
+        self.data = {}  # {collection: {doc_id: dict}}
+        self.reads = 0
+        self.writes = 0
+
+    def collection(self, name):
+        return FakeCollectionReference(self, name)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def transaction(self):
+        return FakeTransaction(self)
+
+
+# --- Bot API local (sin red) ---
+FAKE_BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bot", "username": "fake_bot"}
+
+SEND_METHODS = {"sendMessage", "sendPhoto", "sendVideo", "sendInvoice", "sendMediaGroup"}
+
+
+class FakeRequest(BaseRequest):
+    """BaseRequest que responde localmente a la Bot API y registra las llamadas.
+
+    `latency` simula el tiempo de ida y vuelta hacia api.telegram.org.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = []  # [(method, params)]
+        self.sent = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def result_for(self, method, params):
+        if method == "getMe":
+            return FAKE_BOT_USER
+        if method == "getChatMember":
+            return {"status": "member", "user": {"id": int(params.get("user_id", 0)), "is_bot": False, "first_name": "u"}}
+        if method in SEND_METHODS:
+            chat_id = params.get("chat_id", 0)
+            chat_id = int(chat_id) if str(chat_id).lstrip("-").isdigit() else 0
+            self.sent += 1
+            message = {"message_id": self.sent, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}}
+            return [message] if method == "sendMediaGroup" else message
+        return True
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls.append((api_method, params))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return 200, json.dumps({"ok": True, "result": self.result_for(api_method, params)}).encode()
+
+
+def use_fake_bot_api(application, request=None):
+    """Sustituye el cliente HTTP del bot por FakeRequest, conservando MeteredRequest si lo hay.
+
+    Devuelve el FakeRequest para inspeccionar las llamadas.
+    """
+    request = request or FakeRequest()
+    current = application.bot._request[1]
+    if hasattr(current, "_inner"):
+        current._inner = request
+        application.bot._request = (current, current)
+    else:
+        application.bot._request = (request, request)
+    return request
+
+
+def install_fakes(env=None):
+    """Registra módulos firebase_admin falsos y las variables de entorno mínimas.
+
+    Devuelve el cliente Firestore en memoria que usará bot.py.
+    """
+    defaults = {
+        "GOOGLE_APPLICATION_CREDENTIALS_JSON": json.dumps(json.dumps({})),
+        "TOKEN": "123456:FAKE-TOKEN",
+        "APP_URL": "http://127.0.0.1",
+    }
+    defaults.update(env or {})
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+
+    client = FakeFirestoreClient()
+    firebase_admin = types.ModuleType("firebase_admin")
+    firebase_admin.initialize_app = lambda *args, **kwargs: None
+    credentials = types.ModuleType("firebase_admin.credentials")
+    credentials.Certificate = lambda path: None
+    firestore = types.ModuleType("firebase_admin.firestore")
+    firestore.client = lambda: client
+    firestore.ArrayUnion = ArrayUnion
+    firestore.ArrayRemove = ArrayRemove
+    firestore.Increment = Increment
+    firestore.transactional = transactional
+    firestore.Query = Query
+    firebase_admin.credentials = credentials
+    firebase_admin.firestore = firestore
+    sys.modules["firebase_admin"] = firebase_admin
+    sys.modules["firebase_admin.credentials"] = credentials
+    sys.modules["firebase_admin.firestore"] = firestore
+
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    return client
@@ -0,0 +1,268 @@
+"""Prueba de carga de extremo a extremo: webhook -> bot -> Bot API falsa.
+
+Arranca en este proceso la Bot API falsa (tools/fake_bot_api.py, con latencia y 429
+opcionales) y, en un subproceso, el bot completo con Firestore en memoria
+(tools/run_fake_bot.py). Luego --users usuarios virtuales recorren sesiones
+sintéticas: /start, reproducción de un video, lista de una serie, varios capítulos
+con "Siguiente" y, una fracción --pay-fraction, la compra de un plan (invoice,
+pre_checkout_query y successful_payment).
+
+Cada paso espera la llamada a la Bot API que lo completa (sendVideo, sendInvoice,
+answerPreCheckoutQuery...) y la latencia es desde el POST al webhook hasta esa
+llamada. Un 429 en un envío del paso o un aviso en answerCallbackQuery (control de
+flujo) también lo terminan, con su propio resultado. Se informa del throughput y de
+p50/p95/p99 por paso:
+
+    python tools/load_e2e.py --users 50 --duration 30
+    python tools/load_e2e.py --users 200 --api-latency 0.05 --max-rps 30 --retry-after 2
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+from collections import Counter
+
+from aiohttp import ClientSession, web
+
+from bench_workers import TOKEN, callback_update, wait_http
+from fake_bot_api import FakeBotApi
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+FIRST_USER = 100000
+
+
+# --- Updates sintéticos ---
+def user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": "u"}
+
+
+def message_update(update_id, user_id, **fields):
+    msg = {"message_id": update_id, "date": int(time.time()), "chat": {"id": user_id, "type": "private"}, "from": user(user_id)}
+    msg.update(fields)
+    return {"update_id": update_id, "message": msg}
+
+
+def start_update(update_id, user_id):
+    return message_update(update_id, user_id, text="/start", entities=[{"type": "bot_command", "offset": 0, "length": 6}])
+
+
+def pre_checkout_update(update_id, user_id):
+    query = {"id": str(update_id), "from": user(user_id), "currency": "XTR", "total_amount": 1, "invoice_payload": "plan_pro"}
+    return {"update_id": update_id, "pre_checkout_query": query}
+
+
+def payment_update(update_id, user_id):
+    payment = {
+        "currency": "XTR", "total_amount": 1, "invoice_payload": "plan_pro",
+        "telegram_payment_charge_id": f"c{update_id}", "provider_payment_charge_id": f"p{update_id}",
+    }
+    return message_update(update_id, user_id, successful_payment=payment)
+
+
+def session(args, rng):
+    """Pasos de una sesión: (nombre, constructor del update, métodos que lo completan)."""
+    serie = f"s{rng.randrange(args.series)}"
+    steps = [
+        ("start", start_update, {"sendMessage"}),
+        ("play_video", f"play_video_{rng.randrange(args.videos)}", {"deleteMessage", "sendMessage"}),
+        ("serie_list", f"serie_list_{serie}", {"editMessageMedia", "sendMessage"}),
+    ]
+    for index in range(rng.randint(1, args.chapters)):
+        steps.append(("cap", f"cap_{serie}_{index}", {"sendVideo", "sendMessage"}))
+    if rng.random() < args.pay_fraction:
+        steps += [
+            ("comprar", "comprar_pro", {"sendInvoice"}),
+            ("pre_checkout", pre_checkout_update, {"answerPreCheckoutQuery"}),
+            ("payment", payment_update, {"sendMessage"}),
+        ]
+    return steps
+
+
+# --- Correlación de llamadas de la Bot API con el paso en curso ---
+class Step:
+    __slots__ = ("name", "until", "started", "future")
+
+    def __init__(self, name, until):
+        self.name = name
+        self.until = until
+        self.started = time.perf_counter()
+        self.future = asyncio.get_running_loop().create_future()
+
+    def finish(self, outcome):
+        if not self.future.done():
+            self.future.set_result((outcome, time.perf_counter() - self.started))
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.steps = {}        # {user_id: Step en curso}
+        self.query_users = {}  # {callback_query_id / pre_checkout_query_id: user_id}
+        self.latencies = {}    # {paso: [segundos]}
+        self.outcomes = Counter()
+        self.next_update_id = 1
+
+    def on_call(self, method, params, status):
+        user_id = self.query_users.get(params.get("callback_query_id") or params.get("pre_checkout_query_id"))
+        if user_id is None:
+            chat_id = str(params.get("chat_id", ""))
+            user_id = int(chat_id) if chat_id.lstrip("-").isdigit() else None
+        step = self.steps.get(user_id)
+        if step is None:
+            return
+        if status == 429:
+            step.finish("429")
+        elif method in step.until:
+            step.finish("ok")
+        elif method == "answerCallbackQuery" and params.get("text"):
+            step.finish("limitado")
+
+    def build(self, user_id, action):
+        update_id = self.next_update_id
+        self.next_update_id += 1
+        if callable(action):
+            update = action(update_id, user_id)
+        else:
+            update = callback_update(update_id, user_id, action)
+        if "callback_query" in update or "pre_checkout_query" in update:
+            self.query_users[str(update_id)] = user_id
+        return update_id, json.dumps(update).encode()
+
+    async def run_step(self, session_http, user_id, name, action, until):
+        update_id, body = self.build(user_id, action)
+        step = self.steps[user_id] = Step(name, until)
+        try:
+            async with session_http.post(self.webhook, data=body, headers=self.headers) as resp:
+                await resp.read()
+                if resp.status != 200:
+                    step.finish(f"http_{resp.status}")
+            outcome, elapsed = await asyncio.wait_for(step.future, self.args.timeout)
+        except asyncio.TimeoutError:
+            outcome, elapsed = "timeout", self.args.timeout
+        finally:
+            del self.steps[user_id]
+            self.query_users.pop(str(update_id), None)
+        self.outcomes[outcome] += 1
+        if outcome == "ok":
+            self.latencies.setdefault(name, []).append(elapsed)
+
+    async def virtual_user(self, session_http, user_id, deadline):
+        rng = random.Random(user_id)
+        while time.perf_counter() < deadline:
+            for name, action, until in session(self.args, rng):
+                if time.perf_counter() >= deadline:
+                    return
+                await self.run_step(session_http, user_id, name, action, until)
+                if self.args.think:
+                    await asyncio.sleep(rng.uniform(0, 2 * self.args.think))
+
+    async def run(self, session_http):
+        args = self.args
+        self.webhook = f"http://127.0.0.1:{args.port}/webhook"
+        self.headers = {
+            "X-Telegram-Bot-Api-Secret-Token": hashlib.sha256(TOKEN.encode()).hexdigest(),
+            "Content-Type": "application/json",
+        }
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(self.virtual_user(session_http, FIRST_USER + i, deadline) for i in range(args.users)))
+        return time.perf_counter() - started
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def report(test, elapsed, api):
+    completed = sum(test.outcomes.values())
+    print(f"\n{completed} pasos en {elapsed:.1f} s: {completed / elapsed:.1f} updates/s")
+    print("resultados: " + ", ".join(f"{outcome}={count}" for outcome, count in test.outcomes.most_common()))
+    print(f"\n{'paso':>14} {'n':>7} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'max (ms)':>9}")
+    everything = []
+    for name, values in sorted(test.latencies.items()) + [("total", everything)]:
+        if name != "total":
+            everything += values
+        values.sort()
+        print(
+            f"{name:>14} {len(values):>7} {percentile(values, 0.50) * 1000:>9.1f} {percentile(values, 0.95) * 1000:>9.1f}"
+            f" {percentile(values, 0.99) * 1000:>9.1f} {(values[-1] if values else 0) * 1000:>9.1f}"
+        )
+    calls = sum(api.counts.values())
+    print(f"\nllamadas a la Bot API: {calls} ({calls / elapsed:.1f}/s), 429: {sum(api.rate_limited.values())}")
+    for method, count in api.counts.most_common():
+        limited = api.rate_limited.get(method)
+        print(f"  {method:<24} {count:>8}" + (f"  (429: {limited})" if limited else ""))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50, help="usuarios virtuales concurrentes")
+    parser.add_argument("--duration", type=float, default=30.0, help="segundos de carga")
+    parser.add_argument("--think", type=float, default=0.0, help="pausa media entre pasos de un usuario (s)")
+    parser.add_argument("--timeout", type=float, default=10.0, help="espera máxima por paso (s)")
+    parser.add_argument("--chapters", type=int, default=4, help="capítulos vistos como máximo por sesión")
+    parser.add_argument("--pay-fraction", type=float, default=0.1, help="fracción de sesiones que compran un plan")
+    parser.add_argument("--videos", type=int, default=100)
+    parser.add_argument("--series", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=1, help="WEB_WORKERS del bot")
+    parser.add_argument("--flood-limit", action="store_true", help="mantener el límite de callbacks por usuario del bot")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="latencia simulada de la Bot API (s)")
+    parser.add_argument("--max-rps", type=int, default=0, help="envíos/s antes de que la Bot API falsa responda 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fracción de envíos con 429 al azar")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--port", type=int, default=18180)
+    parser.add_argument("--api-port", type=int, default=18170)
+    args = parser.parse_args()
+
+    api = FakeBotApi(args.api_latency, args.max_rps, args.error_rate, args.retry_after)
+    test = LoadTest(args)
+    api.on_call = test.on_call
+    api_runner = web.AppRunner(api.make_app(), access_log=None)
+    await api_runner.setup()
+    await web.TCPSite(api_runner, "127.0.0.1", args.api_port).start()
+
+    env = dict(
+        os.environ,
+        TOKEN=TOKEN,
+        PORT=str(args.port),
+        WEB_WORKERS=str(args.workers),
+        WORKER_BASE_PORT=str(args.port + 1),
+        TELEGRAM_API_URL=f"http://127.0.0.1:{args.api_port}",
+        SEED_VIDEOS=str(args.videos),
+        SEED_SERIES=str(args.series),
+        SEED_CHAPTERS=str(max(args.chapters, 1)),
+        UPDATE_QUEUE_MAXSIZE="100000",
+    )
+    if not args.flood_limit:
+        env.update(CALLBACK_RATE="1000000", CALLBACK_BURST="1000000")
+    bot_proc = subprocess.Popen(
+        [sys.executable, os.path.join(TOOLS, "run_fake_bot.py")],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        async with ClientSession() as session_http:
+            await wait_http(session_http, f"http://127.0.0.1:{args.port}/ping")
+            api.counts.clear()
+            print(f"{args.users} usuarios virtuales durante {args.duration:.0f} s (workers={args.workers}, "
+                  f"latencia API={args.api_latency * 1000:.0f} ms, max-rps={args.max_rps or '-'}, error-rate={args.error_rate})")
+            elapsed = await test.run(session_http)
+        report(test, elapsed, api)
+    finally:
+        bot_proc.send_signal(signal.SIGINT)
+        try:
+            bot_proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            bot_proc.kill()
+        await api_runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,249 @@
+"""Reproduce una grabación del webhook (WEBHOOK_RECORD_FILE) contra una instancia local.
+
+Arranca la Bot API falsa en este proceso y el bot con Firestore en memoria
+(tools/run_fake_bot.py), añadiendo al catálogo los videos y series que aparecen en la
+grabación. Después envía los updates al webhook respetando los tiempos de llegada
+grabados: --speed 1 en tiempo real, --speed N N veces más rápido y --speed 0 lo más
+rápido posible (con --concurrency peticiones en vuelo).
+
+Informa del ritmo conseguido, el retraso frente al horario grabado, la latencia de
+los POST y, leyendo /metrics del bot, el tiempo medio por handler. Con --output se
+añade un resumen en JSONL (con el commit) para comparar versiones con el mismo tráfico:
+
+    python tools/replay_webhook.py updates.jsonl --speed 1
+    python tools/replay_webhook.py updates.jsonl.0 updates.jsonl.1 --speed 10 --workers 2
+    python tools/replay_webhook.py updates.jsonl --speed 0 --output replays.jsonl
+
+Los usuarios grabados empiezan sin plan en la instancia local (los planes no se graban).
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from aiohttp import ClientSession, web
+
+from bench_workers import TOKEN, wait_http
+from fake_bot_api import FakeBotApi
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+VIDEO_RE = re.compile(r"(?:play_video_|video_)([A-Za-z0-9]+)")
+SERIE_RE = re.compile(r"(?:serie_list_|serie_)([A-Za-z0-9]+)")
+CHAPTER_RE = re.compile(r"cap_([A-Za-z0-9]+)_(\d+)")
+HANDLER_RE = re.compile(r'^bot_handler_seconds_(sum|count)\{handler="([^"]+)"\} (\S+)$')
+
+
+def load_records(paths):
+    records = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            records += [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda record: record["ts"])
+    return records
+
+
+def referenced_content(records):
+    # Catálogo mínimo para que la reproducción recorra los mismos caminos que en producción
+    videos, chapters = set(), {}
+    for record in records:
+        update = record["update"]
+        message = update.get("message") or {}
+        text = " ".join(filter(None, [(update.get("callback_query") or {}).get("data"), message.get("text")]))
+        videos.update(VIDEO_RE.findall(text))
+        for serie_id in SERIE_RE.findall(text):
+            chapters.setdefault(serie_id, 0)
+        for serie_id, index in CHAPTER_RE.findall(text):
+            chapters[serie_id] = max(chapters.get(serie_id, 0), int(index) + 1)
+    return {
+        "videos": {
+            pkg_id: {"photo_id": f"photo_{pkg_id}", "caption": f"Video {pkg_id}", "video_id": f"video_{pkg_id}"} for pkg_id in videos
+        },
+        "series_data": {
+            serie_id: {
+                "title": f"Serie {serie_id}",
+                "photo_id": f"sphoto_{serie_id}",
+                "caption": f"Serie {serie_id}",
+                "capitulos": [f"{serie_id}cap{c}" for c in range(max(count, 1))],
+            }
+            for serie_id, count in chapters.items()
+        },
+    }
+
+
+async def scrape_handlers(session, ports):
+    # {handler: [suma de segundos, updates]} sumando los workers
+    handlers = {}
+    for port in ports:
+        async with session.get(f"http://127.0.0.1:{port}/metrics") as resp:
+            text = await resp.text()
+        for line in text.splitlines():
+            match = HANDLER_RE.match(line)
+            if match:
+                kind, handler, value = match.groups()
+                totals = handlers.setdefault(handler, [0.0, 0])
+                if kind == "sum":
+                    totals[0] += float(value)
+                else:
+                    totals[1] += int(float(value))
+    return handlers
+
+
+async def replay(session, records, args):
+    webhook = f"http://127.0.0.1:{args.port}/webhook"
+    headers = {
+        "X-Telegram-Bot-Api-Secret-Token": hashlib.sha256(TOKEN.encode()).hexdigest(),
+        "Content-Type": "application/json",
+    }
+    sem = asyncio.Semaphore(args.concurrency)
+    post_latencies, lags, statuses = [], [], {}
+
+    async def send(body):
+        async with sem:
+            started = time.perf_counter()
+            async with session.post(webhook, data=body, headers=headers) as resp:
+                await resp.read()
+                statuses[resp.status] = statuses.get(resp.status, 0) + 1
+            post_latencies.append(time.perf_counter() - started)
+
+    first_ts = records[0]["ts"]
+    started = time.perf_counter()
+    tasks = []
+    for record in records:
+        body = json.dumps(record["update"]).encode()
+        if args.speed > 0:
+            target = started + (record["ts"] - first_ts) / args.speed
+            delay = target - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            lags.append(max(0.0, time.perf_counter() - target))
+        tasks.append(asyncio.create_task(send(body)))
+    await asyncio.gather(*tasks)
+    return time.perf_counter() - started, sorted(post_latencies), sorted(lags), statuses
+
+
+async def wait_quiet(api, quiet=1.0):
+    # Terminado cuando la Bot API falsa deja de recibir llamadas
+    last_total, last_change = -1, time.perf_counter()
+    while time.perf_counter() - last_change < quiet:
+        total = sum(api.counts.values())
+        if total != last_total:
+            last_total, last_change = total, time.perf_counter()
+        await asyncio.sleep(0.1)
+    return last_change
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=TOOLS, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="grabaciones JSONL (varias se mezclan por tiempo de llegada)")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = tiempo real, N = N veces más rápido, 0 = máximo")
+    parser.add_argument("--concurrency", type=int, default=256, help="peticiones webhook en vuelo como máximo")
+    parser.add_argument("--workers", type=int, default=1, help="WEB_WORKERS del bot")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="latencia simulada de la Bot API (s)")
+    parser.add_argument("--output", default="", help="JSONL al que añadir el resumen de la reproducción")
+    parser.add_argument("--port", type=int, default=18280)
+    parser.add_argument("--api-port", type=int, default=18270)
+    args = parser.parse_args()
+
+    records = load_records(args.files)
+    if not records:
+        sys.exit("grabación vacía")
+    span = records[-1]["ts"] - records[0]["ts"]
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as seed_file:
+        json.dump(referenced_content(records), seed_file)
+
+    api = FakeBotApi(args.api_latency)
+    api_runner = web.AppRunner(api.make_app(), access_log=None)
+    await api_runner.setup()
+    await web.TCPSite(api_runner, "127.0.0.1", args.api_port).start()
+    env = dict(
+        os.environ,
+        TOKEN=TOKEN,
+        PORT=str(args.port),
+        WEB_WORKERS=str(args.workers),
+        WORKER_BASE_PORT=str(args.port + 1),
+        TELEGRAM_API_URL=f"http://127.0.0.1:{args.api_port}",
+        SEED_CATALOG=seed_file.name,
+        WEBHOOK_RECORD_FILE="",
+    )
+    bot_proc = subprocess.Popen(
+        [sys.executable, os.path.join(TOOLS, "run_fake_bot.py")],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        async with ClientSession() as session:
+            metrics_ports = [args.port] if args.workers == 1 else [args.port + 1 + i for i in range(args.workers)]
+            for port in metrics_ports:
+                await wait_http(session, f"http://127.0.0.1:{port}/ping")
+            api.counts.clear()
+            speed = "máxima" if args.speed <= 0 else f"{args.speed:g}x"
+            print(f"{len(records)} updates grabados en {span:.1f} s, velocidad {speed}")
+
+            started = time.perf_counter()
+            sent_in, post_latencies, lags, statuses = await replay(session, records, args)
+            drained = await wait_quiet(api) - started
+            handlers = await scrape_handlers(session, metrics_ports)
+    finally:
+        bot_proc.send_signal(signal.SIGINT)
+        try:
+            bot_proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            bot_proc.kill()
+        await api_runner.cleanup()
+        os.unlink(seed_file.name)
+
+    calls = sum(api.counts.values())
+    print(f"enviados en {sent_in:.1f} s ({len(records) / sent_in:.1f} updates/s), procesados en {drained:.1f} s")
+    print("respuestas del webhook: " + ", ".join(f"{status}={count}" for status, count in sorted(statuses.items())))
+    if lags:
+        print(f"retraso frente a la grabación: p50 {percentile(lags, 0.5) * 1000:.1f} ms, p99 {percentile(lags, 0.99) * 1000:.1f} ms")
+    print(
+        f"latencia POST /webhook: p50 {percentile(post_latencies, 0.5) * 1000:.1f} ms, "
+        f"p95 {percentile(post_latencies, 0.95) * 1000:.1f} ms, p99 {percentile(post_latencies, 0.99) * 1000:.1f} ms"
+    )
+    print(f"llamadas a la Bot API: {calls}")
+    print(f"\n{'handler':>34} {'updates':>8} {'media (ms)':>11}")
+    for handler, (total, count) in sorted(handlers.items(), key=lambda item: -item[1][0]):
+        print(f"{handler:>34} {count:>8} {total / max(count, 1) * 1000:>11.2f}")
+
+    if args.output:
+        summary = {
+            "ts": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "files": args.files,
+            "updates": len(records),
+            "speed": args.speed,
+            "workers": args.workers,
+            "sent_s": round(sent_in, 3),
+            "drained_s": round(drained, 3),
+            "post_p50_ms": round(percentile(post_latencies, 0.5) * 1000, 3),
+            "post_p99_ms": round(percentile(post_latencies, 0.99) * 1000, 3),
+            "api_calls": calls,
+            "handlers_ms": {handler: round(total / max(count, 1) * 1000, 3) for handler, (total, count) in handlers.items()},
+        }
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(json.dumps(summary) + "\n")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
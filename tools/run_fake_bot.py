@@ -0,0 +1,48 @@
+"""Arranca bot.py contra Firestore en memoria con un catálogo de prueba.
+
+Se configura con las mismas variables de entorno que bot.py (PORT, WEB_WORKERS,
+TELEGRAM_API_URL apuntando a tools/fake_bot_api.py, ...) más:
+    SEED_VIDEOS    videos individuales de prueba (por defecto 100)
+    SEED_SERIES    series de prueba (por defecto 20, con SEED_CHAPTERS capítulos)
+    SEED_CHAPTERS  capítulos por serie (por defecto 12)
+    SEED_CATALOG   JSON opcional {colección: {doc_id: documento}} que se añade al catálogo
+                   (tools/replay_webhook.py lo genera con el contenido de una grabación)
+
+    TELEGRAM_API_URL=http://127.0.0.1:8081 WEB_WORKERS=2 python tools/run_fake_bot.py
+"""
+import asyncio
+import json
+import os
+
+from fakes import install_fakes
+
+
+def seed(client):
+    videos = client.data.setdefault("videos", {})
+    for i in range(int(os.getenv("SEED_VIDEOS", "100"))):
+        videos[str(i)] = {"photo_id": f"photo{i}", "caption": f"Video {i}", "video_id": f"video{i}"}
+    series = client.data.setdefault("series_data", {})
+    chapters = int(os.getenv("SEED_CHAPTERS", "12"))
+    for i in range(int(os.getenv("SEED_SERIES", "20"))):
+        series[f"s{i}"] = {
+            "title": f"Serie {i}",
+            "photo_id": f"sphoto{i}",
+            "caption": f"Serie {i}",
+            "capitulos": [f"s{i}cap{c}" for c in range(chapters)],
+        }
+    if os.getenv("SEED_CATALOG"):
+        with open(os.environ["SEED_CATALOG"], encoding="utf-8") as f:
+            for collection, docs in json.load(f).items():
+                client.data.setdefault(collection, {}).update(docs)
+
+
+# A nivel de módulo: los workers (multiprocessing spawn) reimportan este archivo
+seed(install_fakes())
+
+import bot  # noqa: E402
+
+if __name__ == "__main__":
+    if bot.WEB_WORKERS > 1:
+        bot.run_workers()
+    else:
+        asyncio.run(bot.main())
@@ -0,0 +1,100 @@
+"""Resumen de las trazas JSONL que escribe bot.py con TRACE_FILE.
+
+Para cada handler muestra cuántas trazas hay, su p50/p95 y en qué se va el tiempo
+del camino crítico: webhook, cola, Bot API, Firestore y CPU propia del handler
+(el resto del handler una vez descontadas sus llamadas). Después lista las trazas
+más lentas con sus spans más largos.
+
+    python tools/trace_summary.py traces.jsonl --top 10
+"""
+import argparse
+import json
+from collections import defaultdict
+
+PHASES = ("webhook", "queue_wait", "bot_api", "storage", "handler_cpu")
+
+
+def union_ms(intervals):
+    # Duración de la unión de intervalos: llamadas en paralelo no cuentan doble
+    total, end = 0.0, float("-inf")
+    for start, stop in sorted(intervals):
+        if stop <= end:
+            continue
+        total += stop - max(start, end)
+        end = stop
+    return total
+
+
+def breakdown(trace):
+    phases = dict.fromkeys(PHASES, 0.0)
+    calls = defaultdict(list)
+    handler = 0.0
+    for span in trace["spans"]:
+        start, stop = span["start_ms"], span["start_ms"] + span["duration_ms"]
+        kind = span["name"].split(":", 1)[0]
+        if kind in ("webhook", "queue_wait"):
+            phases[kind] += span["duration_ms"]
+        elif kind == "handler":
+            handler += span["duration_ms"]
+        else:
+            calls[kind].append((start, stop))
+    for kind, intervals in calls.items():
+        phases[kind] = union_ms(intervals)
+    io = union_ms([interval for intervals in calls.values() for interval in intervals])
+    phases["handler_cpu"] = max(0.0, handler - io)
+    return phases
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def load(paths):
+    traces = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            traces.extend(json.loads(line) for line in f if line.strip())
+    return traces
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--top", type=int, default=5, help="trazas más lentas a detallar")
+    parser.add_argument("--handler", help="solo este handler (p. ej. handle_callback:cap)")
+    args = parser.parse_args()
+
+    traces = [t for t in load(args.files) if not args.handler or t["handler"] == args.handler]
+    if not traces:
+        print("Sin trazas.")
+        return
+
+    by_handler = defaultdict(list)
+    for trace in traces:
+        by_handler[trace["handler"]].append(trace)
+
+    header = f"{'handler':>32} {'n':>6} {'p50 ms':>8} {'p95 ms':>8}  " + " ".join(f"{p:>11}" for p in PHASES)
+    print(header)
+    for handler, group in sorted(by_handler.items(), key=lambda item: -len(item[1])):
+        durations = [t["duration_ms"] for t in group]
+        totals = dict.fromkeys(PHASES, 0.0)
+        for trace in group:
+            for phase, value in breakdown(trace).items():
+                totals[phase] += value
+        spent = sum(totals.values()) or 1.0
+        shares = " ".join(f"{totals[p] / spent * 100:>10.0f}%" for p in PHASES)
+        print(f"{handler:>32} {len(group):>6} {percentile(durations, 0.5):>8.1f} {percentile(durations, 0.95):>8.1f}  {shares}")
+
+    print(f"\nTrazas más lentas ({min(args.top, len(traces))}):")
+    for trace in sorted(traces, key=lambda t: -t["duration_ms"])[:args.top]:
+        phases = breakdown(trace)
+        parts = ", ".join(f"{p} {phases[p]:.0f}" for p in PHASES if phases[p] >= 0.5)
+        print(f"  {trace['trace_id']} update {trace['update_id']} {trace['handler']}: {trace['duration_ms']:.0f} ms ({parts})")
+        spans = [s for s in trace["spans"] if ":" in s["name"]]
+        for span in sorted(spans, key=lambda s: -s["duration_ms"])[:3]:
+            print(f"      {span['name']:<40} +{span['start_ms']:.0f} ms  {span['duration_ms']:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()